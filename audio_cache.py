@@ -0,0 +1,249 @@
+import asyncio
+import collections
+import glob
+import os
+import re
+
+from cache import TTLCache
+from instrumentation import increment
+from prefetch import song_url
+
+# directory downloaded audio is kept in; the cache is disabled when unset
+AUDIO_CACHE_DIR = os.environ.get('AUDIO_CACHE_DIR')
+
+# total size of the cached files in bytes before the least recently played ones are deleted
+AUDIO_CACHE_SIZE = int(os.environ.get('AUDIO_CACHE_SIZE', 2 * 1024 ** 3))
+
+# number of plays, counting loops, after which a song is downloaded
+MIN_PLAYS_TO_CACHE = 2
+
+# number of uncached songs whose plays are counted, and how long in seconds a count is kept
+PLAY_HISTORY = 4096
+PLAY_HISTORY_TTL = 7 * 24 * 3600
+
+# songs longer than this many seconds, or of unknown length, are never downloaded
+MAX_CACHED_DURATION = 20 * 60
+
+# seconds a download may take
+DOWNLOAD_TIMEOUT = 300
+
+# Opus in webm can be played without transcoding, so it is preferred
+CACHE_FORMAT = 'bestaudio[acodec=opus]/bestaudio'
+
+# marks files that are still being downloaded
+PARTIAL_MARKER = '.download'
+
+# keys are used as file names, so only plain video ids are cached
+CACHEABLE_KEY = re.compile(r'[\w-]+')
+
+
+def download_options(opts, directory):
+    """
+    Builds the options of the YoutubeDL that downloads into the cache
+
+    yt_dlp reads the format when the YoutubeDL is built, so it cannot be
+    changed per download; downloads get a pool of their own built with it.
+
+    Args:
+        opts (dict): options of the bot's other extractions
+        directory (str): where the files are kept
+
+    Returns:
+        dict: options passed to yt_dlp.YoutubeDL
+    """
+    # files are named after their video id, which is the song's key
+    template = os.path.join(directory.replace('%', '%%'), f'%(id)s{PARTIAL_MARKER}.%(ext)s')
+    return dict(opts, format=CACHE_FORMAT, outtmpl={'default': template}, noplaylist=True)
+
+
+class AudioCache:
+    """
+    Size limited directory of downloaded audio for frequently played songs
+
+    Songs are downloaded in the background once they have been played
+    MIN_PLAYS_TO_CACHE times, and later plays read the local file instead
+    of streaming from the origin. Files are named after their video id,
+    so a directory of fixture files works without a network. When the
+    directory grows past its size limit, the least recently played files
+    are deleted.
+
+    ...
+
+    Attributes
+    ----------
+    directory : str
+        where the files are kept
+    max_bytes : int
+        total size of the files before old ones are deleted
+    downloader : extraction.ExtractionService
+        downloads songs, built with download_options; without one, only files already in the directory are played
+    files : collections.OrderedDict
+        maps video ids to (path, size), least recently played first
+    plays : cache.TTLCache
+        number of times recent uncached songs were played
+    downloads : dict
+        maps video ids to running download tasks
+
+    Methods
+    -------
+    path(song)
+        Returns the local file of a song
+    played(song)
+        Counts a play and downloads the song once it is played often enough
+    stats()
+        Returns the size of the cache
+    close()
+        Stops running downloads
+    """
+    def __init__(self, directory, downloader=None, max_bytes=AUDIO_CACHE_SIZE, min_plays=MIN_PLAYS_TO_CACHE):
+        """
+        Args:
+            directory (str): where the files are kept
+            downloader (extraction.ExtractionService, optional): downloads songs. Defaults to None.
+            max_bytes (int, optional): total size of the files. Defaults to AUDIO_CACHE_SIZE.
+            min_plays (int, optional): plays before a song is downloaded. Defaults to MIN_PLAYS_TO_CACHE.
+        """
+        self.directory = directory
+        self.downloader = downloader
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.files = collections.OrderedDict()
+        self.plays = TTLCache(PLAY_HISTORY, PLAY_HISTORY_TTL)
+        self.downloads = {}
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """
+        Indexes the files already in the directory, oldest modification first
+        """
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            # leftovers of downloads interrupted by a restart
+            if PARTIAL_MARKER in entry.name:
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime, entry.name.split('.', 1)[0], entry.path, stat.st_size))
+        for _, key, path, size in sorted(found):
+            self._add(key, path, size)
+
+    def _add(self, key, path, size):
+        """
+        Indexes a file and deletes the least recently played files while the cache is too big
+
+        Args:
+            key (str): video id
+            path (str): location of the file
+            size (int): size of the file in bytes
+        """
+        if key in self.files:
+            self._remove(key)
+        self.files[key] = (path, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.files) > 1:
+            self._remove(next(iter(self.files)))
+            increment('audio_cache_evictions_total')
+
+    def _remove(self, key):
+        """
+        Deletes a cached file
+
+        Args:
+            key (str): video id
+        """
+        path, size = self.files.pop(key)
+        self.size -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def path(self, song):
+        """
+        Returns the local file of a song and marks it as recently played
+
+        Args:
+            song (track.Track): queued song
+
+        Returns:
+            str: location of the file, or None if the song is not cached
+        """
+        cached = self.files.get(song.id)
+        if cached is None:
+            increment('audio_cache_misses_total')
+            return None
+        self.files.move_to_end(song.id)
+        increment('audio_cache_hits_total')
+        # the modification time keeps the recency order across restarts
+        try:
+            os.utime(cached[0])
+        except OSError:
+            pass
+        return cached[0]
+
+    def played(self, song):
+        """
+        Counts a play and downloads the song in the background once it is played often enough
+
+        Args:
+            song (track.Track): the song that started
+        """
+        key = song.id
+        if self.downloader is None or not key or not CACHEABLE_KEY.fullmatch(key):
+            return
+        if key in self.files or key in self.downloads:
+            return
+        if not song.duration or song.duration > MAX_CACHED_DURATION:
+            return
+        plays = self.plays.get(key, 0) + 1
+        self.plays.set(key, plays)
+        if plays >= self.min_plays:
+            task = asyncio.create_task(self._download(song))
+            self.downloads[key] = task
+            task.add_done_callback(lambda _: self.downloads.pop(key, None))
+
+    async def _download(self, song):
+        """
+        Downloads a song and adds it to the cache
+
+        Args:
+            song (track.Track): song to download
+        """
+        key = song.id
+        try:
+            info = await self.downloader.extract_info(song_url(song), download=True)
+            partial = info['requested_downloads'][0]['filepath']
+            path = os.path.join(self.directory, f'{key}.{info["ext"]}')
+            os.replace(partial, path)
+            self._add(key, path, os.path.getsize(path))
+            self.plays.pop(key, None)
+            increment('audio_cache_downloads_total')
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            print(f'Could not cache {song.title}: {error}')
+            increment('audio_cache_download_errors_total')
+            for partial in glob.glob(os.path.join(glob.escape(self.directory), f'{key}{PARTIAL_MARKER}.*')):
+                os.remove(partial)
+
+    def stats(self):
+        """
+        Returns the size of the cache
+
+        Returns:
+            dict: number of files, bytes used and running downloads
+        """
+        return {'files': len(self.files), 'bytes': self.size, 'downloads': len(self.downloads)}
+
+    def close(self):
+        """
+        Stops running downloads and the downloader
+        """
+        for task in self.downloads.values():
+            task.cancel()
+        if self.downloader is not None:
+            self.downloader.shutdown()
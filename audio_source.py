@@ -0,0 +1,157 @@
+import asyncio
+import collections
+import os
+import threading
+import time
+
+from discord import AudioSource
+from discord.opus import Encoder
+
+from instrumentation import histogram
+
+# number of frames decoded ahead of time when a source is warmed, 20 ms each
+WARM_FRAMES = 50
+
+# seconds a source may take to produce its first frames while warming
+WARM_TIMEOUT = 15
+
+# seconds of audio in one frame
+FRAME_SECONDS = Encoder.FRAME_LENGTH / 1000
+
+
+def find_process(source):
+    """
+    Finds the ffmpeg process behind a chain of wrapped sources
+
+    Args:
+        source (discord.AudioSource): outermost source
+
+    Returns:
+        subprocess.Popen: the ffmpeg process, or None
+    """
+    while source is not None:
+        process = getattr(source, '_process', None)
+        if process:
+            return process
+        source = getattr(source, 'original', None)
+    return None
+
+
+def process_cpu_seconds(pid):
+    """
+    Reads the CPU time a process has used so far
+
+    Args:
+        pid (int): id of the process
+
+    Returns:
+        float: user and system time in seconds, or None where /proc is unavailable
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            # the command name in field 2 may contain spaces, so fields are counted after it
+            fields = file.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class WarmSource(AudioSource):
+    """
+    Wraps a source so it can start decoding before it is played
+
+    Warming reads the first frames off the event loop, which waits for
+    ffmpeg to start and connect to the stream. Once warmed, the player
+    thread's first reads are answered from memory, so swapping to this
+    source does not leave a gap. The source also counts the frames
+    played, which gives the playback position.
+
+    ...
+
+    Attributes
+    ----------
+    original : discord.AudioSource
+        the wrapped source
+    frames : int
+        number of frames handed to the player
+    start : float
+        seconds into the song at which the source starts
+
+    Methods
+    -------
+    warm(frames)
+        Decodes the first frames ahead of time
+    read()
+        Returns the next frame
+    is_opus()
+        Whether the wrapped source produces Opus packets
+    cleanup()
+        Cleans up the wrapped source and records how much CPU its process used
+    """
+    def __init__(self, original, start=0.0):
+        """
+        Args:
+            original (discord.AudioSource): the source to wrap
+            start (float, optional): seconds into the song at which the source starts. Defaults to 0.0.
+        """
+        self.original = original
+        self.start = start
+        self.frames = 0
+        self._buffer = collections.deque()
+        # warming and the player thread may read at the same time
+        self._lock = threading.Lock()
+        self._created = time.perf_counter()
+        self._process = find_process(original)
+
+    @property
+    def position(self):
+        """
+        float: seconds into the song of the last frame handed to the player
+        """
+        return self.start + self.frames * FRAME_SECONDS
+
+    def _fill(self, frames):
+        """
+        Reads frames into the buffer, stopping early at the end of the stream
+
+        Args:
+            frames (int): number of frames to read
+        """
+        with self._lock:
+            while len(self._buffer) < frames:
+                data = self.original.read()
+                self._buffer.append(data)
+                if not data:
+                    break
+        histogram('ffmpeg_warm_seconds').observe(time.perf_counter() - self._created)
+
+    async def warm(self, frames=WARM_FRAMES):
+        """
+        Decodes the first frames ahead of time without blocking the event loop
+
+        Args:
+            frames (int, optional): number of frames to decode. Defaults to WARM_FRAMES.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.wait_for(loop.run_in_executor(None, self._fill, frames), WARM_TIMEOUT)
+
+    def read(self):
+        with self._lock:
+            data = self._buffer.popleft() if self._buffer else self.original.read()
+        if data:
+            self.frames += 1
+        return data
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        if self._process is not None:
+            cpu = process_cpu_seconds(self._process.pid)
+            if cpu is not None:
+                histogram('ffmpeg_cpu_seconds').observe(cpu)
+                if self.frames:
+                    # fraction of a core used per second of audio
+                    histogram('ffmpeg_cpu_per_audio_second').observe(cpu / (self.frames * FRAME_SECONDS))
+            self._process = None
+        self.original.cleanup()
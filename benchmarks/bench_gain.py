@@ -0,0 +1,98 @@
+"""
+Compares discord.PCMVolumeTransformer with loudness.GainSource on CPU time and
+memory allocated per second of audio
+
+GainSource uses NumPy when it is installed and audioop otherwise; the backend in
+use is printed. Allocations are measured with tracemalloc in a separate pass so
+they do not skew the timings.
+
+Run from the repository root:
+
+    python benchmarks/bench_gain.py
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+
+import loudness
+from audio_source import FRAME_SECONDS
+from loudness import GainSource
+from music import VOLUME_CONTROL
+
+AUDIO_SECONDS = 60
+FRAMES = int(AUDIO_SECONDS / FRAME_SECONDS)
+
+
+class FakePCM(discord.AudioSource):
+    """
+    Source that cycles through a few frames of noise at different levels, like an ffmpeg pipe that is always ready
+    """
+    def __init__(self):
+        self.frames = []
+        for level in (500, 4000, 16000):
+            samples = [random.randint(-level, level) for _ in range(loudness.FRAME_SAMPLES)]
+            self.frames.append(b''.join(sample.to_bytes(2, 'little', signed=True) for sample in samples))
+        self.index = 0
+
+    def read(self):
+        self.index = (self.index + 1) % len(self.frames)
+        return self.frames[self.index]
+
+
+def cpu_per_second(source):
+    """
+    Times reading AUDIO_SECONDS of audio through a source
+
+    Args:
+        source (discord.AudioSource): source to read from
+
+    Returns:
+        float: CPU microseconds per second of audio
+    """
+    start = time.process_time()
+    for _ in range(FRAMES):
+        source.read()
+    return (time.process_time() - start) / AUDIO_SECONDS * 1e6
+
+
+def allocated_per_second(source):
+    """
+    Adds up the memory allocated while reading each frame through a source
+
+    Args:
+        source (discord.AudioSource): source to read from
+
+    Returns:
+        float: KiB allocated per second of audio
+    """
+    total = 0
+    tracemalloc.start()
+    for _ in range(FRAMES):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        source.read()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / AUDIO_SECONDS / 1024
+
+
+def main():
+    print(f"GainSource backend: {'numpy' if loudness.numpy is not None else 'audioop'}")
+    sources = (
+        ('PCMVolumeTransformer', lambda: discord.PCMVolumeTransformer(FakePCM(), VOLUME_CONTROL)),
+        ('GainSource', lambda: GainSource(FakePCM(), VOLUME_CONTROL, normalize=False)),
+        ('GainSource normalized', lambda: GainSource(FakePCM(), VOLUME_CONTROL, normalize=True)),
+    )
+    print(f"{'source':<24}{'cpu us/audio s':>16}{'KiB/audio s':>14}")
+    for name, make in sources:
+        print(f'{name:<24}{cpu_per_second(make()):>16.0f}{allocated_per_second(make()):>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
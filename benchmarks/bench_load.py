@@ -0,0 +1,176 @@
+"""
+Load test of the Music cog and the discord_bot commands against a fake gateway and a fake yt_dlp
+
+Simulates many guilds issuing play/add/queue/skip commands at a given rate and reports
+command latency percentiles, event loop lag, memory per guild and time to first audio.
+
+Run from the repository root, eg.:
+
+    python benchmarks/bench_load.py --guilds 200 --rate 0.5 --duration 20 --latency 0.3
+
+The EXTRACTOR_WORKERS and EXTRACTOR_MODE environment variables size the extraction pool as usual.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extraction
+import instrumentation
+from audio_source import WarmSource
+from fakes import FakeAudioSource, FakeBot, FakeContext, FakeGuild, FakeVoiceClient, FakeYoutubeDL
+
+# relative weights of the commands each simulated user sends
+COMMAND_MIX = {'add': 4, 'play': 2, 'queue': 2, 'skip': 1, 'flip': 1}
+
+# interval of the event loop lag probe in seconds
+LAG_PROBE_INTERVAL = 0.01
+
+
+def percentile(samples, fraction):
+    """
+    Returns a percentile of a list of samples
+
+    Args:
+        samples (list): measured values
+        fraction (float): percentile between 0 and 1
+
+    Returns:
+        float: the percentile, or 0 for no samples
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+async def probe_lag(samples):
+    """
+    Measures how late the event loop wakes up a sleeping task
+
+    Args:
+        samples (list): receives the lag of every probe in seconds
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        samples.append(loop.time() - start - LAG_PROBE_INTERVAL)
+
+
+async def run_command(cog, bot_module, ctx, name):
+    """
+    Invokes one command the way the bot would after parsing a message
+
+    Args:
+        cog (music.Music): the music cog
+        bot_module (module): the discord_bot module
+        ctx (fakes.FakeContext): context of the command
+        name (str): command to run
+    """
+    if name == 'flip':
+        await bot_module.flip.callback(ctx)
+    elif name in ('add', 'play'):
+        query = f'song {random.randrange(1000)}'
+        await getattr(cog, name).callback(cog, ctx, *query.split())
+    else:
+        await getattr(cog, name).callback(cog, ctx)
+
+
+async def simulate_guild(cog, bot_module, guild, rate, deadline, latencies, errors):
+    """
+    Issues commands for one guild until the deadline
+
+    Args:
+        cog (music.Music): the music cog
+        bot_module (module): the discord_bot module
+        guild (fakes.FakeGuild): the guild
+        rate (float): average commands per second
+        deadline (float): perf_counter time at which to stop
+        latencies (dict): receives command latencies in seconds by command name
+        errors (list): receives exceptions raised by commands
+    """
+    ctx = FakeContext(cog.bot, guild)
+    names, weights = zip(*COMMAND_MIX.items())
+    name = 'play'
+    guild.started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            await run_command(cog, bot_module, ctx, name)
+        except Exception as error:
+            errors.append(error)
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+        await asyncio.sleep(random.expovariate(rate))
+        name = random.choices(names, weights)[0]
+
+
+async def main(args):
+    FakeYoutubeDL.latency = args.latency
+    FakeVoiceClient.song_length = args.song_length
+    FakeYoutubeDL.duration = args.song_length
+    extraction.load_yt_dlp().YoutubeDL = FakeYoutubeDL
+
+    import discord_bot
+    import music
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    cog = music.Music(FakeBot())
+    # the fake voice client never reads audio, so ffmpeg is not needed
+    cog.create_audio_source = lambda source, volume=1.0, start=0: WarmSource(FakeAudioSource(), start)
+    guilds = [FakeGuild() for _ in range(args.guilds)]
+
+    lag = []
+    lag_task = asyncio.create_task(probe_lag(lag))
+    latencies = {}
+    errors = []
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(*(simulate_guild(cog, discord_bot, guild, args.rate, deadline, latencies, errors)
+                           for guild in guilds))
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    lag_task.cancel()
+    tracemalloc.stop()
+
+    first_audio = [guild.first_audio - guild.started for guild in guilds if guild.first_audio]
+    all_latencies = [value for values in latencies.values() for value in values]
+
+    print(f'{args.guilds} guilds, {args.rate} commands/s each, {args.duration}s, '
+          f'{args.latency * 1000:.0f} ms extraction latency')
+    print(f"{'command':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, values in sorted(latencies.items()) + [('all', all_latencies)]:
+        print(f'{name:<10}{len(values):>8}{percentile(values, 0.5) * 1000:>10.1f}'
+              f'{percentile(values, 0.95) * 1000:>10.1f}{percentile(values, 0.99) * 1000:>10.1f}'
+              f'{max(values) * 1000:>10.1f}')
+    print(f'event loop lag: p50 {percentile(lag, 0.5) * 1000:.2f} ms, p99 {percentile(lag, 0.99) * 1000:.2f} ms, '
+          f'max {max(lag) * 1000:.2f} ms')
+    print(f'memory: {memory / args.guilds / 1024:.1f} KiB per guild')
+    if first_audio:
+        print(f'time to first audio: p50 {percentile(first_audio, 0.5) * 1000:.0f} ms, '
+              f'p95 {percentile(first_audio, 0.95) * 1000:.0f} ms ({len(first_audio)}/{args.guilds} guilds)')
+    print(f'extractions: {FakeYoutubeDL.calls}, errors: {len(errors)}')
+    api_calls = sum(guild.text_channel.api_calls for guild in guilds)
+    requests = sum(count for (name, _), count in instrumentation.counters.items() if name == 'outbox_requests_total')
+    print(f'discord API calls: {api_calls}, messages and edits requested through outboxes: {requests}')
+    for error in errors[:5]:
+        print(f'  {error!r}')
+
+    for guild in guilds:
+        if guild.voice_client:
+            await cog.disconnect(guild)
+    await cog.cog_unload()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=100, help='number of simulated guilds')
+    parser.add_argument('--rate', type=float, default=0.5, help='commands per second per guild')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run for')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds every extraction takes')
+    parser.add_argument('--song-length', type=float, default=2.0, help='seconds every song plays for')
+    asyncio.run(main(parser.parse_args()))
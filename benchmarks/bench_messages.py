@@ -0,0 +1,116 @@
+"""
+Measures how many messages per second on_message handles with the router's prefix filter and without it
+
+The unfiltered handler is the one the bot used before the router: it rolls
+random.randint for every message and sends every message through
+process_commands. Most traffic is plain chat, so the mix is mostly messages
+without the prefix plus a few commands.
+
+Run from the repository root:
+
+    python benchmarks/bench_messages.py --messages 200000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord_bot
+from fakes import FakeGuild
+
+# share of messages that are commands
+COMMAND_SHARE = 0.02
+
+
+async def unfiltered_on_message(message):
+    """
+    on_message as it was before the router, without its timer
+
+    Args:
+        message (types.SimpleNamespace): fake message
+    """
+    if message.author == discord_bot.client.user:
+        return
+    if random.randint(0, discord_bot.SECRET_MESSAGE_PROC) == 0:
+        emotes = message.guild.emojis
+        sent = await message.channel.send(discord_bot.SECRET_MESSAGE)
+        if emotes:
+            await sent.add_reaction(emotes[random.randint(0, len(emotes) - 1)])
+    await discord_bot.client.process_commands(message)
+
+
+async def filtered_on_message(message):
+    """
+    The router's path without the handler timer, so both handlers are compared like for like
+
+    Args:
+        message (types.SimpleNamespace): fake message
+    """
+    if message.author == discord_bot.client.user:
+        return
+    await discord_bot.router.dispatch(message)
+
+
+def make_messages(count, guilds):
+    """
+    Builds the fake messages both handlers are fed
+
+    Args:
+        count (int): number of messages
+        guilds (list): fake guilds the messages come from
+
+    Returns:
+        list: fake messages
+    """
+    state = discord_bot.client._connection
+    author = SimpleNamespace(id=1, bot=False)
+    messages = []
+    for _ in range(count):
+        guild = random.choice(guilds)
+        content = '.flip' if random.random() < COMMAND_SHARE else 'just chatting about the game last night'
+        messages.append(SimpleNamespace(content=content, author=author, guild=guild, channel=guild.text_channel,
+                                        _state=state, id=0, attachments=[]))
+    return messages
+
+
+async def throughput(handler, messages):
+    """
+    Feeds every message to a handler
+
+    Args:
+        handler (callable): on_message implementation
+        messages (list): fake messages
+
+    Returns:
+        float: messages handled per second
+    """
+    start = time.perf_counter()
+    for message in messages:
+        await handler(message)
+    return len(messages) / (time.perf_counter() - start)
+
+
+async def main(args):
+    # the bot is never logged in, so it gets the loop and user that logging in would set
+    discord_bot.client.loop = asyncio.get_running_loop()
+    discord_bot.client._connection.user = SimpleNamespace(id=0, bot=True)
+    guilds = [FakeGuild() for _ in range(50)]
+    messages = make_messages(args.messages, guilds)
+    print(f'{args.messages} messages, {COMMAND_SHARE:.0%} commands')
+    print(f"{'handler':<12}{'messages/s':>14}{'us/message':>14}")
+    for name, handler in (('unfiltered', unfiltered_on_message), ('filtered', filtered_on_message)):
+        rate = await throughput(handler, messages)
+        print(f'{name:<12}{rate:>14.0f}{1e6 / rate:>14.2f}')
+    sent = sum(len(guild.text_channel.sent) for guild in guilds)
+    print(f'messages sent by both handlers, secret messages and flips: {sent}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100000, help='number of messages fed to each handler')
+    asyncio.run(main(parser.parse_args()))
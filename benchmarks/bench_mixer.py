@@ -0,0 +1,134 @@
+"""
+Plays a stream with network hiccups in real time, directly and through mixer.Mixer,
+and counts the frames that reached the voice client late
+
+A frame read later than its 20 ms slot is a stutter on the direct path. The
+mixer reads ahead into its ring buffer, so hiccups shorter than the buffer
+only show up as underruns once they outlast it. The CPU cost of a read and of
+one crossfade is measured separately; the mixer uses NumPy when it is
+installed and audioop otherwise.
+
+Run from the repository root:
+
+    python benchmarks/bench_mixer.py --seconds 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+
+import mixer
+from audio_source import FRAME_SECONDS
+from mixer import Mixer
+
+# frames read when measuring the CPU cost of a read
+COST_FRAMES = 20000
+
+
+class HiccupSource(discord.AudioSource):
+    """
+    Source of noise that usually answers at once but sometimes stalls, like ffmpeg waiting on the network
+    """
+    def __init__(self, frames, chance, stall, seed=0):
+        self.left = frames
+        self.chance = chance
+        self.stall = stall
+        self.random = random.Random(seed)
+        self.frame = bytes(self.random.getrandbits(8) for _ in range(discord.opus.Encoder.FRAME_SIZE))
+
+    def read(self):
+        if self.left <= 0:
+            return b''
+        self.left -= 1
+        if self.random.random() < self.chance:
+            time.sleep(self.random.uniform(*self.stall))
+        return self.frame
+
+
+def play(source, seconds):
+    """
+    Reads a source on the voice client's 20 ms clock, like discord's AudioPlayer
+
+    Args:
+        source (discord.AudioSource): source to play
+        seconds (float): how long to play for
+
+    Returns:
+        tuple: the number of frames read late and the total seconds they were late by
+    """
+    late = 0
+    behind = 0.0
+    start = time.perf_counter()
+    for frame in range(int(seconds / FRAME_SECONDS)):
+        if not source.read():
+            break
+        delay = start + (frame + 1) * FRAME_SECONDS - time.perf_counter()
+        if delay < 0:
+            # like the AudioPlayer, a late frame moves the clock instead of rushing the next ones
+            late += 1
+            behind -= delay
+            start -= delay
+        else:
+            time.sleep(delay)
+    return late, behind
+
+
+def read_cost(source):
+    """
+    Measures the CPU time of a read when the source is always ready
+
+    Args:
+        source (discord.AudioSource): source to read
+
+    Returns:
+        float: microseconds per read
+    """
+    start = time.process_time()
+    for _ in range(COST_FRAMES):
+        source.read()
+    return (time.process_time() - start) / COST_FRAMES * 1e6
+
+
+def main(args):
+    frames = int(args.seconds / FRAME_SECONDS) + 1
+    stall = (args.min_stall, args.max_stall)
+    print(f'{args.seconds:g}s of audio, a stall of {stall[0]:g}-{stall[1]:g}s every {1 / args.chance:.0f} frames on average, '
+          f'{mixer.BUFFER_SECONDS:g}s buffer, mixing with {"numpy" if mixer.numpy is not None else "audioop"}')
+    print(f"{'path':<8}{'late frames':>14}{'seconds late':>14}{'underruns':>12}")
+    late, behind = play(HiccupSource(frames, args.chance, stall), args.seconds)
+    print(f"{'direct':<8}{late:>14}{behind:>14.2f}{'-':>12}")
+    buffered = Mixer(HiccupSource(frames, args.chance, stall), lambda *event: None)
+    late, behind = play(buffered, args.seconds)
+    buffered.cleanup()
+    print(f"{'mixer':<8}{late:>14}{behind:>14.2f}{buffered.underruns:>12}")
+
+    direct_cost = read_cost(HiccupSource(COST_FRAMES, 0, stall))
+    buffered = Mixer(HiccupSource(COST_FRAMES + 1, 0, stall), lambda *event: None)
+    mixer_cost = read_cost(buffered)
+    buffered.cleanup()
+    print(f'CPU per read: direct {direct_cost:.1f} us, mixer {mixer_cost:.1f} us')
+
+    # a crossfade mixes the next song over the buffered end of the current one
+    fade = Mixer(HiccupSource(buffered.capacity, 0, stall), lambda *event: None)
+    while fade._written < fade.capacity:
+        time.sleep(0.01)
+    frames = [HiccupSource(1, 0, stall, seed=1).frame] * fade.fade_frames
+    start = time.perf_counter()
+    with fade._cond:
+        fade._crossfade(fade._written - len(frames), frames)
+    print(f'one {mixer.CROSSFADE_SECONDS:g}s crossfade: {(time.perf_counter() - start) * 1000:.2f} ms')
+    fade.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=20, help='seconds of audio played on each path')
+    parser.add_argument('--chance', type=float, default=0.01, help='chance that a read stalls')
+    parser.add_argument('--min-stall', type=float, default=0.05, help='shortest stall in seconds')
+    parser.add_argument('--max-stall', type=float, default=0.5, help='longest stall in seconds')
+    main(parser.parse_args())
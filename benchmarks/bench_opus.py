@@ -0,0 +1,144 @@
+"""
+Plays a local file through the bot's ffmpeg pipelines and measures the CPU that
+ffmpeg and the bot process spend per second of audio, and how many concurrent
+streams that leaves room for on one core
+
+PCM mode has ffmpeg decode to PCM, scales the samples in python and encodes to
+Opus with libopus in the bot process. Opus re-encode mode has ffmpeg apply the
+volume and encode to Opus itself. Copy mode forwards the file's Opus packets
+without decoding them, which is what cached and Opus streams at full volume get.
+ffmpeg's CPU is read from the rusage of the bot's reaped children. Loudness
+normalization is left off, since it rules out copy mode.
+
+The file is generated with ffmpeg unless --file points at a real song, which
+should hold Opus audio for copy mode to copy. Frames are read as fast as
+possible rather than in real time.
+
+Run from the repository root:
+
+    python benchmarks/bench_opus.py --seconds 60
+"""
+import argparse
+import ctypes.util
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from discord.opus import Encoder
+
+import music
+from audio_source import FRAME_SECONDS
+from fakes import FakeBot
+from music import VOLUME_CONTROL
+
+
+def load_opus():
+    """
+    Loads libopus if discord.py has not already
+
+    Returns:
+        bool: whether Opus encoding is available
+    """
+    if not discord.opus.is_loaded():
+        name = ctypes.util.find_library('opus')
+        if name:
+            discord.opus.load_opus(name)
+    return discord.opus.is_loaded()
+
+
+def generate(path, seconds):
+    """
+    Writes pink noise as Opus in WebM, like the audio youtube serves
+
+    Args:
+        path (str): where to write the file
+        seconds (float): length of the file's audio
+    """
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i',
+                    f'anoisesrc=color=pink:sample_rate={Encoder.SAMPLING_RATE}:duration={seconds}',
+                    '-ac', str(Encoder.CHANNELS), '-c:a', 'libopus', '-b:a', f'{music.OPUS_BITRATE}k', path],
+                   check=True)
+
+
+def children_cpu():
+    """
+    Returns the CPU time used by the reaped child processes
+
+    Returns:
+        float: user and system time in seconds
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(source, encoder=None):
+    """
+    Reads a source to its end and splits the CPU it cost between ffmpeg and the bot
+
+    Args:
+        source (audio_source.WarmSource): source to read
+        encoder (discord.opus.Encoder, optional): encodes PCM frames like the voice thread. Defaults to None.
+
+    Returns:
+        tuple: ffmpeg and bot CPU seconds per second of audio
+    """
+    ffmpeg_start = children_cpu()
+    bot_start = time.process_time()
+    frames = 0
+    while True:
+        data = source.read()
+        if not data:
+            break
+        frames += 1
+        if encoder is not None and not source.is_opus():
+            encoder.encode(data, Encoder.SAMPLES_PER_FRAME)
+    bot = time.process_time() - bot_start
+    # cleanup waits for ffmpeg, which only then counts towards the children
+    source.cleanup()
+    ffmpeg = children_cpu() - ffmpeg_start
+    audio = frames * FRAME_SECONDS or 1
+    return ffmpeg / audio, bot / audio
+
+
+def main(args):
+    if shutil.which('ffmpeg') is None:
+        sys.exit('ffmpeg was not found on PATH')
+    encoder = Encoder() if load_opus() else None
+    if encoder is None:
+        print('libopus not found, so PCM mode is measured without the Opus encode step')
+    music.NORMALIZE_LOUDNESS = False
+    cog = music.Music(FakeBot())
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.file
+        if path is None:
+            path = os.path.join(directory, 'noise.webm')
+            generate(path, args.seconds)
+        # played like a file from the audio cache
+        source = {'url': path, 'title': os.path.basename(path), 'local': True, 'acodec': 'opus'}
+
+        music.OPUS_PASSTHROUGH = False
+        modes = [('pcm', measure(cog.create_audio_source(source), encoder))]
+        music.OPUS_PASSTHROUGH = True
+        modes.append(('opus re-encode', measure(cog.create_audio_source(source))))
+        # at full volume ffmpeg needs no filter, so Opus input is copied
+        modes.append(('opus copy', measure(cog.create_audio_source(source, volume=1))))
+
+    print(f"{'mode':<16}{'ffmpeg ms/s':>13}{'bot ms/s':>10}{'streams/core':>14}")
+    for name, (ffmpeg, bot) in modes:
+        print(f'{name:<16}{ffmpeg * 1000:>13.2f}{bot * 1000:>10.2f}{1 / (ffmpeg + bot):>14.0f}')
+    print(f'PCM and re-encode modes play at volume {VOLUME_CONTROL:g}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=60, help='length of the generated file')
+    parser.add_argument('--file', help='play this file instead of generated noise')
+    main(parser.parse_args())
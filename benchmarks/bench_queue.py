@@ -0,0 +1,96 @@
+"""
+Microbenchmarks of queue operations on 10k and 100k song queues: collections.deque against BlockList
+
+Run from the repository root:
+
+    python benchmarks/bench_queue.py
+"""
+import os
+import random
+import sys
+import timeit
+from collections import deque
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blocklist import BlockList
+
+QUEUE_LENGTHS = (10000, 100000)
+REPEATS = 2000
+
+
+def deque_move(q, src, dst):
+    item = q[src]
+    del q[src]
+    q.insert(dst, item)
+
+
+def deque_dedupe(q):
+    seen = set()
+    items = [item for item in q if not (item in seen or seen.add(item))]
+    q.clear()
+    q.extend(items)
+
+
+OPERATIONS = {
+    'index': (lambda q, i: q[i], lambda q, i: q[i]),
+    'insert': (lambda q, i: q.insert(i, -1), lambda q, i: q.insert(i, -1)),
+    'remove': (lambda q, i: q.__delitem__(i), lambda q, i: q.pop(i)),
+    'move': (lambda q, i: deque_move(q, i, len(q) - 1 - i), lambda q, i: q.move(i, len(q) - 1 - i)),
+    'page': (lambda q, i: list(islice(q, i, i + 10)), lambda q, i: q.slice(i, i + 10)),
+    'popleft+append': (lambda q, i: q.append(q.popleft()), lambda q, i: q.append(q.popleft())),
+}
+
+
+def bench(structure, operation, length):
+    """
+    Times an operation at random positions of a full queue
+
+    Args:
+        structure (type): deque or BlockList
+        operation (callable): takes the queue and a position
+        length (int): initial queue length
+
+    Returns:
+        float: microseconds per operation
+    """
+    q = structure(range(length))
+    # leaves room for removals shrinking the queue
+    positions = [random.randrange(length - REPEATS - 20) for _ in range(REPEATS)]
+    positions_iter = iter(positions)
+    seconds = timeit.timeit(lambda: operation(q, next(positions_iter)), number=REPEATS)
+    return seconds / REPEATS * 1e6
+
+
+def bench_dedupe(structure, dedupe, length):
+    """
+    Times removing duplicates from a queue where roughly half the items repeat
+
+    Args:
+        structure (type): deque or BlockList
+        dedupe (callable): takes the queue and removes duplicates
+        length (int): queue length
+
+    Returns:
+        float: microseconds for the whole pass
+    """
+    items = [random.randrange(length // 2) for _ in range(length)]
+    q = structure(items)
+    return timeit.timeit(lambda: dedupe(q), number=1) * 1e6
+
+
+def main():
+    random.seed(0)
+    for length in QUEUE_LENGTHS:
+        print(f'queue of {length} items, microseconds per operation')
+        print(f"{'operation':<16}{'deque':>10}{'BlockList':>12}")
+        for name, (deque_op, block_op) in OPERATIONS.items():
+            print(f'{name:<16}{bench(deque, deque_op, length):>10.2f}{bench(BlockList, block_op, length):>12.2f}')
+        print(f"{'dedupe':<16}{bench_dedupe(deque, deque_dedupe, length):>10.2f}"
+              f"{bench_dedupe(BlockList, lambda q: q.dedupe(lambda item: item), length):>12.2f}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Plays songs from a local HTTP server that drops connections partway through and
+checks that the player resumes them where they stopped instead of skipping them
+
+The server serves silent 48 kHz stereo WAV files and honours Range requests,
+like the upstream servers ffmpeg seeks in with -ss. By default songs are read by
+a small python source that requests the byte range of its start position, so
+ffmpeg is not needed; --ffmpeg plays them through the bot's real ffmpeg pipeline instead.
+Songs are read as fast as possible rather than in real time.
+
+Run from the repository root:
+
+    python benchmarks/bench_recovery.py --songs 3 --drops 2
+"""
+import argparse
+import asyncio
+import http.server
+import os
+import struct
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from discord.opus import Encoder
+
+import extraction
+import instrumentation
+import player
+from audio_source import FRAME_SECONDS, WarmSource
+from fakes import FakeBot, FakeContext, FakeGuild, FakeVoiceClient, FakeYoutubeDL
+
+# bytes of PCM per second of audio
+BYTES_PER_SECOND = int(Encoder.FRAME_SIZE / FRAME_SECONDS)
+
+# size of the header in front of the samples of a WAV file
+WAV_HEADER_SIZE = 44
+
+
+def wav_header(seconds):
+    """
+    Builds the header of a 48 kHz stereo 16-bit WAV file
+
+    Args:
+        seconds (int): length of the file's audio
+
+    Returns:
+        bytes: the header
+    """
+    size = seconds * BYTES_PER_SECOND
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', size + WAV_HEADER_SIZE - 8, b'WAVE', b'fmt ', 16, 1,
+                       Encoder.CHANNELS, Encoder.SAMPLING_RATE, BYTES_PER_SECOND, Encoder.CHANNELS * 2, 16,
+                       b'data', size)
+
+
+class DroppingHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves a silent WAV file for every path and cuts the first few responses of each song short
+    """
+    song_seconds = 20
+    drops = 2
+    # maps songs to the number of responses cut short so far
+    dropped = {}
+
+    def do_GET(self):
+        header = wav_header(self.song_seconds)
+        size = len(header) + self.song_seconds * BYTES_PER_SECOND
+        start = 0
+        if self.headers.get('Range', '').startswith('bytes='):
+            start = int(self.headers['Range'][6:].split('-')[0])
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Type', 'audio/wav')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(size - start))
+        if start:
+            self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        self.end_headers()
+        remaining = size - start
+        # fresh extractions give the song a new expiry, so drops are counted per song and not per url
+        song = self.path.split('?')[0]
+        if self.dropped.get(song, 0) < self.drops:
+            self.dropped[song] = self.dropped.get(song, 0) + 1
+            # a third of what is left is sent before the connection drops
+            remaining //= 3
+            self.close_connection = True
+        chunk = bytes(64 * 1024)
+        try:
+            if start < len(header):
+                self.wfile.write(header[start:])
+                remaining -= len(header) - start
+            while remaining > 0:
+                self.wfile.write(chunk[:remaining])
+                remaining -= len(chunk)
+        except ConnectionError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPPCMSource(discord.AudioSource):
+    """
+    Reads a WAV file's samples over HTTP from a start position, standing in for ffmpeg with -ss
+    """
+    def __init__(self, url, start=0):
+        offset = WAV_HEADER_SIZE + int(start * BYTES_PER_SECOND) // 4 * 4
+        request = urllib.request.Request(url, headers={'Range': f'bytes={offset}-'})
+        self.response = urllib.request.urlopen(request, timeout=10)
+
+    def read(self):
+        try:
+            data = self.response.read(Encoder.FRAME_SIZE)
+        except Exception:
+            # a dropped connection ends the stream like ffmpeg exiting
+            return b''
+        return data if len(data) == Encoder.FRAME_SIZE else b''
+
+    def cleanup(self):
+        self.response.close()
+
+
+class ReadingVoiceClient(FakeVoiceClient):
+    """
+    Stand-in for discord.VoiceClient whose player thread reads every frame as fast as it can
+    """
+    def play(self, source, *, after=None, **kwargs):
+        if self._source is not None:
+            raise discord.ClientException('Already playing audio.')
+        self.plays += 1
+        self._source = source
+        self._after = after
+        self._stopped = threading.Event()
+        threading.Thread(target=self._read, args=(source, after, self._stopped), daemon=True).start()
+
+    def _read(self, source, after, stopped):
+        # like the real player thread, errors reading the source are passed to after
+        error = None
+        try:
+            while not stopped.is_set() and source.read():
+                pass
+        except Exception as exc:
+            error = exc
+        if self._source is source:
+            self._source = None
+            if after:
+                after(error)
+
+    def stop(self):
+        source, self._source = self._source, None
+        if source is not None:
+            self._stopped.set()
+            if self._after:
+                self._after(None)
+
+
+async def main(args):
+    DroppingHandler.song_seconds = args.song_seconds
+    DroppingHandler.drops = args.drops
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), DroppingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    class LocalYoutubeDL(FakeYoutubeDL):
+        def extract_info(self, url, download=False, **kwargs):
+            video_id = url.rsplit('=', 1)[-1]
+            return {'id': video_id, 'title': f'Song {video_id}', 'duration': args.song_seconds,
+                    'url': f'{base}/{video_id}?expire={int(time.time()) + 21600}'}
+
+    FakeYoutubeDL.latency = 0.01
+    extraction.load_yt_dlp().YoutubeDL = LocalYoutubeDL
+    player.RECOVERY_BACKOFF = args.backoff
+    import music
+
+    cog = music.Music(FakeBot())
+    if not args.ffmpeg:
+        cog.create_audio_source = lambda source, volume=1.0, start=0: WarmSource(
+            HTTPPCMSource(source['url'], start), start)
+    guild = FakeGuild()
+    guild.voice_client = ReadingVoiceClient(guild.voice_channel)
+    ctx = FakeContext(cog.bot, guild)
+    guild_player = cog.get_player(ctx)
+    played = []
+    started = time.perf_counter()
+    original_ended = guild_player._on_song_ended
+
+    async def song_ended(source, error=None):
+        # songs are played through the mixer, which does not know positions
+        audio_source = guild_player._audio_source
+        if source is guild_player._playing:
+            played.append((guild_player.current_song.title, audio_source.start, audio_source.position))
+        await original_ended(source, error)
+    guild_player._on_song_ended = song_ended
+
+    await cog.addmany.callback(cog, ctx, *'; '.join(f'https://youtu.be/song{i:07d}' for i in range(args.songs)).split())
+    guild_player.tell('play', guild.text_channel)
+    while guild_player.current_song is not None or not guild_player.queue.empty():
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    print(f'{args.songs} songs of {args.song_seconds}s, connection dropped {args.drops} times per song')
+    print(f"{'song':<16}{'from s':>8}{'to s':>8}")
+    for title, start, position in played:
+        print(f'{title:<16}{start:>8.1f}{position:>8.1f}')
+    counters = instrumentation.counters
+    print(f"stalls: {counters[('stream_stalls_total', ())]}, recoveries: {counters[('stream_recoveries_total', ())]}, "
+          f"given up: {counters[('stream_recovery_failures_total', ())]}, {elapsed:.1f}s")
+    await cog.disconnect(guild)
+    await cog.cog_unload()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--songs', type=int, default=3, help='number of songs to play')
+    parser.add_argument('--song-seconds', type=int, default=20, help='length of every song')
+    parser.add_argument('--drops', type=int, default=2, help='connections dropped per song before it plays through')
+    parser.add_argument('--backoff', type=float, default=0.1, help='seconds before the first recovery attempt')
+    parser.add_argument('--ffmpeg', action='store_true', help="play through the bot's ffmpeg pipeline")
+    asyncio.run(main(parser.parse_args()))
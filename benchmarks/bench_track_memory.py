@@ -0,0 +1,87 @@
+"""
+Compares the memory used by a 10k song queue of raw yt_dlp entries against Track objects
+
+Run from the repository root:
+
+    python benchmarks/bench_track_memory.py
+"""
+import os
+import sys
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from track import Track
+
+QUEUE_LENGTH = 10000
+
+
+def make_entry(i):
+    """
+    Builds an entry shaped like the flat results of a ytsearch/playlist extraction
+
+    Args:
+        i (int): index used to make every string unique
+
+    Returns:
+        dict: fake yt_dlp entry
+    """
+    video_id = f'{i:011d}'
+    return {
+        '_type': 'url',
+        'ie_key': 'Youtube',
+        'id': video_id,
+        'url': f'https://www.youtube.com/watch?v={video_id}',
+        'title': f'Some fairly typical song title number {i} (Official Video)',
+        'description': f'Description of video {i} ' * 4,
+        'duration': 200.0 + i % 300,
+        'channel_id': f'UC{i:022d}',
+        'channel': f'Channel {i % 500}',
+        'channel_url': f'https://www.youtube.com/channel/UC{i:022d}',
+        'uploader': f'Channel {i % 500}',
+        'uploader_id': f'@channel{i % 500}',
+        'uploader_url': f'https://www.youtube.com/@channel{i % 500}',
+        'thumbnails': [
+            {'url': f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg?sqp=x', 'height': 202, 'width': 360},
+            {'url': f'https://i.ytimg.com/vi/{video_id}/hq720.jpg?sqp=y', 'height': 404, 'width': 720},
+        ],
+        'timestamp': None,
+        'release_timestamp': None,
+        'availability': None,
+        'view_count': 1000 * i,
+        'live_status': None,
+        'channel_is_verified': None,
+    }
+
+
+def measure(build):
+    """
+    Measures the memory retained by a queue built by build()
+
+    Args:
+        build (callable): returns the queue to measure
+
+    Returns:
+        int: bytes allocated and still alive after building
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del queue
+    return after - before
+
+
+def main():
+    dict_bytes = measure(lambda: deque(make_entry(i) for i in range(QUEUE_LENGTH)))
+    track_bytes = measure(lambda: deque(Track.from_entry(make_entry(i)) for i in range(QUEUE_LENGTH)))
+    print(f'queue of {QUEUE_LENGTH} songs')
+    print(f'  yt_dlp dicts: {dict_bytes / 1024 / 1024:8.2f} MiB ({dict_bytes / QUEUE_LENGTH:7.0f} B/song)')
+    print(f'  Track:        {track_bytes / 1024 / 1024:8.2f} MiB ({track_bytes / QUEUE_LENGTH:7.0f} B/song)')
+    print(f'  reduction:    {dict_bytes / track_bytes:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Drives Music.on_voice_state_update with a fake gateway to show that deciding whether
+to leave takes the same time regardless of channel size and makes no HTTP calls
+
+Run from the repository root:
+
+    python benchmarks/bench_voice_state.py
+"""
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from music import Music
+
+CHANNEL_SIZES = (10, 1000, 10000)
+EVENTS = 2000
+BOT_ID = 0
+
+
+class FakeBot:
+    """
+    Stand-in for commands.Bot that fails loudly if the listener makes an HTTP call
+    """
+    def __init__(self):
+        self.user = SimpleNamespace(id=BOT_ID)
+        self.voice_clients = []
+
+    async def fetch_user(self, user_id):
+        raise AssertionError('on_voice_state_update made an HTTP request')
+
+
+def make_channel(humans):
+    """
+    Builds a voice channel holding the bot and some humans, like the gateway cache would
+
+    Args:
+        humans (int): number of human members
+
+    Returns:
+        tuple: the channel and its human members
+    """
+    guild = SimpleNamespace(id=1)
+    channel = SimpleNamespace(id=2, guild=guild, members=[])
+    guild.voice_client = SimpleNamespace(channel=channel)
+    bot_member = SimpleNamespace(id=BOT_ID, bot=True)
+    members = [SimpleNamespace(id=i + 1, bot=False) for i in range(humans)]
+    channel.members = [bot_member] + members
+    return channel, bot_member, members
+
+
+async def bench(humans):
+    """
+    Times leave/rejoin events in a channel of the given size
+
+    Args:
+        humans (int): number of human members
+
+    Returns:
+        float: microseconds per voice state event
+    """
+    cog = Music(FakeBot())
+    disconnects = []
+
+    async def disconnect(guild):
+        disconnects.append(guild)
+    cog.disconnect = disconnect
+
+    channel, bot_member, members = make_channel(humans)
+    empty = SimpleNamespace(channel=None)
+    inside = SimpleNamespace(channel=channel)
+    # the bot joining seeds the count from the member cache once
+    await cog.on_voice_state_update(bot_member, empty, inside)
+
+    member = members[0]
+    start = time.perf_counter()
+    for _ in range(EVENTS):
+        await cog.on_voice_state_update(member, inside, empty)
+        await cog.on_voice_state_update(member, empty, inside)
+    elapsed = time.perf_counter() - start
+
+    assert not disconnects
+    return elapsed / (2 * EVENTS) * 1e6
+
+
+async def main():
+    print('microseconds per voice state event')
+    for humans in CHANNEL_SIZES:
+        print(f'{humans:>6} humans: {await bench(humans):.2f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,317 @@
+"""
+Local stand-ins for the Discord gateway, voice connections and yt_dlp used by the benchmarks
+"""
+import asyncio
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+import discord
+
+from audio_source import FRAME_SECONDS
+
+# ids handed out to fake guilds, channels, messages and users
+_ids = itertools.count(1000)
+
+
+class FakeYoutubeDL:
+    """
+    Replacement for yt_dlp.YoutubeDL that answers instantly after a configurable delay
+
+    ...
+
+    Attributes
+    ----------
+    latency : float
+        seconds every extraction blocks for, like a network round trip
+    playlist_length : int
+        number of entries in every playlist
+    calls : int
+        number of extractions performed by every instance
+    duration : int
+        length in seconds reported for every song
+    """
+    latency = 0.2
+    playlist_length = 300
+    calls = 0
+    duration = 180
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+
+    @classmethod
+    def entry(cls, video_id):
+        """
+        Builds a flat entry like the ones ytsearch and playlists return
+
+        Args:
+            video_id (str): id of the fake video
+
+        Returns:
+            dict: fake flat entry
+        """
+        return {
+            '_type': 'url',
+            'ie_key': 'Youtube',
+            'id': video_id,
+            'url': f'https://www.youtube.com/watch?v={video_id}',
+            'title': f'Fake song {video_id}',
+            'duration': cls.duration,
+            'thumbnails': [{'url': f'https://i.ytimg.com/vi/{video_id}/hq.jpg'}],
+        }
+
+    def extract_info(self, url, download=False, **kwargs):
+        FakeYoutubeDL.calls += 1
+        time.sleep(self.latency)
+        if url.startswith('ytsearch:'):
+            return {'entries': [self.entry(f'{abs(hash(url)) % 10 ** 11:011d}')]}
+        if 'list=' in url:
+            return {'title': 'Fake playlist', 'entries': self.playlist_entries()}
+        video_id = url.rsplit('=', 1)[-1]
+        return {
+            'id': video_id,
+            'title': f'Fake song {video_id}',
+            'duration': self.duration,
+            'url': f'http://127.0.0.1/fake/{video_id}?expire={int(time.time()) + 21600}',
+        }
+
+    def playlist_entries(self):
+        """
+        Yields a playlist's entries lazily, blocking for every continuation page like yt_dlp
+
+        Yields:
+            dict: fake flat entries
+        """
+        for i in range(1, self.playlist_length + 1):
+            if i > 1 and i % 100 == 1:
+                FakeYoutubeDL.calls += 1
+                time.sleep(self.latency)
+            yield self.entry(f'pl{i:09d}')
+
+    def sanitize_info(self, info):
+        return info
+
+
+class FakeAudioSource(discord.AudioSource):
+    """
+    Audio source that produces silence instead of spawning ffmpeg
+    """
+    def read(self):
+        return b'\0' * 3840
+
+    def cleanup(self):
+        pass
+
+
+class FakeVoiceClient:
+    """
+    Stand-in for discord.VoiceClient whose songs end after a fixed time
+
+    ...
+
+    Attributes
+    ----------
+    song_length : float
+        seconds every song plays for
+    plays : int
+        number of songs started
+    """
+    song_length = 2.0
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.plays = 0
+        self._source = None
+        self._paused = False
+        self._after = None
+        self._timer = None
+
+    def is_connected(self):
+        return self.channel is not None
+
+    def is_playing(self):
+        return self._source is not None and not self._paused
+
+    def is_paused(self):
+        return self._source is not None and self._paused
+
+    def play(self, source, *, after=None, **kwargs):
+        if self._source is not None:
+            raise discord.ClientException('Already playing audio.')
+        if self.channel.guild.first_audio is None:
+            self.channel.guild.first_audio = time.perf_counter()
+        self.plays += 1
+        self._source = source
+        self._after = after
+        # the real player thread calls after once the source runs out
+        self._timer = threading.Timer(self.song_length, self._finish, args=(source,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _finish(self, source):
+        # the real player thread reads the whole song, which moves the source's position to its end
+        for _ in range(int(self.song_length / FRAME_SECONDS)):
+            source.read()
+        if self._source is source:
+            self._source = None
+            if self._after:
+                self._after(None)
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()
+        source, self._source = self._source, None
+        if source is not None and self._after:
+            self._after(None)
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.channel.guild.voice_client = None
+        self.channel = None
+
+
+class FakeMessage:
+    """
+    Stand-in for discord.Message that counts the API calls made on it
+    """
+    def __init__(self, channel, content=None, embed=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        self.channel.api_calls += 1
+        self.content = content if content is not None else self.content
+        self.embed = embed if embed is not None else self.embed
+
+    async def add_reaction(self, emoji):
+        self.channel.api_calls += 1
+
+    async def remove_reaction(self, emoji, user):
+        self.channel.api_calls += 1
+
+
+class FakeTextChannel:
+    """
+    Stand-in for discord.TextChannel that records sent messages
+
+    ...
+
+    Attributes
+    ----------
+    api_latency : float
+        seconds every API call takes
+    api_calls : int
+        number of API calls made on the channel and its messages
+    """
+    api_latency = 0.0
+
+    def __init__(self, guild):
+        self.id = next(_ids)
+        self.guild = guild
+        self.api_calls = 0
+        self.sent = []
+
+    async def send(self, content=None, embed=None, **kwargs):
+        self.api_calls += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        message = FakeMessage(self, content, embed)
+        self.sent.append(message)
+        return message
+
+
+class FakeVoiceChannel:
+    """
+    Stand-in for discord.VoiceChannel
+    """
+    def __init__(self, guild):
+        self.id = next(_ids)
+        self.guild = guild
+        self.members = []
+
+    async def connect(self, **kwargs):
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+
+class FakeMember:
+    """
+    Stand-in for discord.Member sitting in a voice channel
+    """
+    def __init__(self, voice_channel, bot=False):
+        self.id = next(_ids)
+        self.bot = bot
+        self.voice = SimpleNamespace(channel=voice_channel)
+        voice_channel.members.append(self)
+
+
+class FakeGuild:
+    """
+    Stand-in for discord.Guild with one text channel, one voice channel and one listener
+
+    ...
+
+    Attributes
+    ----------
+    first_audio : float
+        perf_counter time at which the guild's first song started, or None
+    """
+    def __init__(self):
+        self.id = next(_ids)
+        self.voice_client = None
+        self.first_audio = None
+        self.emojis = []
+        self.text_channel = FakeTextChannel(self)
+        self.voice_channel = FakeVoiceChannel(self)
+        self.member = FakeMember(self.voice_channel)
+
+
+class FakeContext:
+    """
+    Stand-in for commands.Context as seen by a command invoked in a guild
+    """
+    def __init__(self, bot, guild, author=None):
+        self.bot = bot
+        self.guild = guild
+        self.author = author or guild.member
+        self.channel = guild.text_channel
+        self.message = None
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeBot:
+    """
+    Stand-in for commands.Bot that never sees any reactions and fails on HTTP lookups
+    """
+    def __init__(self):
+        self.user = SimpleNamespace(id=0, bot=True)
+        self.owner_id = None
+        self.loop = None
+        self.voice_clients = []
+
+    async def wait_for(self, event, *, check=None, timeout=None):
+        raise asyncio.TimeoutError
+
+    async def fetch_user(self, user_id):
+        raise AssertionError('the benchmark should not make HTTP requests')
+
+    async def is_owner(self, user):
+        return True
@@ -0,0 +1,315 @@
+import random
+from itertools import chain, islice
+
+# target number of items per block; blocks are split once they reach twice this
+BLOCK_SIZE = 512
+
+
+class BlockList:
+    """
+    List split into small blocks so positional inserts and removals stay cheap on long queues
+
+    A Fenwick tree over the block lengths finds the block holding a position
+    in O(log n), and positional operations then only touch that block. The
+    tree is rebuilt lazily when blocks are created or removed, which happens
+    at most once every BLOCK_SIZE operations.
+
+    ...
+
+    Attributes
+    ----------
+    block_size : int
+        target number of items per block
+
+    Methods
+    -------
+    append(item)
+        Adds an item to the end
+    appendleft(item)
+        Adds an item to the front
+    popleft()
+        Removes and returns the first item
+    insert(index, item)
+        Inserts an item before index
+    pop(index=-1)
+        Removes and returns the item at index
+    move(src, dst)
+        Moves the item at src so that it ends up at dst
+    slice(start, stop)
+        Returns the items between start and stop as a list
+    drop(count)
+        Removes the first count items
+    shuffle()
+        Shuffles the items in place
+    dedupe(key)
+        Removes items whose key was already seen earlier in the list
+    clear()
+        Removes every item
+    """
+    def __init__(self, iterable=(), block_size=BLOCK_SIZE):
+        """
+        Args:
+            iterable (iterable, optional): initial items. Defaults to ().
+            block_size (int, optional): target number of items per block. Defaults to BLOCK_SIZE.
+        """
+        self.block_size = block_size
+        self._blocks = []
+        self._len = 0
+        # fenwick tree of block lengths, None while it needs rebuilding
+        self._tree = None
+        self._rebuild(iterable)
+
+    def _rebuild(self, items):
+        """
+        Replaces the contents with items split into evenly sized blocks
+
+        Args:
+            items (iterable): new items
+        """
+        items = list(items)
+        size = self.block_size
+        self._blocks = [items[i:i + size] for i in range(0, len(items), size)]
+        self._len = len(items)
+        self._tree = None
+
+    def _build_tree(self):
+        """
+        Builds the fenwick tree of block lengths in O(number of blocks)
+        """
+        tree = [0] + [len(block) for block in self._blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _resized(self, block_index, delta):
+        """
+        Records that a block gained or lost items
+
+        Args:
+            block_index (int): index of the block
+            delta (int): change in the block's length
+        """
+        self._len += delta
+        tree = self._tree
+        if tree is not None:
+            i = block_index + 1
+            while i < len(tree):
+                tree[i] += delta
+                i += i & -i
+
+    def _locate(self, index):
+        """
+        Finds the block holding an index
+
+        Args:
+            index (int): position, negative values count from the end
+
+        Returns:
+            tuple: index of the block and the offset within it
+        """
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('BlockList index out of range')
+        # the front is the common case for a song queue
+        if index < len(self._blocks[0]):
+            return 0, index
+        if self._tree is None:
+            self._build_tree()
+        tree = self._tree
+        position = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            if position + step < len(tree) and tree[position + step] <= index:
+                position += step
+                index -= tree[position]
+            step >>= 1
+        return position, index
+
+    def _split(self, block_index):
+        """
+        Splits a block that grew too large into two halves
+
+        Args:
+            block_index (int): index of the block
+        """
+        block = self._blocks[block_index]
+        if len(block) >= 2 * self.block_size:
+            half = len(block) // 2
+            self._blocks[block_index:block_index + 1] = [block[:half], block[half:]]
+            self._tree = None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._blocks)
+
+    def __getitem__(self, index):
+        block_index, offset = self._locate(index)
+        return self._blocks[block_index][offset]
+
+    def __repr__(self):
+        return f'BlockList({list(self)!r})'
+
+    def append(self, item):
+        """
+        Adds an item to the end
+
+        Args:
+            item: item to add
+        """
+        if not self._blocks or len(self._blocks[-1]) >= self.block_size:
+            self._blocks.append([item])
+            self._tree = None
+            self._len += 1
+        else:
+            self._blocks[-1].append(item)
+            self._resized(len(self._blocks) - 1, 1)
+
+    def appendleft(self, item):
+        """
+        Adds an item to the front
+
+        Args:
+            item: item to add
+        """
+        if not self._blocks or len(self._blocks[0]) >= self.block_size:
+            self._blocks.insert(0, [item])
+            self._tree = None
+            self._len += 1
+        else:
+            self._blocks[0].insert(0, item)
+            self._resized(0, 1)
+
+    def popleft(self):
+        """
+        Removes and returns the first item
+
+        Returns:
+            the first item
+        """
+        return self.pop(0)
+
+    def insert(self, index, item):
+        """
+        Inserts an item before index; indices past the end append
+
+        Args:
+            index (int): position to insert at
+            item: item to insert
+        """
+        if index < 0:
+            index = max(index + self._len, 0)
+        if index >= self._len:
+            self.append(item)
+            return
+        block_index, offset = self._locate(index)
+        self._blocks[block_index].insert(offset, item)
+        self._resized(block_index, 1)
+        self._split(block_index)
+
+    def pop(self, index=-1):
+        """
+        Removes and returns the item at index
+
+        Args:
+            index (int, optional): position of the item. Defaults to -1.
+
+        Returns:
+            the removed item
+        """
+        block_index, offset = self._locate(index)
+        block = self._blocks[block_index]
+        item = block.pop(offset)
+        if block:
+            self._resized(block_index, -1)
+        else:
+            del self._blocks[block_index]
+            self._tree = None
+            self._len -= 1
+        return item
+
+    def move(self, src, dst):
+        """
+        Moves the item at src so that it ends up at dst
+
+        Args:
+            src (int): current position of the item
+            dst (int): new position of the item
+        """
+        self.insert(dst, self.pop(src))
+
+    def slice(self, start, stop):
+        """
+        Returns the items between start and stop as a list
+
+        Args:
+            start (int): first position
+            stop (int): position after the last one
+
+        Returns:
+            list: the items in the range
+        """
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return []
+        block_index, offset = self._locate(start)
+        items = chain(islice(self._blocks[block_index], offset, None),
+                      chain.from_iterable(self._blocks[block_index + 1:]))
+        return list(islice(items, stop - start))
+
+    def drop(self, count):
+        """
+        Removes the first count items
+
+        Args:
+            count (int): number of items to remove
+        """
+        count = min(max(count, 0), self._len)
+        self._len -= count
+        self._tree = None
+        while count and count >= len(self._blocks[0]):
+            count -= len(self._blocks.pop(0))
+        if count:
+            del self._blocks[0][:count]
+
+    def shuffle(self):
+        """
+        Shuffles the items in place
+        """
+        items = list(self)
+        random.shuffle(items)
+        self._rebuild(items)
+
+    def dedupe(self, key):
+        """
+        Removes items whose key was already seen earlier in the list
+
+        Args:
+            key (callable): returns the identity of an item
+
+        Returns:
+            int: number of items removed
+        """
+        seen = set()
+        items = []
+        for item in self:
+            item_key = key(item)
+            if item_key not in seen:
+                seen.add(item_key)
+                items.append(item)
+        removed = self._len - len(items)
+        if removed:
+            self._rebuild(items)
+        return removed
+
+    def clear(self):
+        """
+        Removes every item
+        """
+        self._blocks = []
+        self._len = 0
+        self._tree = None
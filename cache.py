@@ -0,0 +1,146 @@
+import time
+from collections import OrderedDict
+
+# maximum number of entries held by each cache
+CACHE_SIZE = 2048
+
+# seconds that search results and track metadata stay valid
+METADATA_TTL = 6 * 3600
+
+
+def normalize_query(query):
+    """
+    Normalizes a search query so trivially different spellings share a cache entry
+
+    Args:
+        query (str): query typed by the user
+
+    Returns:
+        str: lowercased query with collapsed whitespace
+    """
+    return ' '.join(query.lower().split())
+
+
+class TTLCache:
+    """
+    Size bounded cache that evicts the least recently used entry and expires entries over time
+
+    ...
+
+    Attributes
+    ----------
+    maxsize : int
+        maximum number of entries
+    ttl : float
+        default lifetime of an entry in seconds
+    hits : int
+        number of successful lookups
+    misses : int
+        number of lookups that found nothing usable
+
+    Methods
+    -------
+    get(key, default=None)
+        Returns the value for key if present and not expired
+    set(key, value, expires=None)
+        Stores a value, evicting the least recently used entry if full
+    pop(key, default=None)
+        Removes an entry
+    stats()
+        Returns the hit/miss counters
+    clear()
+        Removes every entry
+    """
+    def __init__(self, maxsize=CACHE_SIZE, ttl=METADATA_TTL):
+        """
+        Args:
+            maxsize (int, optional): maximum number of entries. Defaults to CACHE_SIZE.
+            ttl (float, optional): default lifetime of an entry in seconds. Defaults to METADATA_TTL.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # maps keys to (value, unix expiry time) pairs in least to most recently used order
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > time.time()
+
+    def get(self, key, default=None):
+        """
+        Returns the value for key if present and not expired
+
+        Args:
+            key (hashable): cache key
+            default (optional): returned on a miss. Defaults to None.
+
+        Returns:
+            the cached value or default
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[1] <= time.time():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, expires=None):
+        """
+        Stores a value, evicting the least recently used entry if full
+
+        Args:
+            key (hashable): cache key
+            value: value to store
+            expires (float, optional): unix time at which the entry expires. Defaults to now plus ttl.
+        """
+        if expires is None:
+            expires = time.time() + self.ttl
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Removes an entry
+
+        Args:
+            key (hashable): cache key
+            default (optional): returned if key is absent. Defaults to None.
+
+        Returns:
+            the removed value or default
+        """
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def stats(self):
+        """
+        Returns the hit/miss counters
+
+        Returns:
+            dict: hits, misses, hit rate and current size
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._data)
+        }
+
+    def clear(self):
+        """
+        Removes every entry
+        """
+        self._data.clear()
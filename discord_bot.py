@@ -1,9 +1,17 @@
-import music
+import time
+
+# taken before the other imports so the startup timing includes them
+STARTED = time.perf_counter()
+
+from instrumentation import histogram, timer
+from message_router import Countdown, MessageRouter
 from discord import Intents
 from discord.ext import commands
 from dotenv import load_dotenv
+import asyncio
 import os
 import random
+import signal
 
 load_dotenv()
 
@@ -11,14 +19,29 @@ load_dotenv()
 TOKEN = os.environ.get('TOKEN') or os.getenv('TOKEN')
 SECRET_MESSAGE = os.environ.get('SECRET_MESSAGE', 'hello')
 
+# comma separated ids of the servers that get the secret message; every server does when unset
+SECRET_MESSAGE_GUILDS = os.environ.get('SECRET_MESSAGE_GUILDS')
+
+# start of every command
+COMMAND_PREFIX = '.'
+
 intents = Intents.default()
 intents.typing = False
 intents.message_content = True
 intents.voice_states = True
 # TODO see if you need to restrict more stuff
 
+# set by launcher.py when this process only runs some of the bot's shards
+SHARD_IDS = os.environ.get('SHARD_IDS')
+SHARD_COUNT = os.environ.get('SHARD_COUNT')
+
 #Instantiating the bot
-client = commands.Bot(command_prefix='.', help_command=commands.MinimalHelpCommand(), intents=intents)
+if SHARD_IDS:
+    client = commands.AutoShardedBot(command_prefix=COMMAND_PREFIX, help_command=commands.MinimalHelpCommand(), intents=intents,
+                                     shard_ids=[int(shard_id) for shard_id in SHARD_IDS.split(',')],
+                                     shard_count=int(SHARD_COUNT))
+else:
+    client = commands.Bot(command_prefix=COMMAND_PREFIX, help_command=commands.MinimalHelpCommand(), intents=intents)
 
 #Variables required for different commands
 head_tail = ['Heads', 'Tails']
@@ -28,30 +51,88 @@ randword_url = 'https://randomword.com/'
 # determines chance that secret message is sent - higher means lower chance
 SECRET_MESSAGE_PROC = 99
 
+# plain chat is handled here without going through the command framework
+router = MessageRouter(client, COMMAND_PREFIX)
+secret_roll = Countdown(1 / (SECRET_MESSAGE_PROC + 1))
+
+# seconds since STARTED at which each startup stage finished
+startup = {'imports': time.perf_counter() - STARTED}
+
+# close() scheduled by SIGTERM, kept so the task is not garbage collected while it runs
+closing = None
+
+def close_on_sigterm():
+    """
+    Closes the bot like Ctrl+C does, so cogs save their state before Heroku or the launcher stops the process
+    """
+    global closing
+    if closing is None:
+        closing = asyncio.create_task(client.close())
+
+@client.event
+async def setup_hook():
+    """
+    Loads the music cog once, after logging in and before connecting to the gateway
+    """
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, close_on_sigterm)
+    except NotImplementedError:
+        # event loops on Windows have no signal handlers
+        pass
+    await client.load_extension('music')
+    startup['cogs'] = time.perf_counter() - STARTED
+
 @client.event
 async def on_ready():
-    await client.add_cog(music.Music(client))
+    # on_ready runs again after every reconnect, but startup is only timed once
+    if 'ready' not in startup:
+        startup['ready'] = time.perf_counter() - STARTED
+        previous = 0
+        for stage, finished in startup.items():
+            histogram('startup_seconds', stage=stage).observe(finished - previous)
+            previous = finished
+        print(f"Started in {startup['ready']:.2f}s: imports {startup['imports']:.2f}s, "
+              f"login and cogs {startup['cogs'] - startup['imports']:.2f}s, "
+              f"gateway {startup['ready'] - startup['cogs']:.2f}s")
     print(f'{client.user} had connected to Discord!')
     print(client.guilds)
 
 @client.event
 async def on_message(message):
     """
-    Bot will send a message whenever a certain keyword is found
+    Passes every message to the router, which only builds command contexts for commands
 
     Args:
         message (discord.message): Messages sent in discord servers with bot
     """
     if message.author == client.user:
         return
-    if random.randint(0, SECRET_MESSAGE_PROC) == 0:
-        emotes = message.guild.emojis
-        react_emote = emotes[random.randint(0, len(emotes) - 1)]
+    with timer('handler_seconds', handler='on_message'):
+        await router.dispatch(message)
+
+
+async def send_secret_message(message):
+    """
+    Bot will occasionally answer a message with the secret message
+
+    Args:
+        message (discord.message): Messages sent in discord servers with bot
+    """
+    if not secret_roll.roll():
+        return
+    with timer('discord_api_seconds', call='send'):
         sent = await message.channel.send(SECRET_MESSAGE.replace('_', ' '))
-        await sent.add_reaction(react_emote)
+    # servers without custom emojis only get the message
+    if message.guild.emojis:
+        await sent.add_reaction(random.choice(message.guild.emojis))
     # if 'bruh' in message.content.lower():
     #     await message.channel.send('bruh')
-    await client.process_commands(message)
+
+if SECRET_MESSAGE_GUILDS:
+    for guild_id in SECRET_MESSAGE_GUILDS.split(','):
+        router.add_handler(send_secret_message, int(guild_id))
+else:
+    router.add_handler(send_secret_message)
 
 
 @client.command(name='flip')
@@ -0,0 +1,322 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from instrumentation import timer
+
+# number of workers in the extraction pool
+EXTRACTOR_WORKERS = int(os.environ.get('EXTRACTOR_WORKERS', 4))
+
+# 'thread' or 'process' - processes sidestep the GIL for heavy playlist parsing
+EXTRACTOR_MODE = os.environ.get('EXTRACTOR_MODE', 'thread')
+
+# maximum number of extractions a single server can have running at once
+GUILD_EXTRACTION_LIMIT = 2
+
+# number of threads looking up songs added in bulk, apart from the extraction pool
+BULK_EXTRACTOR_WORKERS = int(os.environ.get('BULK_EXTRACTOR_WORKERS', 16))
+
+# maximum number of bulk lookups a single server can have running at once, so several servers can add in bulk
+GUILD_BULK_LIMIT = 8
+
+# seconds before an extraction is abandoned
+EXTRACTION_TIMEOUT = 30
+
+# number of playlist entries extracted per page
+PLAYLIST_PAGE_SIZE = 100
+
+# playlists (and endless mixes) stop being read after this many entries
+MAX_PLAYLIST_SONGS = 5000
+
+# pages of a playlist read ahead of the caller before the worker waits for it
+PLAYLIST_PAGES_AHEAD = 2
+
+# each worker thread (or process) holds its own YoutubeDL instance
+_worker = threading.local()
+
+# imported by the first worker, since it is by far the slowest import of the bot
+yt_dlp = None
+
+
+def load_yt_dlp():
+    """
+    Imports yt_dlp the first time it is needed
+
+    Returns:
+        module: the yt_dlp module
+    """
+    global yt_dlp
+    if yt_dlp is None:
+        with timer('startup_seconds', stage='yt_dlp'):
+            import yt_dlp as module
+        yt_dlp = module
+    return yt_dlp
+
+
+def _init_worker(opts):
+    """
+    Pool initializer that builds the worker's YoutubeDL instance
+
+    Args:
+        opts (dict): options passed to yt_dlp.YoutubeDL
+    """
+    _worker.ydl = load_yt_dlp().YoutubeDL(opts)
+    _worker.sanitize = False
+
+
+def _init_process_worker(opts):
+    """
+    Pool initializer for process workers; results have to be picklable
+
+    Args:
+        opts (dict): options passed to yt_dlp.YoutubeDL
+    """
+    _init_worker(opts)
+    _worker.sanitize = True
+
+
+def _extract(url, download):
+    """
+    Runs inside a pool worker and performs the blocking extraction
+
+    Args:
+        url (str): url or search query handed to yt_dlp
+        download (bool): whether yt_dlp should download the media
+
+    Returns:
+        dict: info dict returned by yt_dlp
+    """
+    info = _worker.ydl.extract_info(url, download=download)
+    if _worker.sanitize:
+        info = _worker.ydl.sanitize_info(info)
+    return info
+
+
+def _stream_playlist(url, page_size, deliver):
+    """
+    Runs inside a thread worker and reads a playlist with one lazy flat extraction
+
+    yt_dlp fetches the playlist's continuation pages only as its entries
+    are iterated, so every page is fetched once however long the playlist.
+
+    Args:
+        url (str): playlist url
+        page_size (int): entries handed over at a time
+        deliver (callable): called with the playlist title and a page of entries; returns False
+            once the caller stopped listening
+    """
+    ydl = _worker.ydl
+    info = ydl.extract_info(url, download=False, process=False)
+    # links that only point at a playlist are followed once
+    if info.get('_type') == 'url':
+        info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+    title = info.get('title') or 'playlist'
+    page = []
+    for count, entry in enumerate(info.get('entries') or [], start=1):
+        if entry:
+            page.append(entry)
+        if len(page) == page_size:
+            if not deliver(title, page):
+                return
+            page = []
+        if count >= MAX_PLAYLIST_SONGS:
+            break
+    if page:
+        deliver(title, page)
+
+
+def _ready():
+    """
+    Does nothing; submitted to start a worker, whose initializer does the work
+    """
+
+
+class ExtractionService:
+    """
+    Runs yt_dlp extractions on a worker pool so the event loop is never blocked
+
+    ...
+
+    Attributes
+    ----------
+    opts : dict
+        options used to build each worker's YoutubeDL
+    timeout : float
+        seconds before an extraction raises asyncio.TimeoutError
+    guild_limit : int
+        maximum number of concurrent extractions per server
+    guild_bulk_limit : int
+        maximum number of concurrent bulk extractions per server
+    executor : concurrent.futures.Executor
+        thread or process pool that runs the extractions
+    playlist_executor : concurrent.futures.Executor
+        thread pool that reads playlists, so long playlists never hold up other extractions
+    bulk_executor : concurrent.futures.Executor
+        thread pool that runs bulk extractions, so songs added in bulk never hold up playback
+    guild_semaphores : dict
+        per server semaphores capping concurrent extractions
+    guild_bulk_semaphores : dict
+        per server semaphores capping concurrent bulk extractions
+
+    Methods
+    -------
+    extract_info(url, guild_id=None, download=False, bulk=False)
+        Extracts info for the url on the pool
+    iter_playlist(url, page_size=PLAYLIST_PAGE_SIZE)
+        Reads a playlist and yields it one page at a time
+    release_guild(guild_id)
+        Forgets the concurrency state of a server
+    warm()
+        Starts a worker in the background so the first extraction does not wait for yt_dlp to load
+    shutdown()
+        Stops the worker pool
+    """
+    def __init__(self, opts, workers=EXTRACTOR_WORKERS, mode=EXTRACTOR_MODE,
+                 guild_limit=GUILD_EXTRACTION_LIMIT, timeout=EXTRACTION_TIMEOUT,
+                 bulk_workers=BULK_EXTRACTOR_WORKERS, guild_bulk_limit=GUILD_BULK_LIMIT):
+        """
+        Args:
+            opts (dict): options passed to yt_dlp.YoutubeDL
+            workers (int, optional): size of the pool. Defaults to EXTRACTOR_WORKERS.
+            mode (str, optional): 'thread' or 'process'. Defaults to EXTRACTOR_MODE.
+            guild_limit (int, optional): concurrent extractions per server. Defaults to GUILD_EXTRACTION_LIMIT.
+            timeout (float, optional): seconds per extraction. Defaults to EXTRACTION_TIMEOUT.
+            bulk_workers (int, optional): size of the bulk pool. Defaults to BULK_EXTRACTOR_WORKERS.
+            guild_bulk_limit (int, optional): concurrent bulk extractions per server. Defaults to GUILD_BULK_LIMIT.
+        """
+        self.opts = opts
+        self.timeout = timeout
+        self.guild_limit = guild_limit
+        self.guild_bulk_limit = guild_bulk_limit
+        self.guild_semaphores = {}
+        self.guild_bulk_semaphores = {}
+        if mode == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                                                initializer=_init_process_worker, initargs=(opts,))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='extractor',
+                                               initializer=_init_worker, initargs=(opts,))
+        # playlists are read for as long as they are being added, so they get threads of their own;
+        # pages are handed over through the event loop of this process
+        self.playlist_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='playlist',
+                                                    initializer=_init_worker, initargs=(opts,))
+        # extractions mostly wait on the network, so threads are enough for lookups in bulk
+        self.bulk_executor = ThreadPoolExecutor(max_workers=bulk_workers, thread_name_prefix='bulk',
+                                                initializer=_init_worker, initargs=(opts,))
+
+    def _semaphore(self, guild_id, bulk=False):
+        """
+        Retrieves the server's semaphore or creates a new one
+
+        Args:
+            guild_id (int): id of the server
+            bulk (bool, optional): whether to retrieve the semaphore of bulk extractions. Defaults to False.
+
+        Returns:
+            asyncio.Semaphore: semaphore limiting the server's extractions
+        """
+        semaphores = self.guild_bulk_semaphores if bulk else self.guild_semaphores
+        if guild_id not in semaphores:
+            semaphores[guild_id] = asyncio.Semaphore(self.guild_bulk_limit if bulk else self.guild_limit)
+        return semaphores[guild_id]
+
+    async def extract_info(self, url, guild_id=None, download=False, bulk=False):
+        """
+        Extracts info for the url on the pool
+
+        The timeout only stops the caller from waiting; a worker that is
+        stuck in yt_dlp finishes in the background. Bulk extractions run on
+        their own pool under their own limit, so many songs can be looked up
+        at once without holding up the songs a server is playing.
+
+        Args:
+            url (str): url or search query handed to yt_dlp
+            guild_id (int, optional): server requesting the extraction. Defaults to None.
+            download (bool, optional): whether yt_dlp should download the media. Defaults to False.
+            bulk (bool, optional): whether the extraction is one of many songs added at once. Defaults to False.
+
+        Returns:
+            dict: info dict returned by yt_dlp
+        """
+        loop = asyncio.get_running_loop()
+        executor = self.bulk_executor if bulk else self.executor
+        async with self._semaphore(guild_id, bulk):
+            # includes time spent waiting for a free worker
+            with timer('extraction_seconds'):
+                future = loop.run_in_executor(executor, _extract, url, download)
+                return await asyncio.wait_for(future, self.timeout)
+
+    async def iter_playlist(self, url, page_size=PLAYLIST_PAGE_SIZE):
+        """
+        Reads a playlist and yields it one page at a time
+
+        The whole playlist is one flat extraction on a worker, which hands
+        over pages as yt_dlp reads them, so callers can use entries as they
+        arrive. The worker stays at most PLAYLIST_PAGES_AHEAD pages ahead of
+        the caller and stops once the caller does. Playlists are read on
+        their own pool and do not count towards a server's extraction limit,
+        so adding one never holds up the server's songs. The timeout applies
+        to each page.
+
+        Args:
+            url (str): playlist url
+            page_size (int, optional): entries per page. Defaults to PLAYLIST_PAGE_SIZE.
+
+        Yields:
+            tuple: the playlist title and the list of entries on the page
+        """
+        loop = asyncio.get_running_loop()
+        pages = asyncio.Queue()
+        ahead = threading.Semaphore(PLAYLIST_PAGES_AHEAD)
+        stopped = threading.Event()
+
+        def deliver(title, entries):
+            # waits while the caller is behind, checking now and then whether it gave up
+            while not ahead.acquire(timeout=1):
+                if stopped.is_set():
+                    return False
+            if stopped.is_set():
+                return False
+            loop.call_soon_threadsafe(pages.put_nowait, (title, entries))
+            return True
+
+        future = loop.run_in_executor(self.playlist_executor, _stream_playlist, url, page_size, deliver)
+        # the end of the playlist, or its error, comes after the last page
+        future.add_done_callback(lambda _: pages.put_nowait(None))
+        try:
+            while True:
+                with timer('extraction_seconds'):
+                    page = await asyncio.wait_for(pages.get(), self.timeout)
+                if page is None:
+                    await future
+                    return
+                ahead.release()
+                yield page
+        finally:
+            stopped.set()
+
+    def release_guild(self, guild_id):
+        """
+        Forgets the concurrency state of a server
+
+        Args:
+            guild_id (int): id of the server
+        """
+        self.guild_semaphores.pop(guild_id, None)
+        self.guild_bulk_semaphores.pop(guild_id, None)
+
+    def warm(self):
+        """
+        Starts a worker in the background so the first extraction does not wait for yt_dlp to load
+        """
+        # the pool only starts workers, which import yt_dlp, once it is given work
+        self.executor.submit(_ready)
+
+    def shutdown(self):
+        """
+        Stops the worker pool without waiting for running extractions
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.playlist_executor.shutdown(wait=False, cancel_futures=True)
+        self.bulk_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,306 @@
+import asyncio
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+# how often the event loop lag probe wakes up in seconds
+LAG_PROBE_INTERVAL = 0.1
+
+# file the Prometheus text dump is written to; disabled when unset
+METRICS_FILE = os.environ.get('METRICS_FILE')
+
+# seconds between Prometheus text dumps
+METRICS_INTERVAL = 15
+
+# seconds between stack samples taken by the profiler
+PROFILE_INTERVAL = 0.005
+
+# number of hottest frames included in a profile report
+PROFILE_TOP = 15
+
+
+class Histogram:
+    """
+    Bucketed histogram of durations in seconds, in the shape Prometheus expects
+
+    ...
+
+    Attributes
+    ----------
+    name : str
+        metric name
+    labels : tuple
+        sorted (label, value) pairs
+    counts : list
+        number of observations per bucket
+    total : float
+        sum of all observations
+    count : int
+        number of observations
+
+    Methods
+    -------
+    observe(value)
+        Records an observation
+    percentile(fraction)
+        Estimates a percentile from the buckets
+    """
+    def __init__(self, name, labels=()):
+        """
+        Args:
+            name (str): metric name
+            labels (tuple, optional): sorted (label, value) pairs. Defaults to ().
+        """
+        self.name = name
+        self.labels = labels
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Records an observation
+
+        Args:
+            value (float): observed duration in seconds
+        """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def percentile(self, fraction):
+        """
+        Estimates a percentile from the buckets
+
+        Args:
+            fraction (float): percentile between 0 and 1
+
+        Returns:
+            float: upper bound of the bucket holding the percentile
+        """
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target and seen:
+                return bound
+        return 0.0
+
+
+# every histogram, counter and gauge, keyed by name and labels
+histograms = {}
+counters = collections.Counter()
+gauges = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def histogram(name, **labels):
+    """
+    Retrieves a histogram or creates a new one
+
+    Args:
+        name (str): metric name
+        labels: label values
+
+    Returns:
+        Histogram: the histogram
+    """
+    key = _key(name, labels)
+    if key not in histograms:
+        histograms[key] = Histogram(*key)
+    return histograms[key]
+
+
+def increment(name, amount=1, **labels):
+    """
+    Increases a counter
+
+    Args:
+        name (str): metric name
+        amount (int, optional): amount to add. Defaults to 1.
+        labels: label values
+    """
+    counters[_key(name, labels)] += amount
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets a value that can go up and down, like the number of connected servers
+
+    Args:
+        name (str): metric name
+        value (float): current value
+        labels: label values
+    """
+    gauges[_key(name, labels)] = value
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Records how long the body of a with block takes; works around awaits too
+
+    Args:
+        name (str): metric name
+        labels: label values
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram(name, **labels).observe(time.perf_counter() - start)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{label}="{value}"' for label, value in pairs) + '}'
+
+
+def render_prometheus():
+    """
+    Renders every metric in the Prometheus text exposition format
+
+    Returns:
+        str: the metrics
+    """
+    lines = []
+    typed = set()
+    for kind, values in (('counter', counters), ('gauge', gauges)):
+        for (name, labels), value in sorted(values.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} {kind}')
+                typed.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+    for (name, labels), hist in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} histogram')
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, hist.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {hist.total}')
+        lines.append(f'{name}_count{_format_labels(labels)} {hist.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    """
+    Writes the Prometheus text dump atomically so scrapers never see a partial file
+
+    Args:
+        path (str): destination file
+    """
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(render_prometheus())
+    os.replace(temp_path, path)
+
+
+async def dump_metrics(path, interval=METRICS_INTERVAL, collect=None):
+    """
+    Writes the Prometheus text dump periodically
+
+    Args:
+        path (str): destination file
+        interval (float, optional): seconds between dumps. Defaults to METRICS_INTERVAL.
+        collect (callable, optional): updates gauges before each dump. Defaults to None.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if collect is not None:
+            collect()
+        try:
+            write_prometheus(path)
+        except OSError as error:
+            print(f'Could not write metrics to {path}: {error}')
+
+
+async def monitor_loop_lag(interval=LAG_PROBE_INTERVAL):
+    """
+    Records how late the event loop wakes up a sleeping task
+
+    Lag means some callback held the loop, which delays every guild.
+
+    Args:
+        interval (float, optional): seconds between probes. Defaults to LAG_PROBE_INTERVAL.
+    """
+    loop = asyncio.get_running_loop()
+    lag = histogram('event_loop_lag_seconds')
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag.observe(max(loop.time() - start - interval, 0.0))
+
+
+def sample_stacks(thread_id, seconds, interval=PROFILE_INTERVAL, top=PROFILE_TOP):
+    """
+    Samples the stack of a thread to find where it spends its time
+
+    Blocks for the given number of seconds, so run it off the event loop.
+
+    Args:
+        thread_id (int): ident of the thread to sample
+        seconds (float): how long to sample for
+        interval (float, optional): seconds between samples. Defaults to PROFILE_INTERVAL.
+        top (int, optional): number of frames in the report. Defaults to PROFILE_TOP.
+
+    Returns:
+        str: the hottest frames and how often they were on the stack
+    """
+    own = collections.Counter()
+    inclusive = collections.Counter()
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples += 1
+            seen = set()
+            own[_describe(frame)] += 1
+            while frame is not None:
+                description = _describe(frame)
+                if description not in seen:
+                    inclusive[description] += 1
+                    seen.add(description)
+                frame = frame.f_back
+        time.sleep(interval)
+    if not samples:
+        return 'No samples taken'
+    lines = [f'{samples} samples over {seconds}s', 'self:']
+    lines += [f'{count / samples:6.1%} {where}' for where, count in own.most_common(top)]
+    lines.append('inclusive:')
+    lines += [f'{count / samples:6.1%} {where}' for where, count in inclusive.most_common(top)]
+    return '\n'.join(lines)
+
+
+def _describe(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}'
+
+
+async def profile_loop(seconds):
+    """
+    Samples the event loop thread for a while without blocking it
+
+    Args:
+        seconds (float): how long to sample for
+
+    Returns:
+        str: the profile report
+    """
+    thread_id = threading.get_ident()
+    return await asyncio.get_running_loop().run_in_executor(None, sample_stacks, thread_id, seconds)
@@ -0,0 +1,331 @@
+"""
+Runs the bot as several worker processes that each own a range of shards
+
+Every worker is a normal discord_bot.py process running an AutoShardedBot
+for its shards, so each server's player, queue and caches live in the one
+process that receives its events. Workers dump their metrics to a stats
+directory; the launcher restarts workers that exit and periodically merges
+their metrics into cluster.prom and a health summary.
+
+    python launcher.py --workers 4
+"""
+import argparse
+import math
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+from dotenv import load_dotenv
+
+# seconds discord wants between two shards identifying
+IDENTIFY_DELAY = 5
+
+# seconds between health checks
+HEALTH_INTERVAL = 15
+
+# a worker whose metrics are older than this many seconds is reported as stale
+STALE_AFTER = 60
+
+# first and longest wait in seconds before restarting a worker that exited
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 300
+
+# a worker that ran this long before exiting is restarted without backing off
+HEALTHY_RUN = 600
+
+# gauges that are summed across workers for the health summary
+SUMMED_GAUGES = ('guilds', 'voice_clients', 'players', 'playing')
+
+# a Prometheus sample line: name, optional labels and value
+SAMPLE = re.compile(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})? (.+)$')
+
+
+def recommended_shards(token):
+    """
+    Asks discord how many shards the bot should run
+
+    Args:
+        token (str): bot token
+
+    Returns:
+        int: recommended number of shards, or None if discord could not be reached
+    """
+    try:
+        response = requests.get('https://discord.com/api/v10/gateway/bot',
+                                headers={'Authorization': f'Bot {token}'}, timeout=10)
+        response.raise_for_status()
+        return response.json()['shards']
+    except (requests.RequestException, KeyError, ValueError) as error:
+        print(f'Could not get the recommended shard count: {error}')
+        return None
+
+
+def split_shards(shard_count, workers):
+    """
+    Splits the shards into contiguous ranges, one per worker
+
+    Args:
+        shard_count (int): total number of shards
+        workers (int): number of worker processes
+
+    Returns:
+        list: lists of shard ids
+    """
+    size = math.ceil(shard_count / workers)
+    return [list(range(start, min(start + size, shard_count))) for start in range(0, shard_count, size)]
+
+
+class Worker:
+    """
+    One bot process and the shards it owns
+
+    ...
+
+    Attributes
+    ----------
+    index : int
+        position of the worker
+    shard_ids : list
+        shards the worker runs
+    shard_count : int
+        total number of shards
+    workers : int
+        number of workers sharing the machine
+    metrics_file : str
+        where the worker dumps its metrics
+    process : subprocess.Popen
+        the running process, or None
+    restarts : int
+        number of times the worker was restarted
+    restart_at : float
+        time at which an exited worker is started again, or None
+
+    Methods
+    -------
+    start()
+        Starts the worker's process
+    check()
+        Restarts the worker if its process exited
+    stop()
+        Stops the worker's process
+    """
+    def __init__(self, index, shard_ids, shard_count, stats_dir, workers=1):
+        """
+        Args:
+            index (int): position of the worker
+            shard_ids (list): shards the worker runs
+            shard_count (int): total number of shards
+            stats_dir (str): directory the worker dumps its metrics in
+            workers (int, optional): number of workers sharing the machine. Defaults to 1.
+        """
+        self.index = index
+        self.workers = workers
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.metrics_file = os.path.join(stats_dir, f'worker-{index}.prom')
+        self.process = None
+        self.restarts = 0
+        self.restart_at = None
+        self._started = None
+        self._delay = RESTART_DELAY
+
+    def start(self):
+        """
+        Starts the worker's process
+        """
+        env = dict(os.environ,
+                   SHARD_IDS=','.join(map(str, self.shard_ids)),
+                   SHARD_COUNT=str(self.shard_count),
+                   METRICS_FILE=self.metrics_file)
+        # the audio cache's index is per process, so each worker gets its own part of the directory
+        if os.environ.get('AUDIO_CACHE_DIR'):
+            env['AUDIO_CACHE_DIR'] = os.path.join(os.environ['AUDIO_CACHE_DIR'], f'worker-{self.index}')
+            env['AUDIO_CACHE_SIZE'] = str(int(os.environ.get('AUDIO_CACHE_SIZE', 2 * 1024 ** 3)) // self.workers)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discord_bot.py')
+        self.process = subprocess.Popen([sys.executable, script], env=env)
+        self._started = time.monotonic()
+        self.restart_at = None
+        print(f'Worker {self.index} started with shards {self.shard_ids} as pid {self.process.pid}')
+
+    def check(self):
+        """
+        Schedules a restart when the worker's process exited, backing off if it keeps crashing
+        """
+        now = time.monotonic()
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.restarts += 1
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        if now - self._started > HEALTHY_RUN:
+            self._delay = RESTART_DELAY
+        print(f'Worker {self.index} exited with code {code}, restarting in {self._delay}s')
+        self.restart_at = now + self._delay
+        self._delay = min(self._delay * 2, MAX_RESTART_DELAY)
+
+    @property
+    def alive(self):
+        """
+        bool: whether the worker's process is running
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        """
+        Stops the worker's process, killing it if it does not exit in time
+        """
+        if not self.alive:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def read_metrics(worker):
+    """
+    Reads a worker's metrics, labelling every sample with the worker
+
+    Args:
+        worker (Worker): the worker
+
+    Returns:
+        tuple: list of (name, labels, value) samples, the metric types and the age of the file in seconds,
+        or None if the worker has not dumped any metrics yet
+    """
+    try:
+        with open(worker.metrics_file) as file:
+            text = file.read()
+        age = time.time() - os.path.getmtime(worker.metrics_file)
+    except OSError:
+        return None
+    samples = []
+    types = {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ', 3)
+            types[name] = kind
+            continue
+        match = SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            labels = f'worker="{worker.index}"' + (f',{labels}' if labels else '')
+            samples.append((name, labels, value))
+    return samples, types, age
+
+
+def aggregate(workers, stats_dir):
+    """
+    Merges the workers' metrics into cluster.prom and prints a health summary
+
+    Args:
+        workers (list): every worker
+        stats_dir (str): directory the merged metrics are written to
+    """
+    samples = []
+    types = {}
+    totals = dict.fromkeys(SUMMED_GAUGES, 0)
+    rows = []
+    for worker in workers:
+        metrics = read_metrics(worker)
+        status = 'running' if worker.alive else 'restarting' if worker.process else 'waiting'
+        if metrics is None:
+            rows.append((worker, status, {}))
+            continue
+        worker_samples, worker_types, age = metrics
+        samples.extend(worker_samples)
+        types.update(worker_types)
+        values = {name: float(value) for name, labels, value in worker_samples if name in SUMMED_GAUGES}
+        for name, value in values.items():
+            totals[name] += value
+        if worker.alive and age > STALE_AFTER:
+            status = 'stale'
+        rows.append((worker, status, values))
+
+    families = {}
+    for name, labels, value in samples:
+        # histograms are typed under their base name
+        base = re.sub(r'_(bucket|sum|count)$', '', name) if name not in types else name
+        families.setdefault(base, []).append(f'{name}{{{labels}}} {value}')
+    lines = []
+    # every worker's samples of a metric have to be listed together
+    for base, family in families.items():
+        if base in types:
+            lines.append(f'# TYPE {base} {types[base]}')
+        lines.extend(family)
+    for name, value in totals.items():
+        lines.append(f'cluster_{name} {value:g}')
+    temp_path = os.path.join(stats_dir, 'cluster.prom.tmp')
+    with open(temp_path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, os.path.join(stats_dir, 'cluster.prom'))
+
+    print(f"{'worker':>6} {'pid':>7} {'shards':<12} {'status':<10} {'restarts':>8} "
+          + ' '.join(f'{name:>13}' for name in SUMMED_GAUGES))
+    for worker, status, values in rows:
+        shards = f'{worker.shard_ids[0]}-{worker.shard_ids[-1]}'
+        pid = worker.process.pid if worker.process else '-'
+        print(f'{worker.index:>6} {pid:>7} {shards:<12} {status:<10} {worker.restarts:>8} '
+              + ' '.join(f'{values.get(name, 0):>13g}' for name in SUMMED_GAUGES))
+    print(f"{'total':>6} {'':>7} {'':<12} {'':<10} {'':>8} "
+          + ' '.join(f'{totals[name]:>13g}' for name in SUMMED_GAUGES))
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of bot processes (default: number of cores)')
+    parser.add_argument('--shards', type=int, default=None,
+                        help="total number of shards (default: discord's recommendation, at least one per worker)")
+    parser.add_argument('--stats-dir', default='stats', help='directory for metrics and the cluster summary')
+    parser.add_argument('--interval', type=float, default=HEALTH_INTERVAL, help='seconds between health checks')
+    args = parser.parse_args()
+
+    shard_count = args.shards or max(recommended_shards(os.environ.get('TOKEN')) or 1, args.workers)
+    os.makedirs(args.stats_dir, exist_ok=True)
+    ranges = split_shards(shard_count, args.workers)
+    workers = [Worker(index, shard_ids, shard_count, args.stats_dir, len(ranges))
+               for index, shard_ids in enumerate(ranges)]
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        # shards in different processes still share discord's identify limit, so workers start one at a time
+        pending = list(workers)
+        next_start = 0
+        last_report = time.monotonic()
+        while not stopping:
+            now = time.monotonic()
+            if pending and now >= next_start:
+                worker = pending.pop(0)
+                worker.start()
+                next_start = now + IDENTIFY_DELAY * len(worker.shard_ids)
+            for worker in workers:
+                if worker.process is not None:
+                    worker.check()
+            if now - last_report >= args.interval:
+                aggregate(workers, args.stats_dir)
+                last_report = now
+            time.sleep(1)
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import audioop
+import math
+import os
+
+from discord import AudioSource, ClientException
+from discord.opus import Encoder
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# whether songs are normalized towards TARGET_LOUDNESS before the volume is applied
+NORMALIZE_LOUDNESS = os.environ.get('NORMALIZE_LOUDNESS', '1').lower() not in ('0', 'false', 'no')
+
+# loudness songs are normalized to, in dB relative to full scale like LUFS
+TARGET_LOUDNESS = -14.0
+
+# frames below this loudness are treated as silence and do not move the gain, like the R128 absolute gate
+SILENCE_GATE = -70.0
+
+# frames in the window loudness is measured over, 3 seconds like R128 short-term loudness
+LOUDNESS_WINDOW = 150
+
+# most the normalization may boost a quiet song, in dB
+MAX_BOOST = 12.0
+
+# fraction of the distance to the desired gain covered each frame, so gain changes are gradual
+GAIN_SMOOTHING = 0.02
+
+# the same ceiling PCMVolumeTransformer applies
+MAX_VOLUME = 2.0
+
+# number of 16 bit samples in a frame
+FRAME_SAMPLES = Encoder.FRAME_SIZE // 2
+
+# mean square of a full scale sine wave, the 0 dB reference
+FULL_SCALE_POWER = 32768.0 ** 2 / 2
+
+
+class GainSource(AudioSource):
+    """
+    Replacement for discord.PCMVolumeTransformer that also normalizes loudness
+
+    Loudness is measured like EBU R128 short-term loudness, without the
+    K-weighting filter, over a sliding window of recent frames. Silent
+    frames are gated out. The gain moves smoothly towards the level that
+    brings the window to TARGET_LOUDNESS, and the volume is applied on
+    top of it. With NumPy, every frame is processed in buffers allocated
+    once per source. Without it, audioop does the same work in C.
+
+    ...
+
+    Attributes
+    ----------
+    original : discord.AudioSource
+        the wrapped PCM source
+    volume : float
+        gain applied after normalization, like PCMVolumeTransformer.volume
+    normalize : bool
+        whether loudness is normalized
+    gain : float
+        current normalization gain
+
+    Methods
+    -------
+    read()
+        Returns the next frame with gain applied
+    cleanup()
+        Cleans up the wrapped source
+    """
+    def __init__(self, original, volume=1.0, normalize=NORMALIZE_LOUDNESS):
+        """
+        Args:
+            original (discord.AudioSource): the PCM source to wrap
+            volume (float, optional): gain applied after normalization. Defaults to 1.0.
+            normalize (bool, optional): whether loudness is normalized. Defaults to NORMALIZE_LOUDNESS.
+        """
+        if original.is_opus():
+            raise ClientException('AudioSource must not be Opus encoded.')
+        self.original = original
+        self.volume = volume
+        self.normalize = normalize
+        self.gain = 1.0
+        # mean squares of the recent frames that passed the gate, kept as a ring with a running sum
+        self._powers = [0.0] * LOUDNESS_WINDOW
+        self._power_index = 0
+        self._power_count = 0
+        self._power_sum = 0.0
+        self._gate = FULL_SCALE_POWER * 10 ** (SILENCE_GATE / 10)
+        self._max_gain = 10 ** (MAX_BOOST / 20)
+        if numpy is not None:
+            self._samples = numpy.empty(FRAME_SAMPLES, dtype=numpy.float32)
+            self._output = numpy.empty(FRAME_SAMPLES, dtype=numpy.int16)
+
+    @property
+    def volume(self):
+        """
+        float: gain applied after normalization, capped like PCMVolumeTransformer
+        """
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = min(max(value, 0.0), MAX_VOLUME)
+
+    def _track_power(self, power):
+        """
+        Adds the mean square of a frame to the window and moves the gain towards the target
+
+        Args:
+            power (float): mean square of the frame's samples
+        """
+        if power < self._gate:
+            return
+        self._power_sum += power - self._powers[self._power_index]
+        self._powers[self._power_index] = power
+        self._power_index = (self._power_index + 1) % LOUDNESS_WINDOW
+        self._power_count = min(self._power_count + 1, LOUDNESS_WINDOW)
+        mean = max(self._power_sum / self._power_count, self._gate)
+        loudness = 10 * math.log10(mean / FULL_SCALE_POWER)
+        desired = min(10 ** ((TARGET_LOUDNESS - loudness) / 20), self._max_gain)
+        self.gain += (desired - self.gain) * GAIN_SMOOTHING
+
+    def read(self):
+        data = self.original.read()
+        # the last frame of a stream can be short, and is passed through
+        if len(data) != Encoder.FRAME_SIZE:
+            return data
+        if numpy is None:
+            if self.normalize:
+                self._track_power(audioop.rms(data, 2) ** 2)
+            return audioop.mul(data, 2, self._volume * self.gain)
+        samples = self._samples
+        numpy.copyto(samples, numpy.frombuffer(data, dtype=numpy.int16))
+        if self.normalize:
+            self._track_power(float(numpy.dot(samples, samples)) / FRAME_SAMPLES)
+        samples *= self._volume * self.gain
+        numpy.clip(samples, -32768, 32767, out=samples)
+        numpy.copyto(self._output, samples, casting='unsafe')
+        # the encoder needs bytes, which is the only copy made per frame
+        return self._output.tobytes()
+
+    def cleanup(self):
+        self.original.cleanup()
@@ -0,0 +1,146 @@
+import math
+import random
+
+
+class Countdown:
+    """
+    Decides which messages win a random chance with one random draw per win instead of one per message
+
+    The number of losing messages before the next win is drawn from the
+    geometric distribution, which gives every message the same chance as
+    rolling for each of them.
+
+    ...
+
+    Attributes
+    ----------
+    chance : float
+        probability that a message wins
+    remaining : int
+        messages left to lose before the next win
+
+    Methods
+    -------
+    roll()
+        Returns whether the current message wins
+    """
+    def __init__(self, chance, rng=random):
+        """
+        Args:
+            chance (float): probability that a message wins, between 0 and 1
+            rng (random.Random, optional): source of randomness. Defaults to the random module.
+        """
+        self.chance = chance
+        self._rng = rng
+        self.remaining = self._draw()
+
+    def _draw(self):
+        """
+        Draws the number of losing messages before the next win
+
+        Returns:
+            int: number of losses
+        """
+        if self.chance >= 1:
+            return 0
+        # 1 - random() is never 0, so the logarithm is defined
+        return int(math.log(1 - self._rng.random()) / math.log(1 - self.chance))
+
+    def roll(self):
+        """
+        Returns whether the current message wins
+
+        Returns:
+            bool: whether the message wins
+        """
+        if self.remaining:
+            self.remaining -= 1
+            return False
+        self.remaining = self._draw()
+        return True
+
+
+class MessageRouter:
+    """
+    Cheap first stage for every message the bot sees
+
+    Messages from servers are passed to the handlers configured for every
+    server and for that server in particular. Only messages starting with
+    the command prefix go on to the command framework, so plain chat never
+    pays for building a command context. Direct messages skip the server
+    handlers but can still run commands.
+
+    ...
+
+    Attributes
+    ----------
+    bot : discord.ext.commands.Bot
+        processes the commands
+    prefix : str
+        start of every command
+    default_handlers : list
+        coroutine functions taking the message that run for every server
+    handlers : dict
+        maps server ids to lists of extra handlers for that server
+
+    Methods
+    -------
+    add_handler(handler, guild_id=None)
+        Runs a handler for every message of one or every server
+    remove_handler(handler, guild_id=None)
+        Stops running a handler
+    dispatch(message)
+        Runs the handlers of a message and its command if it has one
+    """
+    def __init__(self, bot, prefix):
+        """
+        Args:
+            bot (discord.ext.commands.Bot): processes the commands
+            prefix (str): start of every command
+        """
+        self.bot = bot
+        self.prefix = prefix
+        self.default_handlers = []
+        self.handlers = {}
+
+    def add_handler(self, handler, guild_id=None):
+        """
+        Runs a handler for every message of one or every server
+
+        Args:
+            handler (callable): coroutine function taking the message
+            guild_id (int, optional): server the handler is for. Defaults to None, which means every server.
+        """
+        if guild_id is None:
+            self.default_handlers.append(handler)
+        else:
+            self.handlers.setdefault(guild_id, []).append(handler)
+
+    def remove_handler(self, handler, guild_id=None):
+        """
+        Stops running a handler
+
+        Args:
+            handler (callable): the handler
+            guild_id (int, optional): server it was added for. Defaults to None, which means every server.
+        """
+        handlers = self.default_handlers if guild_id is None else self.handlers.get(guild_id, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if guild_id is not None and not handlers:
+            self.handlers.pop(guild_id, None)
+
+    async def dispatch(self, message):
+        """
+        Runs the handlers of a message and its command if it has one
+
+        Args:
+            message (discord.Message): message the bot received
+        """
+        if message.guild is not None:
+            for handler in self.default_handlers:
+                await handler(message)
+            for handler in self.handlers.get(message.guild.id, ()):
+                await handler(message)
+        if message.content.startswith(self.prefix):
+            await self.bot.process_commands(message)
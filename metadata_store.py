@@ -0,0 +1,341 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# path of the sqlite database; the store is disabled when unset
+METADATA_DB = os.environ.get('METADATA_DB')
+
+# pending writes that trigger a flush
+WRITE_BATCH_SIZE = 50
+
+# seconds a pending write waits before being flushed anyway
+FLUSH_INTERVAL = 10
+
+# maximum number of tracks and queries kept on disk
+MAX_STORED_TRACKS = 50000
+MAX_STORED_QUERIES = 50000
+
+# fraction of the maximum kept after compaction so it does not run on every flush
+COMPACT_TARGET = 0.9
+
+# fields of a queue entry that are persisted
+TRACK_FIELDS = ('id', 'ie_key', 'title', 'duration', 'url', 'thumbnails')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT PRIMARY KEY,
+    ids TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_last_used ON tracks (last_used);
+CREATE INDEX IF NOT EXISTS queries_last_used ON queries (last_used);
+"""
+
+
+def compact_entry(entry):
+    """
+    Strips a yt_dlp entry down to the fields that are persisted
+
+    Args:
+        entry (dict): queue entry produced by yt_dlp
+
+    Returns:
+        dict: entry with only TRACK_FIELDS
+    """
+    return {field: entry.get(field) for field in TRACK_FIELDS}
+
+
+class MetadataStore:
+    """
+    SQLite backed track metadata store that survives restarts
+
+    The database is opened lazily on first use and only touched from one
+    dedicated thread, so lookups never block the event loop. Writes are
+    buffered and committed in batches, along with the last use of the rows
+    read since the previous batch, so reads never commit. Old rows are
+    deleted once the tables grow past their limits.
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+        location of the sqlite database
+    max_tracks : int
+        maximum number of stored tracks
+    max_queries : int
+        maximum number of stored queries
+
+    Methods
+    -------
+    get_query(query)
+        Returns the entries stored for a normalized query
+    get_track(video_id)
+        Returns the entry stored for a video id
+    put_query(query, entries)
+        Buffers a query and its entries for writing
+    put_track(entry)
+        Buffers an entry for writing
+    flush()
+        Writes all buffered rows and last uses
+    close()
+        Flushes and closes the database
+    """
+    def __init__(self, path, max_tracks=MAX_STORED_TRACKS, max_queries=MAX_STORED_QUERIES):
+        """
+        Args:
+            path (str): location of the sqlite database
+            max_tracks (int, optional): maximum number of stored tracks. Defaults to MAX_STORED_TRACKS.
+            max_queries (int, optional): maximum number of stored queries. Defaults to MAX_STORED_QUERIES.
+        """
+        self.path = path
+        self.max_tracks = max_tracks
+        self.max_queries = max_queries
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='metadata-store')
+        self._conn = None
+        self._pending_tracks = {}
+        self._pending_queries = {}
+        # maps rows read since the last flush to when they were last used
+        self._used_tracks = {}
+        self._used_queries = {}
+        self._flush_task = None
+        # flushes started by full batches, kept so they are not garbage collected while they run
+        self._batch_flushes = set()
+
+    def _connect(self):
+        """
+        Opens the database on first use; only called from the store's thread
+
+        Returns:
+            sqlite3.Connection: the open connection
+        """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    async def _run(self, func, *args):
+        """
+        Runs a database function on the store's thread
+
+        Args:
+            func (callable): function taking the connection as its first argument
+
+        Returns:
+            the function's result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._connect(), *args))
+
+    @staticmethod
+    def _load_tracks(conn, ids):
+        """
+        Reads stored tracks
+
+        Args:
+            conn (sqlite3.Connection): open connection
+            ids (list): video ids to read
+
+        Returns:
+            dict: maps the found video ids to their entries
+        """
+        rows = {}
+        for video_id in ids:
+            row = conn.execute('SELECT data FROM tracks WHERE id = ?', (video_id,)).fetchone()
+            if row is not None:
+                rows[video_id] = json.loads(row[0])
+        return rows
+
+    @staticmethod
+    def _load_query(conn, query):
+        """
+        Reads the entries stored for a query
+
+        Args:
+            conn (sqlite3.Connection): open connection
+            query (str): normalized query
+
+        Returns:
+            list: stored entries, or None if the query is unknown
+        """
+        row = conn.execute('SELECT ids FROM queries WHERE query = ?', (query,)).fetchone()
+        if row is None:
+            return None
+        ids = json.loads(row[0])
+        tracks = MetadataStore._load_tracks(conn, ids)
+        # a partially compacted query is treated as missing
+        if len(tracks) != len(ids):
+            return None
+        return [tracks[video_id] for video_id in ids]
+
+    async def get_query(self, query):
+        """
+        Returns the entries stored for a normalized query
+
+        Args:
+            query (str): normalized query
+
+        Returns:
+            list: stored entries, or None if the query is unknown
+        """
+        if query in self._pending_queries:
+            ids = self._pending_queries[query]
+            if all(video_id in self._pending_tracks for video_id in ids):
+                return [self._pending_tracks[video_id] for video_id in ids]
+        entries = await self._run(self._load_query, query)
+        if entries is not None:
+            now = time.time()
+            self._used_queries[query] = now
+            for entry in entries:
+                self._used_tracks[entry['id']] = now
+            self._schedule_flush()
+        return entries
+
+    async def get_track(self, video_id):
+        """
+        Returns the entry stored for a video id
+
+        Args:
+            video_id (str): youtube video id
+
+        Returns:
+            dict: stored entry, or None if the video is unknown
+        """
+        if video_id in self._pending_tracks:
+            return self._pending_tracks[video_id]
+        rows = await self._run(self._load_tracks, [video_id])
+        if video_id in rows:
+            self._used_tracks[video_id] = time.time()
+            self._schedule_flush()
+        return rows.get(video_id)
+
+    def put_track(self, entry):
+        """
+        Buffers an entry for writing
+
+        Args:
+            entry (dict): queue entry produced by yt_dlp
+        """
+        if entry and entry.get('id'):
+            self._pending_tracks[entry['id']] = compact_entry(entry)
+            self._schedule_flush()
+
+    def put_query(self, query, entries):
+        """
+        Buffers a query and its entries for writing
+
+        Args:
+            query (str): normalized query
+            entries (list): queue entries returned for the query
+        """
+        entries = [entry for entry in entries if entry and entry.get('id')]
+        for entry in entries:
+            self._pending_tracks[entry['id']] = compact_entry(entry)
+        self._pending_queries[query] = [entry['id'] for entry in entries]
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """
+        Flushes right away once a batch of writes is full, otherwise after FLUSH_INTERVAL
+        """
+        if len(self._pending_tracks) + len(self._pending_queries) >= WRITE_BATCH_SIZE:
+            task = asyncio.create_task(self.flush())
+            self._batch_flushes.add(task)
+            task.add_done_callback(self._batch_flushes.discard)
+            task.add_done_callback(self._report_failure)
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+            self._flush_task.add_done_callback(self._report_failure)
+
+    def _report_failure(self, task):
+        """
+        Prints why a background flush failed, since nothing awaits it
+
+        Args:
+            task (asyncio.Task): the finished flush
+        """
+        if not task.cancelled() and task.exception() is not None:
+            print(f'Could not write metadata to {self.path}: {task.exception()}')
+
+    async def _delayed_flush(self):
+        """
+        Flushes once FLUSH_INTERVAL has passed
+        """
+        await asyncio.sleep(FLUSH_INTERVAL)
+        self._flush_task = None
+        await self.flush()
+
+    def _write(self, conn, tracks, queries, used_tracks, used_queries):
+        """
+        Commits a batch of rows and last uses, and compacts the tables
+
+        Args:
+            conn (sqlite3.Connection): open connection
+            tracks (dict): maps video ids to entries
+            queries (dict): maps normalized queries to lists of video ids
+            used_tracks (dict): maps video ids read since the last batch to when they were last used
+            used_queries (dict): maps normalized queries read since the last batch to when they were last used
+        """
+        now = time.time()
+        conn.executemany('UPDATE tracks SET last_used = ? WHERE id = ?',
+                         [(used, video_id) for video_id, used in used_tracks.items()])
+        conn.executemany('UPDATE queries SET last_used = ? WHERE query = ?',
+                         [(used, query) for query, used in used_queries.items()])
+        conn.executemany('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?)',
+                         [(video_id, json.dumps(data), now) for video_id, data in tracks.items()])
+        conn.executemany('INSERT OR REPLACE INTO queries VALUES (?, ?, ?)',
+                         [(query, json.dumps(ids), now) for query, ids in queries.items()])
+        self._compact(conn, 'tracks', self.max_tracks)
+        self._compact(conn, 'queries', self.max_queries)
+        conn.commit()
+
+    @staticmethod
+    def _compact(conn, table, limit):
+        """
+        Deletes the least recently used rows of a table that grew past its limit
+
+        Args:
+            conn (sqlite3.Connection): open connection
+            table (str): table name
+            limit (int): maximum number of rows
+        """
+        count = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        if count > limit:
+            excess = count - int(limit * COMPACT_TARGET)
+            conn.execute(f'DELETE FROM {table} WHERE rowid IN '
+                         f'(SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)', (excess,))
+
+    async def flush(self):
+        """
+        Writes all buffered rows and last uses
+        """
+        if not (self._pending_tracks or self._pending_queries or self._used_tracks or self._used_queries):
+            return
+        tracks, self._pending_tracks = self._pending_tracks, {}
+        queries, self._pending_queries = self._pending_queries, {}
+        used_tracks, self._used_tracks = self._used_tracks, {}
+        used_queries, self._used_queries = self._used_queries, {}
+        await self._run(self._write, tracks, queries, used_tracks, used_queries)
+
+    async def close(self):
+        """
+        Flushes and closes the database
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        # running batches finish on the store's thread before it is shut down
+        await asyncio.gather(*self._batch_flushes, return_exceptions=True)
+        await self.flush()
+        if self._conn is not None:
+            await self._run(lambda conn: conn.close())
+            self._conn = None
+        self._executor.shutdown(wait=True)
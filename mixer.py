@@ -0,0 +1,286 @@
+import audioop
+import math
+import os
+import threading
+from collections import deque
+
+from discord import AudioSource, ClientException
+from discord.opus import Encoder
+
+from audio_source import FRAME_SECONDS
+from instrumentation import increment
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# seconds of decoded audio buffered ahead of the voice client; 0 plays sources directly without the mixer
+BUFFER_SECONDS = float(os.environ.get('AUDIO_BUFFER_SECONDS', 3))
+
+# seconds over which one song fades into the next; 0 switches songs without a gap but without fading
+CROSSFADE_SECONDS = float(os.environ.get('CROSSFADE_SECONDS', 2))
+
+# number of 16 bit samples in a frame
+FRAME_SAMPLES = Encoder.FRAME_SIZE // 2
+
+# played when the buffer runs dry in the middle of a song
+SILENCE = bytes(Encoder.FRAME_SIZE)
+
+
+class Mixer(AudioSource):
+    """
+    Source played by the voice client that buffers decoded frames and crossfades between songs
+
+    A reader thread keeps a ring of frames, allocated once per mixer,
+    filled from the current song, so a slow read from ffmpeg does not
+    stall the voice thread. A frame that is not ready in time is replaced
+    by silence and counted as an underrun. When a song's stream ends the
+    mixer calls notify with 'stream_drained' and keeps playing what is
+    buffered. A source handed to queue() in the meantime is mixed over the
+    buffered end of the song in one batch, and notify is called with
+    'crossfaded' once the voice client reaches it. Without one, the mixer
+    ends once the buffer is empty.
+
+    ...
+
+    Attributes
+    ----------
+    capacity : int
+        number of frames the ring holds
+    fade_frames : int
+        number of frames two songs overlap for
+    underruns : int
+        frames replaced by silence because the buffer was empty
+    error : Exception
+        error reading the song that ended the mixer, or None
+
+    Methods
+    -------
+    queue(source)
+        Hands over the next song after the current one's stream ended
+    finish()
+        Lets the mixer end once the current song's buffered frames are played
+    read()
+        Returns the next frame
+    is_opus()
+        Always False, since frames have to be decoded to be mixed
+    cleanup()
+        Stops the reader thread and cleans up the songs' sources it still holds
+    """
+    def __init__(self, source, notify, buffer=BUFFER_SECONDS, crossfade=CROSSFADE_SECONDS):
+        """
+        Args:
+            source (audio_source.WarmSource): the first song's PCM source
+            notify (callable): called from the mixer's threads with the event name, the mixer and the song's source
+            buffer (float, optional): seconds of audio buffered ahead. Defaults to BUFFER_SECONDS.
+            crossfade (float, optional): seconds two songs overlap for. Defaults to CROSSFADE_SECONDS.
+        """
+        if source.is_opus():
+            raise ClientException('AudioSource must not be Opus encoded.')
+        self.notify = notify
+        self.fade_frames = int(crossfade / FRAME_SECONDS)
+        # the ring always holds a whole fade, so the end of a song can be mixed in place
+        self.capacity = max(int(buffer / FRAME_SECONDS), self.fade_frames, 1)
+        self.underruns = 0
+        self.error = None
+        self._ring = bytearray(self.capacity * Encoder.FRAME_SIZE)
+        if numpy is not None:
+            self._frames = numpy.frombuffer(self._ring, dtype=numpy.int16).reshape(self.capacity, FRAME_SAMPLES)
+        # frames ever written to and read from the ring; their difference is the number buffered
+        self._written = 0
+        self._read = 0
+        # (first frame, source) of songs the voice client has not reached yet
+        self._boundaries = deque()
+        self._source = source
+        self._incoming = None
+        self._draining = False
+        self._ended = False
+        self._stopped = False
+        self._started = False
+        self._cond = threading.Condition()
+        threading.Thread(target=self._fill, name='mixer', daemon=True).start()
+
+    def _fill(self):
+        """
+        Runs on the reader thread and keeps the ring full until the last song ends
+        """
+        while True:
+            with self._cond:
+                while self._written - self._read >= self.capacity and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                source = self._source
+            try:
+                data = source.read()
+            except Exception as error:
+                self.error = error
+                data = b''
+            if data:
+                with self._cond:
+                    self._write(data)
+                    self._cond.notify_all()
+                continue
+            if self.error is None and self._next_song(source):
+                continue
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+            return
+
+    def _write(self, data):
+        """
+        Copies a frame into the ring, padding the short last frame of a stream; the lock must be held
+
+        Args:
+            data (bytes): PCM frame
+        """
+        offset = self._written % self.capacity * Encoder.FRAME_SIZE
+        self._ring[offset:offset + len(data)] = data
+        if len(data) < Encoder.FRAME_SIZE:
+            self._ring[offset + len(data):offset + Encoder.FRAME_SIZE] = SILENCE[len(data):]
+        self._written += 1
+
+    def _next_song(self, source):
+        """
+        Waits for the next song once a stream ended and mixes its first frames over the end of the current one
+
+        Args:
+            source (audio_source.WarmSource): the source whose stream ended
+
+        Returns:
+            bool: whether the mixer moved on to a next song
+        """
+        with self._cond:
+            self._draining = True
+        self.notify('stream_drained', self, source)
+        with self._cond:
+            # the buffer running dry first means the next song came too late
+            while self._incoming is None and self._draining and not self._stopped:
+                self._cond.wait()
+            incoming, self._incoming = self._incoming, None
+            self._draining = False
+            if incoming is None or self._stopped:
+                return False
+        # reading happens outside the lock, while the voice client keeps playing the buffered end
+        frames = []
+        while len(frames) < self.fade_frames:
+            try:
+                data = incoming.read()
+            except Exception:
+                # the error comes up again on the next read and ends the mixer there
+                break
+            if not data:
+                break
+            frames.append(data.ljust(Encoder.FRAME_SIZE, b'\0'))
+        with self._cond:
+            overlap = min(len(frames), self._written - self._read)
+            start = self._written - overlap
+            if overlap:
+                self._crossfade(start, frames[:overlap])
+            for data in frames[overlap:]:
+                self._write(data)
+            self._boundaries.append((start, incoming))
+            self._source = incoming
+            self._cond.notify_all()
+        return True
+
+    def _crossfade(self, start, frames):
+        """
+        Mixes frames of the next song over buffered frames of the current one; the lock must be held
+
+        Equal power curves are used, so the loudness does not dip halfway
+        through the fade.
+
+        Args:
+            start (int): index of the first buffered frame to mix over
+            frames (list): PCM frames of the next song, one per buffered frame
+        """
+        count = len(frames)
+        slots = [(start + i) % self.capacity for i in range(count)]
+        if numpy is not None:
+            tail = self._frames[slots].astype(numpy.float32)
+            head = numpy.frombuffer(b''.join(frames), dtype=numpy.int16).reshape(count, FRAME_SAMPLES)
+            angles = numpy.linspace(0, math.pi / 2, count * FRAME_SAMPLES, dtype=numpy.float32).reshape(tail.shape)
+            tail *= numpy.cos(angles)
+            tail += head * numpy.sin(angles)
+            numpy.clip(tail, -32768, 32767, out=tail)
+            self._frames[slots] = tail.astype(numpy.int16)
+            return
+        for i, slot in enumerate(slots):
+            angle = (i + 0.5) / count * math.pi / 2
+            offset = slot * Encoder.FRAME_SIZE
+            tail = bytes(self._ring[offset:offset + Encoder.FRAME_SIZE])
+            self._ring[offset:offset + Encoder.FRAME_SIZE] = audioop.add(
+                audioop.mul(tail, 2, math.cos(angle)), audioop.mul(frames[i], 2, math.sin(angle)), 2)
+
+    def queue(self, source):
+        """
+        Hands over the next song after the current one's stream ended
+
+        Args:
+            source (audio_source.WarmSource): the next song's PCM source
+
+        Returns:
+            bool: whether the mixer took the song, which it does not once its buffer ran dry
+        """
+        if source.is_opus():
+            return False
+        with self._cond:
+            if not self._draining or self._stopped:
+                return False
+            self._incoming = source
+            self._cond.notify_all()
+        return True
+
+    def finish(self):
+        """
+        Lets the mixer end once the current song's buffered frames are played
+        """
+        with self._cond:
+            self._draining = False
+            self._cond.notify_all()
+
+    def read(self):
+        switched = None
+        with self._cond:
+            # the first frame may take as long as ffmpeg needs to start
+            while not self._started and self._written == self._read and not self._ended and not self._stopped:
+                self._cond.wait()
+            if self._written == self._read and not self._ended and not self._draining:
+                self._cond.wait(FRAME_SECONDS)
+            if self._written == self._read:
+                if self._ended or self._draining or self._stopped:
+                    # a song that is still waited for comes too late, and plays after a normal gap instead
+                    self._draining = False
+                    self._cond.notify_all()
+                    return b''
+                self.underruns += 1
+                increment('audio_underruns_total')
+                return SILENCE
+            self._started = True
+            offset = self._read % self.capacity * Encoder.FRAME_SIZE
+            data = bytes(self._ring[offset:offset + Encoder.FRAME_SIZE])
+            self._read += 1
+            if self._boundaries and self._boundaries[0][0] < self._read:
+                switched = self._boundaries.popleft()[1]
+            self._cond.notify_all()
+        if switched is not None:
+            self.notify('crossfaded', self, switched)
+        return data
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        with self._cond:
+            self._stopped = True
+            sources = [self._source, self._incoming] + [source for _, source in self._boundaries]
+            self._incoming = None
+            self._boundaries.clear()
+            self._cond.notify_all()
+        # the player cleans up the same sources when it hears the mixer ended, which does nothing the second time
+        for source in sources:
+            if source is not None:
+                source.cleanup()
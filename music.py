@@ -1,16 +1,40 @@
 import discord
 from discord.ext import commands
 import asyncio
-from discord.utils import get
-import yt_dlp
-import random
-import math
+import os
+from audio_cache import AUDIO_CACHE_DIR, DOWNLOAD_TIMEOUT, AudioCache, download_options
+from audio_source import WarmSource
+from blocklist import BlockList
+from cache import TTLCache, normalize_query
+from extraction import ExtractionService
+from loudness import NORMALIZE_LOUDNESS, TARGET_LOUDNESS, GainSource
+import instrumentation
+from instrumentation import increment, set_gauge, timer
+from metadata_store import METADATA_DB, MetadataStore
+from outbox import Outbox
+from player import GuildPlayer
+from prefetch import EXPIRY_MARGIN, song_key, url_expiry
+from queue_view import QueuePages
+from resolver import Query, classify
+from session_store import SESSION_DB, SessionStore
+from track import Track
+from voice_presence import HumanCounter
+import time
+
+# ffmpeg log level; debug output is large, so it is only worth enabling while troubleshooting
+FFMPEG_LOGLEVEL = os.environ.get('FFMPEG_LOGLEVEL', 'warning')
 
 ffmpeg_options = {
     'options': '-vn',
-    "before_options": "-loglevel debug -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+    "before_options": f"-loglevel {FFMPEG_LOGLEVEL} -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
 }
 
+# sends the stream to discord as Opus encoded by ffmpeg instead of encoding PCM in python
+OPUS_PASSTHROUGH = os.environ.get('OPUS_PASSTHROUGH', '').lower() in ('1', 'true', 'yes')
+
+# bitrate in kbps of Opus encoded by ffmpeg
+OPUS_BITRATE = 128
+
 ydl_opts = {
     'format': 'bestaudio/best',
     'restrictfilenames': True,
@@ -28,42 +52,176 @@ ydl_opts = {
 # controls volume of AudioSource
 VOLUME_CONTROL = 0.1
 
-# determines size of each page for queue command
-QUEUE_PAGE_SIZE = 10
+# highest volume the volume command accepts, in percent of VOLUME_CONTROL
+MAX_VOLUME_PERCENT = 200
+
+# most queries the addmany command takes at once
+MAX_BULK_QUERIES = 100
+
+def stream_options(source, start=0):
+    """
+    Returns the ffmpeg options for a stream, leaving out the network ones for local files
 
-# causes queue message to timeout at this time
-Q_TIMEOUT = 30
+    Args:
+        source (dict): info dict of the stream
+        start (float, optional): seconds into the stream to start at. Defaults to 0.
 
-# causes bot to disconnect after queue empties after some time
-EMPTY_TIMEOUT = 5
+    Returns:
+        dict: ffmpeg options
+    """
+    if source.get('local'):
+        options = {'options': ffmpeg_options['options'], 'before_options': f'-loglevel {FFMPEG_LOGLEVEL}'}
+    else:
+        options = dict(ffmpeg_options)
+    # seeking before the input lets ffmpeg ask the server for the right byte range instead of decoding up to it
+    if start:
+        options['before_options'] = f"{options['before_options']} -ss {start:.2f}"
+    return options
 
 class SongQueue(asyncio.Queue):
     """
-    Subclass of asyncio.Queue that allows for putting items in front of underlying deque
+    Subclass of asyncio.Queue backed by a BlockList so songs can be removed, moved and paged cheaply
 
     ...
 
     Attributes
     ----------
-    _put(item)
-        Overridden from asyncio.Queue; appends left if item is a tuple and appends to back otherwise
+    version : int
+        increases whenever the songs change, so views of the queue know when they are stale
+
+    Methods
+    -------
+    _init(maxsize)
+        Overridden from asyncio.Queue; stores the songs in a BlockList
+    put_front(item)
+        Puts an item in front of every other item
+    page(start, stop)
+        Returns the songs between start and stop
+    remove(index)
+        Removes and returns the song at index
+    move(src, dst)
+        Moves the song at src to dst
+    jump(index)
+        Drops every song before index
+    dedupe()
+        Removes songs that are already queued earlier
+    shuffle()
+        Shuffles the queue
+    clear()
+        Removes every song
         
     """
     def __init__(self):
+        self.version = 0
         super().__init__()
-        
-    def _put(self, item):
+
+    def _init(self, maxsize):
         """
-        Overridden from asyncio.Queue; appends left if item is a tuple and appends to back otherwise
+        Overridden from asyncio.Queue; stores the songs in a BlockList
         https://github.com/python/cpython/blob/3.10/Lib/asyncio/queues.py
-        
+
         Args:
-            item (tuple or str): item to be appended to queue
+            maxsize (int): unused, song queues are unbounded
         """
-        if isinstance(item, tuple):
-            self._queue.appendleft(item[0])
-        else:
-            self._queue.append(item)
+        self._queue = BlockList()
+
+    def _put(self, item):
+        """
+        Overridden from asyncio.Queue; appends a song and marks the queue as changed
+        """
+        self.version += 1
+        self._queue.append(item)
+
+    def _get(self):
+        """
+        Overridden from asyncio.Queue; pops the next song and marks the queue as changed
+        """
+        self.version += 1
+        return self._queue.popleft()
+
+    def put_front(self, item):
+        """
+        Puts an item in front of every other item, waking a waiting consumer like put_nowait
+
+        Args:
+            item (track.Track): song to play next
+        """
+        self.version += 1
+        self._queue.appendleft(item)
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._wakeup_next(self._getters)
+
+    def page(self, start, stop):
+        """
+        Returns the songs between start and stop
+
+        Args:
+            start (int): first position
+            stop (int): position after the last one
+
+        Returns:
+            list: the songs in the range
+        """
+        return self._queue.slice(start, stop)
+
+    def remove(self, index):
+        """
+        Removes and returns the song at index
+
+        Args:
+            index (int): position of the song
+
+        Returns:
+            track.Track: the removed song
+        """
+        self.version += 1
+        return self._queue.pop(index)
+
+    def move(self, src, dst):
+        """
+        Moves the song at src to dst
+
+        Args:
+            src (int): current position of the song
+            dst (int): new position of the song
+        """
+        self.version += 1
+        self._queue.move(src, dst)
+
+    def jump(self, index):
+        """
+        Drops every song before index so it is the next one played
+
+        Args:
+            index (int): position of the song to play next
+        """
+        self.version += 1
+        self._queue.drop(index)
+
+    def dedupe(self):
+        """
+        Removes songs that are already queued earlier
+
+        Returns:
+            int: number of removed songs
+        """
+        self.version += 1
+        return self._queue.dedupe(song_key)
+
+    def shuffle(self):
+        """
+        Shuffles the queue
+        """
+        self.version += 1
+        self._queue.shuffle()
+
+    def clear(self):
+        """
+        Removes every song
+        """
+        self.version += 1
+        self._queue.clear()
             
 class Music(commands.Cog):
     """
@@ -75,20 +233,66 @@ class Music(commands.Cog):
     ----------
     bot : discord.ext.commands.Bot
         a representation of the bot
-    ydl : youtube_dl.YoutubeDL
-        used for retrieving the audio from youtube videos
-    servers : dict
-        stores all of the async components required to handle playing music
+    extractor : extraction.ExtractionService
+        retrieves the audio from youtube videos without blocking the event loop, built on first use
+    players : dict
+        maps server ids to the player.GuildPlayer handling their music
+    search_cache : cache.TTLCache
+        maps normalized queries to lists of tracks, shared between servers
+    metadata_cache : cache.TTLCache
+        maps video ids to tracks, shared between servers
+    stream_cache : cache.TTLCache
+        maps video ids to resolved audio streams, shared between servers
+    metadata_store : metadata_store.MetadataStore
+        optional on-disk copy of search results that survives restarts
+    voice_presence : voice_presence.HumanCounter
+        counts the human users in the voice channels the bot is in
+    monitor_tasks : list
+        background tasks recording metrics
+    audio_cache : audio_cache.AudioCache
+        optional directory of downloaded audio for frequently played songs
+    outboxes : dict
+        maps channel ids to the outbox.Outbox scheduling the bot's messages there
+    queue_pages : dict
+        maps server ids to the queue_view.QueuePages shared by their queue messages
+    session_store : session_store.SessionStore
+        optional file of every server's queue and settings that survives restarts
 
 
     Methods
     -------
     
     HELPER METHODS-
-    get_server_info(ctx)
-        Retrieves server async components or creates new ones
+    outbox(channel)
+        Retrieves the outbox of a channel
+    collect_gauges()
+        Records how much this process is serving
+    get_player(ctx)
+        Retrieves the server's player or starts a new one
+    restore_session(ctx)
+        Brings back the server's queue and settings from before a restart
+    snapshot_sessions()
+        Saves the state of the players that changed since the last snapshot
+    get_queue_pages(ctx)
+        Retrieves the pages of the server's queue
+    player_exited(player)
+        Forgets a player whose task ended so idle servers are garbage collected
+    create_audio_source(source, volume, start)
+        Creates the AudioSource for a resolved stream
+    create_opus_source(source, volume, start)
+        Creates an AudioSource that hands Opus packets from ffmpeg straight to discord
     connect_to_user(ctx)
         Handles connecting bot to the user's voice channel
+    lookup(ctx, query, bulk)
+        Retrieves the tracks of a query from the caches or yt_dlp
+    cache_tracks(entries)
+        Converts yt_dlp entries to tracks and remembers them by video id
+    cache_video(info)
+        Remembers a fully extracted song and the stream it resolved to
+    add_playlist(ctx, url)
+        Queues the first page of a playlist and keeps adding the rest in the background
+    ingest_playlist(player, pages, message, title, total)
+        Adds the remaining pages of a playlist while reporting progress
     add_to_queue(ctx, *params)
         Adds songs to queue
     disconnect(guild)
@@ -103,10 +307,20 @@ class Music(commands.Cog):
     COMMANDS-
     add(ctx, *params)
         Queues song query without automatically playing
+    addmany(ctx, *params)
+        Queues a list of song queries separated by semicolons, looking them up in parallel
     play(ctx, *params)
         Queues song query and plays from queue if not currently playing
     shuffle(ctx)
         Shuffles the song queue
+    remove(ctx, index)
+        Removes a song from the queue
+    move(ctx, src, dst)
+        Moves a song to a different position in the queue
+    jump(ctx, index)
+        Skips ahead to a song in the queue
+    dedupe(ctx)
+        Removes duplicate songs from the queue
     play_error(ctx, error)
         Handles errors with the play command
     pause(ctx)
@@ -115,12 +329,20 @@ class Music(commands.Cog):
         Skips the current song
     loop(ctx)
         Loop the current song
+    volume(ctx, percent)
+        Shows or changes the server's volume
     queue(ctx)
         Sends an embedded message that contains the songs currently loaded on the queue
     connect(ctx)
         Connects to user's voice channel
     dc(ctx)
         Disconnects bot from current voice channel. Also, deletes server information (clears queue, etc.)
+    cachestats(ctx)
+        Sends the hit/miss counters of the shared caches
+    stats(ctx)
+        Sends timing percentiles of the hot paths
+    profile(ctx, seconds)
+        Samples the event loop for a while and sends the hottest frames
         
     """
     def __init__(self, bot):
@@ -129,31 +351,281 @@ class Music(commands.Cog):
             bot (discord.ext.commands.Bot): a representation of the bot
         """
         self.bot = bot
-        self.ydl = yt_dlp.YoutubeDL(ydl_opts)
-        self.servers = {}
+        self._extractor = None
+        self.players = {}
+        self.search_cache = TTLCache()
+        self.metadata_cache = TTLCache()
+        self.stream_cache = TTLCache()
+        self.metadata_store = MetadataStore(METADATA_DB) if METADATA_DB else None
+        self.voice_presence = HumanCounter()
+        self.monitor_tasks = []
+        self.outboxes = {}
+        self.queue_pages = {}
+        self.session_store = SessionStore(SESSION_DB) if SESSION_DB else None
+        # downloads get their own worker so they never hold up searches
+        self.audio_cache = AudioCache(AUDIO_CACHE_DIR, ExtractionService(
+            download_options(ydl_opts, AUDIO_CACHE_DIR), workers=1, mode='thread',
+            timeout=DOWNLOAD_TIMEOUT)) if AUDIO_CACHE_DIR else None
+
+    @property
+    def extractor(self):
+        """
+        extraction.ExtractionService: the extraction pool, built when the first music command needs it
+        """
+        if self._extractor is None:
+            self._extractor = ExtractionService(ydl_opts)
+            # yt_dlp loads on a worker while the command is still being handled
+            self._extractor.warm()
+        return self._extractor
+
+    async def cog_load(self):
+        """
+        Starts the event loop lag monitor and the metrics dump when the cog is added
+        """
+        self.monitor_tasks.append(asyncio.create_task(instrumentation.monitor_loop_lag()))
+        if instrumentation.METRICS_FILE:
+            self.monitor_tasks.append(asyncio.create_task(
+                instrumentation.dump_metrics(instrumentation.METRICS_FILE, collect=self.collect_gauges)))
+        if self.session_store:
+            self.monitor_tasks.append(asyncio.create_task(self.session_store.run(self.snapshot_sessions)))
+
+    async def cog_unload(self):
+        """
+        Stops the extraction workers, the monitors and saves pending metadata and sessions when the cog is removed
+        """
+        for task in self.monitor_tasks:
+            task.cancel()
+        # the players are still running here, so this is the state a restart brings back
+        if self.session_store:
+            self.snapshot_sessions()
+            await self.session_store.close()
+        if self._extractor:
+            self._extractor.shutdown()
+        if self.audio_cache:
+            self.audio_cache.close()
+        if self.metadata_store:
+            await self.metadata_store.close()
     
-    def get_server_info(self, ctx):
+    async def cog_check(self, ctx):
+        """
+        Rejects music commands sent in direct messages, which have no server to play in
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+
+        Returns:
+            bool: always True for commands sent in a server
         """
-        Retrieves server async components or creates new ones
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+        return True
+
+    async def cog_before_invoke(self, ctx):
+        """
+        Restores the server's session from before a restart the first time it uses a music command
 
         Args:
             ctx (discord.ext.commands.Context): context related to command call
+        """
+        if self.session_store and ctx.guild.id not in self.players:
+            await self.restore_session(ctx)
+
+    def outbox(self, channel):
+        """
+        Retrieves the outbox of a channel, which is forgotten once everything is sent and its rate limit recovered
+
+        Args:
+            channel (discord.abc.Messageable): where the messages go
 
         Returns:
-            dict: Returns the objects managing server music
+            outbox.Outbox: schedules the bot's messages to the channel
+        """
+        outbox = self.outboxes.get(channel.id)
+        if outbox is None:
+            outbox = self.outboxes[channel.id] = Outbox(channel, self.outbox_idle)
+        return outbox
+
+    def outbox_idle(self, outbox):
+        """
+        Forgets an outbox that has nothing left to send once its rate limit has fully recovered
+
+        A new outbox starts without any recent calls, so forgetting one any
+        earlier would let the next burst to the channel go past discord's rate limit.
+
+        Args:
+            outbox (outbox.Outbox): the idle outbox
+        """
+        # an outbox given more output calls this again once it is sent
+        if self.outboxes.get(outbox.channel.id) is not outbox or not outbox.idle:
+            return
+        delay = outbox.refill_delay()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.outbox_idle, outbox)
+        else:
+            del self.outboxes[outbox.channel.id]
+
+    def collect_gauges(self):
+        """
+        Records how much this process is serving, which a sharded launcher adds up across processes
+        """
+        set_gauge('guilds', len(self.bot.guilds))
+        set_gauge('voice_clients', len(self.bot.voice_clients))
+        set_gauge('players', len(self.players))
+        set_gauge('playing', sum(1 for vc in self.bot.voice_clients if vc.is_playing()))
+        # AutoShardedBot reports one latency per shard
+        for shard_id, latency in getattr(self.bot, 'latencies', [(self.bot.shard_id or 0, self.bot.latency)]):
+            set_gauge('gateway_latency_seconds', latency, shard=shard_id)
+        set_gauge('heartbeat_timestamp_seconds', time.time())
+
+    def get_player(self, ctx):
+        """
+        Retrieves the server's player or starts a new one
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+
+        Returns:
+            player.GuildPlayer: the player handling the server's music
         """
         # uses server id as key
-        if not self.servers.get(ctx.guild.id):
-            self.servers[ctx.guild.id] = {
-                'q': SongQueue(),
-                'event': asyncio.Event(),
-                'lock': asyncio.Lock(),
-                'current_song': '',
-                'loop': False,
-                'timeout': False
-            }
-        info = self.servers.get(ctx.guild.id)
-        return info
+        player = self.players.get(ctx.guild.id)
+        if player is None or player.task.done():
+            player = GuildPlayer(self, ctx.guild, SongQueue(), self.player_exited, VOLUME_CONTROL).start()
+            self.players[ctx.guild.id] = player
+        return player
+
+    def get_queue_pages(self, ctx):
+        """
+        Retrieves the pages of the server's queue, replacing them if the server got a new player
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+
+        Returns:
+            queue_view.QueuePages: pages shared by the server's queue messages
+        """
+        queue = self.get_player(ctx).queue
+        pages = self.queue_pages.get(ctx.guild.id)
+        if pages is None or pages.queue is not queue:
+            if pages is not None:
+                pages.stop()
+            pages = self.queue_pages[ctx.guild.id] = QueuePages(ctx.guild.id, queue)
+        return pages
+
+    async def restore_session(self, ctx):
+        """
+        Brings back the server's queue and settings from before a restart
+
+        The song that was playing goes back to the front of the queue. Nothing
+        starts playing until someone uses the play command.
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+        """
+        session = await self.session_store.take(ctx.guild.id)
+        if session is None:
+            return
+        songs = ([session['current']] if session['current'] else []) + session['songs']
+        player = self.get_player(ctx)
+        # the new player is idle, so its settings can be set directly
+        player.loop = session['loop']
+        player.volume = session['volume']
+        player.channel = ctx.guild.get_channel(session['channel']) if session['channel'] else None
+        for track in songs:
+            if track.id:
+                self.metadata_cache.set(track.id, track)
+        if songs:
+            player.enqueue(songs)
+            self.outbox(ctx.channel).send(
+                f"Restored {len(songs)} song{'' if len(songs) == 1 else 's'} from before the restart!")
+
+    def snapshot_sessions(self):
+        """
+        Saves the state of the players that changed since the last snapshot
+        """
+        for guild_id, player in self.players.items():
+            signature = (id(player.queue), player.queue.version, id(player.current_song), player.loop,
+                         player.volume, player.channel.id if player.channel else None)
+            self.session_store.save(guild_id, signature, lambda player=player: {
+                'current': player.current_song,
+                'songs': player.queue.page(0, player.queue.qsize()),
+                'loop': player.loop,
+                'volume': player.volume,
+                'channel': player.channel.id if player.channel else None,
+            })
+
+    def player_exited(self, player):
+        """
+        Forgets a player whose task ended so idle servers are garbage collected
+
+        Args:
+            player (player.GuildPlayer): the player that stopped
+        """
+        if self.players.get(player.guild.id) is player:
+            del self.players[player.guild.id]
+            # a pool that was never built has nothing to forget
+            if self._extractor is not None:
+                self._extractor.release_guild(player.guild.id)
+            # players only exit when they leave on purpose, so their session is not restored
+            if self.session_store:
+                self.session_store.forget(player.guild.id)
+            # buttons of old queue messages stop working along with the queue they page
+            pages = self.queue_pages.pop(player.guild.id, None)
+            if pages is not None:
+                pages.stop()
+
+    def create_audio_source(self, source, volume=VOLUME_CONTROL, start=0):
+        """
+        Creates the AudioSource for a resolved stream
+
+        Args:
+            source (dict): info dict of the stream
+            volume (float, optional): the server's volume. Defaults to VOLUME_CONTROL.
+            start (float, optional): seconds into the stream to start at. Defaults to 0.
+
+        Returns:
+            audio_source.WarmSource: AudioSource object with adjustable volume that can be warmed before playing
+        """
+        if OPUS_PASSTHROUGH:
+            try:
+                audio_source = self.create_opus_source(source, volume, start)
+                increment('streams_total', mode='opus')
+                return WarmSource(audio_source, start)
+            except Exception as error:
+                print(f'Falling back to PCM for {source.get("title")}: {error}')
+                increment('opus_fallbacks_total')
+        updated_options = stream_options(source, start)
+        audio_source = discord.FFmpegPCMAudio(source['url'], **updated_options)
+        audio_source = GainSource(audio_source, volume)
+        increment('streams_total', mode='pcm')
+        return WarmSource(audio_source, start)
+
+    def create_opus_source(self, source, volume=VOLUME_CONTROL, start=0):
+        """
+        Creates an AudioSource that hands Opus packets from ffmpeg straight to discord
+
+        Discord skips its own decode, volume and encode steps for these
+        sources, so ffmpeg applies the volume and loudness normalization.
+        Opus streams are copied without re-encoding when neither is needed.
+
+        Args:
+            source (dict): info dict of the stream
+            volume (float, optional): the server's volume. Defaults to VOLUME_CONTROL.
+            start (float, optional): seconds into the stream to start at. Defaults to 0.
+
+        Returns:
+            discord.FFmpegOpusAudio: AudioSource object producing Opus packets
+        """
+        filters = [f'volume={volume}'] if volume != 1 else []
+        if NORMALIZE_LOUDNESS:
+            filters.insert(0, f'loudnorm=I={TARGET_LOUDNESS}')
+        updated_options = stream_options(source, start)
+        options = updated_options['options']
+        if filters:
+            options = f"{options} -filter:a {','.join(filters)}"
+        codec = 'copy' if source.get('acodec') == 'opus' and not filters else None
+        return discord.FFmpegOpusAudio(source['url'], bitrate=OPUS_BITRATE, codec=codec,
+                                       before_options=updated_options['before_options'], options=options)
     
     async def connect_to_user(self, ctx):
         """
@@ -175,10 +647,135 @@ class Music(commands.Cog):
         return True
     
     
+    async def lookup(self, ctx, query, bulk=False):
+        """
+        Retrieves the tracks of a query from the caches or yt_dlp
+
+        Links are classified locally, so a link to a known video costs no
+        extraction and differently written links to one song share a cache
+        entry. The time taken is recorded per kind of query.
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            query (resolver.Query): classified search terms or link given by the user
+            bulk (bool, optional): whether the query is one of many added at once. Defaults to False.
+
+        Returns:
+            list: tracks of the link or search results
+        """
+        with timer('resolve_seconds', kind=query.kind):
+            tracks, source = await self._resolve(ctx, query, bulk)
+        increment('resolutions_total', kind=query.kind, source=source)
+        return tracks
+
+    async def _resolve(self, ctx, query, bulk=False):
+        """
+        Untimed body of lookup
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            query (resolver.Query): classified query
+            bulk (bool, optional): whether the query is one of many added at once. Defaults to False.
+
+        Returns:
+            tuple: the tracks and where they came from, 'memory', 'store' or 'extract'
+        """
+        if query.kind in ('video', 'id'):
+            track = self.metadata_cache.get(query.key)
+            if track is not None:
+                return [track], 'memory'
+            if self.metadata_store:
+                entry = await self.metadata_store.get_track(query.key)
+                if entry is not None:
+                    return self.cache_tracks([entry]), 'store'
+            try:
+                info = await self.extractor.extract_info(query.url, guild_id=ctx.guild.id, bulk=bulk)
+            except Exception:
+                # a word shaped like a video id is searched for when there is no such video
+                if query.kind == 'id':
+                    return await self._resolve(ctx, Query('search', query.key, query.key), bulk)
+                raise
+            return self.cache_video(info), 'extract'
+
+        # searches keep their old keys so results stored on disk are still found
+        key = normalize_query(query.key) if query.kind == 'search' else f'{query.kind}:{query.key}'
+        tracks = self.search_cache.get(key)
+        if tracks is not None:
+            return tracks, 'memory'
+
+        # search results are also kept on disk if the store is enabled
+        entries = None
+        if self.metadata_store and query.kind == 'search':
+            entries = await self.metadata_store.get_query(key)
+        if entries is not None:
+            source = 'store'
+        else:
+            source = 'extract'
+            info = await self.extractor.extract_info(
+                f'ytsearch:{query.url}' if query.kind == 'search' else query.url, guild_id=ctx.guild.id, bulk=bulk)
+            if 'entries' not in info:
+                tracks = self.cache_video(info)
+                self.search_cache.set(key, tracks)
+                return tracks, source
+            entries = info['entries']
+            if self.metadata_store and query.kind == 'search':
+                self.metadata_store.put_query(key, entries)
+
+        tracks = self.cache_tracks(entries)
+        self.search_cache.set(key, tracks)
+        return tracks, source
+
+    def cache_video(self, info):
+        """
+        Remembers a fully extracted song, including the stream it resolved to, so playing it needs no second extraction
+
+        Args:
+            info (dict): info dict of one song produced by yt_dlp
+
+        Returns:
+            list: the song's track
+        """
+        tracks = self.cache_tracks([info])
+        if not tracks:
+            return tracks
+        track = tracks[0]
+        # the prefetcher would resolve the song to this same stream
+        if info.get('url'):
+            self.stream_cache.set(song_key(track), info, expires=url_expiry(info['url']) - EXPIRY_MARGIN)
+        if self.metadata_store and track.ie_key != 'Soundcloud':
+            self.metadata_store.put_track(dict(info, url=track.url, ie_key=track.ie_key))
+        return tracks
+
+    def cache_tracks(self, entries):
+        """
+        Converts yt_dlp entries to tracks and remembers them by video id
+
+        Args:
+            entries (list): entries produced by yt_dlp
+
+        Returns:
+            list: the converted tracks
+        """
+        tracks = [Track.from_entry(entry) for entry in entries if entry]
+        for track in tracks:
+            if track.id:
+                self.metadata_cache.set(track.id, track)
+        return tracks
+    
     async def add_to_queue(self, ctx, *params):
         """
         Adds songs to queue
 
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+        """
+        with timer('handler_seconds', handler='add_to_queue'):
+            await self._add_to_queue(ctx, *params)
+
+    async def _add_to_queue(self, ctx, *params):
+        """
+        Untimed body of add_to_queue
+
         Args:
             ctx (discord.ext.commands.Context): context related to command call
         """
@@ -187,31 +784,86 @@ class Music(commands.Cog):
         if not connected:
             return
         
-        # gets server's async components
-        server_info = self.get_server_info(ctx)
-        q, lock = server_info['q'], server_info['lock']
+        # gets server's player
+        player = self.get_player(ctx)
         
         # retrieves youtube links if params are given
         if params:
+            query = ' '.join(params)
+            resolved = classify(query)
+            # playlists are added page by page instead of all at once
+            if resolved.kind in ('playlist', 'soundcloud_set'):
+                await self.add_playlist(ctx, resolved.url)
+                return
             try:
-                query = ' '.join(params)
-                # assumes only soundcloud and youtube are available
-                # TODO link verification? handle variety of links
-                is_link = 'list=' in query or 'soundcloud.com' in query or 'youtube.com' in query
-                info = self.ydl.extract_info(f"{'' if is_link else 'ytsearch:'}{query}", download=False)
-                await ctx.send(f"Added song to queue!")
+                tracks = await self.lookup(ctx, resolved)
+                # a burst of adds is reported in one message
+                self.outbox(ctx.channel).send("Added song to queue!", kind='added',
+                                              plural=lambda count: f"Added {count} songs to queue!")
             except:
-                ctx.send('Error in finding song')
+                self.outbox(ctx.channel).send('Error in finding song')
                 return
-            # lock ensures that only one person is affecting the queue at a time
-            async with lock:
-                server_info["timeout"] = False
-                if is_link:
-                    await q.put(info)
-                else:
-                    for entry in info['entries']:
-                        await q.put(entry)
-    
+            player.enqueue(tracks)
+
+    async def add_playlist(self, ctx, url):
+        """
+        Queues the first page of a playlist and keeps adding the rest in the background
+
+        Playback can start as soon as the first page is queued. Progress is
+        reported by editing a single message.
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            url (str): playlist url
+        """
+        player = self.get_player(ctx)
+        pages = self.extractor.iter_playlist(url)
+        try:
+            title, entries = await pages.__anext__()
+        except StopAsyncIteration:
+            await ctx.send('Playlist is empty!')
+            return
+        except Exception:
+            await ctx.send('Error in finding playlist')
+            return
+        tracks = self.cache_tracks(entries)
+        player.enqueue(tracks)
+        message = await self.outbox(ctx.channel).send_now(f"Adding playlist {title}: {len(tracks)} songs queued so far...")
+
+        task = asyncio.create_task(self.ingest_playlist(player, pages, message, title, len(tracks)))
+        player.ingest_tasks.add(task)
+        task.add_done_callback(player.ingest_tasks.discard)
+
+    async def ingest_playlist(self, player, pages, message, title, total):
+        """
+        Adds the remaining pages of a playlist while reporting progress
+
+        The progress edits go through the channel's current outbox, which
+        debounces them, rather than one kept from the start, so they share
+        the channel's rate limit with everything else sent there.
+
+        Args:
+            player (player.GuildPlayer): the server's player
+            pages (async generator): remaining pages from ExtractionService.iter_playlist
+            message (discord.Message): progress message to edit
+            title (str): playlist title
+            total (int): number of songs queued so far
+        """
+        try:
+            async for title, entries in pages:
+                tracks = self.cache_tracks(entries)
+                player.enqueue(tracks)
+                total += len(tracks)
+                content = f"Adding playlist {title}: {total} songs queued so far..."
+                self.outbox(message.channel).edit(message, content=content)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            content = f"Stopped adding playlist {title} after {total} songs"
+        else:
+            content = f"Added {total} songs from playlist {title}!"
+        self.outbox(message.channel).edit(message, content=content)
+
     async def disconnect(self, guild):
         """
         Handles disconnecting bot AFTER confirming voice protocol
@@ -220,9 +872,11 @@ class Music(commands.Cog):
         Args:
             guild (discord.Guild): guild related to function call
         """
-        await guild.voice_client.disconnect()
-        if guild.id in self.servers:
-            del self.servers[guild.id]
+        player = self.players.get(guild.id)
+        if player is not None:
+            await player.ask('disconnect')
+        else:
+            await guild.voice_client.disconnect()
     
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before: discord.VoiceChannel, after):
@@ -232,16 +886,35 @@ class Music(commands.Cog):
 
         This event triggers for a variety of voice state changes, the only 
         important one of which is when a user leaves the channel that the 
-        bot is currently in.
+        bot is currently in. Only the gateway cache is used, so no
+        HTTP requests are made here.
         
         Args:
             member (discord.Member): the user
             before (discord.VoiceState): the previous voice state of the user
             after (discord.VoiceState): the resulting voice state of the user
         """
+        with timer('handler_seconds', handler='voice_state_update'):
+            await self._on_voice_state_update(member, before, after)
+
+    async def _on_voice_state_update(self, member, before, after):
+        """
+        Untimed body of on_voice_state_update
+
+        Args:
+            member (discord.Member): the user
+            before (discord.VoiceState): the previous voice state of the user
+            after (discord.VoiceState): the resulting voice state of the user
+        """
+        self.voice_presence.update(member, before, after)
         
-        # ignores bots
+        # ignores bots, but starts counting the humans wherever this bot ends up
         if member.bot:
+            if member.id == self.bot.user.id:
+                if before.channel:
+                    self.voice_presence.forget(before.channel.id)
+                if after.channel:
+                    self.voice_presence.track(after.channel)
             return
         
         # if the user just joined a chat, nothing happens
@@ -249,7 +922,7 @@ class Music(commands.Cog):
             return
         
         # if the bot is not connected to before's guild, exit
-        bot_vc = get(self.bot.voice_clients, guild=before.channel.guild)
+        bot_vc = before.channel.guild.voice_client
         if bot_vc is None:
             return
         
@@ -261,16 +934,8 @@ class Music(commands.Cog):
         if after.channel and before.channel.id == after.channel.id:
             return
         
-        # counts the number of real users in the voice chat
-        user_found = False
-        for channel_member in before.channel.voice_states.keys():
-            user = await self.bot.fetch_user(channel_member)
-            if not user.bot:
-                user_found = True
-                break
-        
-        # is there is only one or no real users, disconnect
-        if not user_found:
+        # if there are no real users left, disconnect
+        if self.voice_presence.humans(before.channel) == 0:
             await self.disconnect(before.channel.guild)    
     
     @commands.command(name="add", aliases=['a'])
@@ -284,6 +949,70 @@ class Music(commands.Cog):
         """
         await self.add_to_queue(ctx, *params)
         
+    @commands.command(name='addmany', aliases=['am'])
+    async def addmany(self, ctx, *params):
+        """
+        Queues a list of song queries separated by semicolons, looking them up in parallel
+
+        Songs are queued in the order they were listed as soon as every
+        song before them is found, and one summary is sent at the end.
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            params: command parameters that store the queries
+        """
+        with timer('handler_seconds', handler='addmany'):
+            queries = [query.strip() for query in ' '.join(params).split(';') if query.strip()]
+            if not queries:
+                await ctx.send("Give me songs separated by semicolons!")
+                return
+            if not await self.connect_to_user(ctx):
+                return
+            player = self.get_player(ctx)
+            skipped = queries[MAX_BULK_QUERIES:]
+            queries = queries[:MAX_BULK_QUERIES]
+
+            # results are lists of tracks, or the reason a query failed
+            results = [None] * len(queries)
+            queued = 0
+
+            def enqueue_ready():
+                """
+                Queues the finished results that every earlier query is also done for
+                """
+                nonlocal queued
+                tracks = []
+                while queued < len(results) and results[queued] is not None:
+                    if isinstance(results[queued], list):
+                        tracks.extend(results[queued])
+                    queued += 1
+                if tracks:
+                    player.enqueue(tracks)
+
+            async def resolve(index, query):
+                """
+                Looks up one query and queues whatever is ready in order
+                """
+                resolved = classify(query)
+                if resolved.kind in ('playlist', 'soundcloud_set'):
+                    results[index] = 'playlists have to be added on their own'
+                else:
+                    try:
+                        results[index] = await self.lookup(ctx, resolved, bulk=True)
+                    except Exception:
+                        results[index] = 'not found'
+                enqueue_ready()
+
+            # cached songs are found at once, while extractions run on the bulk pool under the server's bulk limit
+            await asyncio.gather(*(resolve(index, query) for index, query in enumerate(queries)))
+
+            added = sum(len(result) for result in results if isinstance(result, list))
+            lines = [f"Added {added} song{'' if added == 1 else 's'} to queue!"]
+            lines.extend(f"{query}: {result}" for query, result in zip(queries, results) if isinstance(result, str))
+            if skipped:
+                lines.append(f"Only the first {MAX_BULK_QUERIES} songs were added, {len(skipped)} left out")
+            await ctx.send('\n'.join(lines)[:2000])
+
     @commands.command(name='play', aliases=['p'])
     async def play(self, ctx, *params):
         """
@@ -293,71 +1022,12 @@ class Music(commands.Cog):
             ctx (discord.ext.commands.Context): context related to command call
             params: command parameters that stores the query information
         """
-        await self.add_to_queue(ctx, *params)
+        with timer('handler_seconds', handler='play'):
+            await self.add_to_queue(ctx, *params)
 
-        # if bot is paused, continue playing
-        if ctx.voice_client and ctx.voice_client.is_paused():
-            ctx.voice_client.resume()
-            
-        # gets server's async components
-        server_info = self.get_server_info(ctx)
-        q, event, lock = server_info['q'], server_info['event'], server_info['lock']
-        
-        # exits early if client is already playing
-        if ctx.voice_client.is_playing(): # TODO does resume make it play right away? What about small gaps between songs?
-            return
-
-        # continues until the song queue is empty
-        while not q.empty():
-            # uses event to communicate when current song is done playing
-            event.clear()
-            
-            # if the bot is currently connected, play a song
-            # otherwise, clear the queue
+            # the player resumes if paused and otherwise starts playing if it is not already
             if ctx.voice_client:
-                # handles loop command logic
-                async with lock:
-                    song = server_info['current_song'] if server_info['loop'] else await q.get()
-                    server_info['current_song'] = song
-                
-                # extracts audio stream and creates AudioSource object with adjustable volume
-                if song.get('ie_key') == 'Soundcloud':
-                    source = self.ydl.extract_info(song['url'], download=False)
-                else:
-                    source = self.ydl.extract_info(f"https://www.youtube.com/watch?v={song['id']}", download=False)
-
-                updated_options = dict(ffmpeg_options)
-                audio_source = discord.FFmpegPCMAudio(source['url'], **updated_options)
-                audio_source = discord.PCMVolumeTransformer(audio_source)
-                audio_source.volume = VOLUME_CONTROL
-                
-                # handles errors where two songs are played simultaneously
-                try:
-                    ctx.guild.voice_client.play(audio_source, after = lambda _: event.set())
-                    await ctx.send(f"Now playing: {source['title']}")
-                except:
-                    async with lock:
-                        await q.put((song))
-                        
-                await event.wait()
-                audio_source.cleanup()
-            else:
-                q._init(0)
-        else:
-            async def timeout():
-                await asyncio.sleep(EMPTY_TIMEOUT)
-                async with lock:
-                    if server_info["timeout"]:
-                        await ctx.send("Queue is empty, so I'm leaving. See you next time!")
-                        if ctx.voice_client is not None:
-                            await self.disconnect(ctx.guild)
-
-            async with lock:
-                if server_info["timeout"]:
-                    return
-                server_info["timeout"] = True
-            
-            await timeout()
+                self.get_player(ctx).tell('play', ctx.channel)
 
     @commands.command()
     async def shuffle(self, ctx):
@@ -367,14 +1037,70 @@ class Music(commands.Cog):
         Args:
             ctx (discord.ext.commands.Context): context related to command call
         """
-        info = self.get_server_info(ctx)
-        q, lock = info['q'], info['lock']
-        
-        # waits for other queue transaction to be done before shuffling
-        async with lock:
-            random.shuffle(q._queue)
+        await self.get_player(ctx).ask('shuffle')
         await ctx.send("Shuffled queue!")
 
+    @commands.command(name='remove', aliases=['rm'])
+    async def remove(self, ctx, index: int):
+        """
+        Removes a song from the queue
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            index (int): position of the song as shown by the queue command
+        """
+        player = self.get_player(ctx)
+        if not 1 <= index <= player.queue.qsize():
+            await ctx.send("Invalid song number!")
+            return
+        song = await player.ask('remove', index - 1)
+        await ctx.send(f"Removed {song.title} from the queue!")
+
+    @commands.command(name='move', aliases=['mv'])
+    async def move(self, ctx, src: int, dst: int):
+        """
+        Moves a song to a different position in the queue
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            src (int): current position of the song as shown by the queue command
+            dst (int): new position of the song
+        """
+        player = self.get_player(ctx)
+        size = player.queue.qsize()
+        if not (1 <= src <= size and 1 <= dst <= size):
+            await ctx.send("Invalid song number!")
+            return
+        await player.ask('move', src - 1, dst - 1)
+        await ctx.send(f"Moved song {src} to position {dst}!")
+
+    @commands.command(name='jump', aliases=['j'])
+    async def jump(self, ctx, index: int):
+        """
+        Skips ahead to a song in the queue, dropping the songs before it
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            index (int): position of the song as shown by the queue command
+        """
+        player = self.get_player(ctx)
+        if not 1 <= index <= player.queue.qsize():
+            await ctx.send("Invalid song number!")
+            return
+        await player.ask('jump', index - 1)
+        await ctx.send(f"Jumped to song {index}!")
+
+    @commands.command()
+    async def dedupe(self, ctx):
+        """
+        Removes duplicate songs from the queue, keeping the first copy of each
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+        """
+        removed = await self.get_player(ctx).ask('dedupe')
+        await ctx.send(f"Removed {removed} duplicate song{'' if removed == 1 else 's'}!")
+
     @play.error
     async def play_error(self, ctx, error):
         """
@@ -397,8 +1123,7 @@ class Music(commands.Cog):
         """
         if ctx.voice_client is None:
             await ctx.send("Bot is not connected.")
-        elif ctx.voice_client.is_playing():
-            ctx.voice_client.pause()
+        elif await self.get_player(ctx).ask('pause'):
             await ctx.send("Music is paused!")
         else:
             await ctx.send("No music is playing right now!")
@@ -413,8 +1138,7 @@ class Music(commands.Cog):
         """
         if ctx.voice_client is None:
             await ctx.send("Bot is not connected.")
-        elif ctx.voice_client.is_playing():
-            ctx.voice_client.stop()
+        elif await self.get_player(ctx).ask('skip'):
             await ctx.send("Song skipped!")
         else:
             await ctx.send("Invalid command!")
@@ -428,19 +1152,30 @@ class Music(commands.Cog):
             ctx (discord.ext.commands.Context): context related to command call
         """
         if ctx.voice_client and ctx.voice_client.is_playing():
-            info = self.get_server_info(ctx)
-            async with info['lock']:
-                loop_setting = not info['loop']
-                info['loop'] = loop_setting
-                title = info['current_song']['title']
-            await ctx.send(f"Loop {'en' if loop_setting else 'dis'}abled for song {title}")
-            # adds current song back to queue to start loop
-            async with info['lock']:
-                if loop_setting and info['q'].empty():
-                    await info['q'].put(info['current_song'])
+            loop_setting, song = await self.get_player(ctx).ask('loop')
+            await ctx.send(f"Loop {'en' if loop_setting else 'dis'}abled for song {song.title}")
         else:
             await ctx.send("Nothing is playing")
 
+    @commands.command(name='volume', aliases=['vol'])
+    async def volume(self, ctx, percent: int = None):
+        """
+        Shows or changes the server's volume, where 100 is the default
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            percent (int, optional): new volume. Defaults to None, which shows the current one.
+        """
+        player = self.get_player(ctx)
+        if percent is None:
+            await ctx.send(f"Volume is {round(player.volume / VOLUME_CONTROL * 100)}%")
+        elif not 0 <= percent <= MAX_VOLUME_PERCENT:
+            await ctx.send(f"Volume must be between 0 and {MAX_VOLUME_PERCENT}!")
+        elif await player.ask('volume', VOLUME_CONTROL * percent / 100):
+            await ctx.send(f"Volume set to {percent}%!")
+        else:
+            await ctx.send(f"Volume set to {percent}%, starting with the next song!")
+
     @commands.command(name='queue', aliases=['q'])
     async def queue(self, ctx):
         """
@@ -449,81 +1184,15 @@ class Music(commands.Cog):
         Args:
             ctx (discord.ext.commands.Context): context related to command call
         """
-        info = self.get_server_info(ctx)
-        
-        # used to decide which songs are displayed on the current page of the embed message
-        page_size = QUEUE_PAGE_SIZE
-        async with info['lock']:
-            num_pages = math.ceil(info['q'].qsize() / page_size)
-        if num_pages < 1:
+        pages = self.get_queue_pages(ctx)
+        if pages.page_count < 1:
             await ctx.send("Queue is empty! Add some songs first.")
             return
-        current_page = 1
-        
-        # enumerates songs in queue
-        async with info['lock']:
-            songs = list(enumerate(info['q']._queue, start = 1))
-            
-        embed_settings = discord.Embed(title='Current song queue:', color=discord.Color.blue())
-        def update_embed_settings(page_num):
-            """
-            Changes the embed fields based on the current page
-            """
-            embed_settings.clear_fields()
-            for x in range((page_num - 1) * page_size, min(len(songs), page_num * page_size)):
-                index = songs[x][0]
-                song = songs[x][1]
-                source_type = song.get('ie_key')
-                # assumes only soundcloud and youtube available
-                if source_type == 'Soundcloud':
-                    time_str = 'Soundcloud song'
-                    title = song['url']
-                    title = title.split('/')[-1].replace('-', ' ')
-                else:
-                    duration = int(math.floor(song['duration']))
-                    hours = '' if duration < 3600 else f'{duration // 3600}:'
-                    minutes = duration % 3600 // 60
-                    minutes = minutes if duration < 3600 else f'{minutes:02}'
-                    time_str = f"{hours}{minutes}:{duration % 60:02}"
-                    title = song['title']
-                embed_settings.add_field(name=f"{index}. {title}", 
-                                        value=time_str, inline=False)
-        update_embed_settings(current_page)
-        
-        # sends initial message with left and right emotes to change pages
-        message = await ctx.send(embed=embed_settings)
-        await message.add_reaction("\u25c0")
-        await message.add_reaction("\u25b6")
-        
-        def check(reaction, user):
-            """
-            Detects whether one of the valid reactions was used by a non-bot user
-
-            Args:
-                reaction (discord.Reaction): reaction added to the message
-                user (discord.User): user that added the reaction
-                
-            Returns:
-                bool: returns whether reaction was added one of the page flip emotes
-            """
-            return str(reaction.emoji) in ["\u25c0", "\u25b6"] and not user.bot
-
-        # scans for reactions until timeout
-        while True:
-            try:
-                reaction, user = await self.bot.wait_for("reaction_add", timeout=Q_TIMEOUT, check=check)
-                if str(reaction.emoji) == "\u25c0" and current_page > 1:
-                    current_page -= 1
-                    update_embed_settings(current_page)
-                    await message.edit(embed=embed_settings)
-                elif str(reaction.emoji) == "\u25b6" and current_page < num_pages:
-                    current_page += 1
-                    update_embed_settings(current_page)
-                    await message.edit(embed=embed_settings)
-                await message.remove_reaction(reaction, user)
-            except asyncio.TimeoutError:
-                break
-                
+        # the buttons are handled by the message's view, so nothing waits here for them
+        view = pages.view()
+        message = await ctx.send(embed=pages.render(1), view=view)
+        pages.track(message, view)
+
     @commands.command()
     async def connect(self, ctx):
         """
@@ -546,3 +1215,79 @@ class Music(commands.Cog):
             await ctx.send("Bot is not connected to a channel")
         else:
             await self.disconnect(ctx.guild)
+
+    @commands.command()
+    @commands.is_owner()
+    async def cachestats(self, ctx):
+        """
+        Sends the hit/miss counters of the shared caches
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+        """
+        lines = []
+        for name, cache in (('search', self.search_cache), ('metadata', self.metadata_cache), ('stream', self.stream_cache)):
+            stats = cache.stats()
+            lines.append(f"{name}: {stats['hits']} hits, {stats['misses']} misses "
+                         f"({stats['hit_rate']:.0%}), {stats['size']} entries")
+        if self.audio_cache:
+            stats = self.audio_cache.stats()
+            lines.append(f"audio: {stats['files']} files, {stats['bytes'] / 1024 ** 2:.0f} MiB, "
+                         f"{stats['downloads']} downloading")
+        await ctx.send('\n'.join(lines))
+
+    @commands.command()
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """
+        Sends timing percentiles of the hot paths and the event loop lag
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+        """
+        self.collect_gauges()
+        lines = [f"{len(self.players)} active players, {len(self.bot.guilds)} servers"]
+        requests = sum(count for (name, _), count in instrumentation.counters.items() if name == 'outbox_requests_total')
+        api_calls = sum(count for (name, _), count in instrumentation.counters.items() if name == 'outbox_api_calls_total')
+        lines.append(f"messages: {requests} requested, {api_calls} API calls, {requests - api_calls} saved")
+        stalls, recoveries, failures = (instrumentation.counters[(name, ())] for name in (
+            'stream_stalls_total', 'stream_recoveries_total', 'stream_recovery_failures_total'))
+        lines.append(f"streams: {stalls} cut off, {recoveries} resumed, {failures} given up on")
+        crossfades, underruns = (instrumentation.counters[(name, ())] for name in ('crossfades_total', 'audio_underruns_total'))
+        lines.append(f"audio: {crossfades} crossfades, {underruns} buffer underruns")
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        if shard_ids:
+            lines.append(f"shards {','.join(map(str, shard_ids))} of {self.bot.shard_count}")
+        for (name, labels), hist in sorted(instrumentation.histograms.items()):
+            if not hist.count:
+                continue
+            label = ','.join(value for _, value in labels)
+            lines.append(f"{name}{f'[{label}]' if label else ''}: {hist.count} samples, "
+                         f"p50 <= {hist.percentile(0.5) * 1000:g}ms, p99 <= {hist.percentile(0.99) * 1000:g}ms, "
+                         f"mean {hist.total / hist.count * 1000:.1f}ms")
+        await ctx.send('```\n' + '\n'.join(lines)[:1900] + '\n```')
+
+    @commands.command()
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: float = 5):
+        """
+        Samples the event loop for a while and sends the hottest frames
+
+        Args:
+            ctx (discord.ext.commands.Context): context related to command call
+            seconds (float, optional): how long to sample for. Defaults to 5.
+        """
+        seconds = min(max(seconds, 1), 60)
+        await ctx.send(f"Profiling the event loop for {seconds:g} seconds...")
+        report = await instrumentation.profile_loop(seconds)
+        await ctx.send('```\n' + report[:1900] + '\n```')
+
+
+async def setup(bot):
+    """
+    Adds the cog when the bot loads this module as an extension
+
+    Args:
+        bot (discord.ext.commands.Bot): a representation of the bot
+    """
+    await bot.add_cog(Music(bot))
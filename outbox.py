@@ -0,0 +1,241 @@
+import asyncio
+import time
+from collections import deque
+
+from instrumentation import increment, timer
+
+# seconds a message waits for others to be combined with it
+COALESCE_DELAY = 0.25
+
+# seconds an edit waits for newer edits of the same message to replace it
+EDIT_DEBOUNCE = 1.0
+
+# discord allows roughly this many messages and edits per channel in RATE_PERIOD seconds
+RATE_LIMIT = 5
+RATE_PERIOD = 5.0
+
+# longest message discord accepts
+MAX_MESSAGE_LENGTH = 2000
+
+
+class Outbox:
+    """
+    Schedules the bot's messages to one channel so bursts cost few API calls
+
+    Messages queued close together are sent as one message, and messages
+    of the same kind are merged, so 37 queued songs become "Added 37 songs
+    to queue!". A newer message can replace a pending one of its kind, so
+    skipping through songs only announces the last one. Edits of a
+    message are debounced and only the newest is sent. Every call waits
+    until fewer than RATE_LIMIT calls were made in the last RATE_PERIOD
+    seconds, like discord's per-channel limit, and pending output keeps
+    being merged while it waits.
+
+    ...
+
+    Attributes
+    ----------
+    channel : discord.abc.Messageable
+        where the messages go
+    requests : int
+        number of sends and edits asked for
+    api_calls : int
+        number of sends and edits made
+
+    Methods
+    -------
+    send(text, kind=None, plural=None, replace=False)
+        Queues a message without waiting for it to be sent
+    send_now(content=None, **kwargs)
+        Sends a message as soon as the rate limit allows and returns it
+    edit(message, delay=EDIT_DEBOUNCE, **fields)
+        Queues an edit, replacing pending edits of the same message
+    saved
+        Number of API calls avoided
+    idle
+        Whether nothing is waiting to be sent
+    refill_delay()
+        Returns the seconds until the rate limit has fully recovered
+    """
+    def __init__(self, channel, on_idle=None):
+        """
+        Args:
+            channel (discord.abc.Messageable): where the messages go
+            on_idle (callable, optional): called with the outbox once everything is sent. Defaults to None.
+        """
+        self.channel = channel
+        self.on_idle = on_idle
+        self.requests = 0
+        self.api_calls = 0
+        # [kind, text, count, plural] entries in the order they were queued
+        self._pending = []
+        self._edits = {}
+        # times of the latest calls, the oldest of which decides when the next may be made
+        self._calls = deque(maxlen=RATE_LIMIT)
+        self._task = None
+
+    @property
+    def saved(self):
+        """
+        int: number of API calls avoided by merging and dropping output
+        """
+        return self.requests - self.api_calls
+
+    @property
+    def idle(self):
+        """
+        bool: whether nothing is waiting to be sent
+        """
+        return not self._pending and not self._edits
+
+    def refill_delay(self):
+        """
+        Returns the seconds until the rate limit has fully recovered, after which a new outbox behaves the same
+
+        Returns:
+            float: seconds until no call counts towards the limit, 0 if none does
+        """
+        if not self._calls:
+            return 0
+        return max(0, self._calls[-1] + RATE_PERIOD - time.monotonic())
+
+    def send(self, text, kind=None, plural=None, replace=False):
+        """
+        Queues a message without waiting for it to be sent
+
+        Args:
+            text (str): the message
+            kind (str, optional): messages of the same kind are merged. Defaults to None.
+            plural (callable, optional): builds the merged text from the number of merged messages. Defaults to None.
+            replace (bool, optional): whether the message replaces a pending one of its kind. Defaults to False.
+        """
+        self._count_request('send')
+        entry = next((entry for entry in self._pending if kind is not None and entry[0] == kind), None)
+        if entry is None:
+            self._pending.append([kind, text, 1, plural])
+        elif replace:
+            entry[1] = text
+        else:
+            entry[2] += 1
+            entry[1] = plural(entry[2]) if plural else f'{entry[1]}\n{text}'
+        self._wake()
+
+    async def send_now(self, content=None, **kwargs):
+        """
+        Sends a message as soon as the rate limit allows and returns it, for messages that are edited later
+
+        Args:
+            content (str, optional): the message. Defaults to None.
+            kwargs: other arguments of discord.abc.Messageable.send
+
+        Returns:
+            discord.Message: the sent message
+        """
+        self._count_request('send')
+        await self._wait_for_slot()
+        return await self._call('send', self.channel.send(content, **kwargs))
+
+    def edit(self, message, delay=EDIT_DEBOUNCE, **fields):
+        """
+        Queues an edit, replacing pending edits of the same message
+
+        Args:
+            message (discord.Message): message to edit
+            delay (float, optional): seconds to wait for newer edits. Defaults to EDIT_DEBOUNCE.
+            fields: arguments of discord.Message.edit
+        """
+        self._count_request('edit')
+        # newer edits replace the pending one but do not push it back, so steady progress still shows
+        pending = self._edits.get(message.id)
+        due = pending[2] if pending else time.monotonic() + delay
+        self._edits[message.id] = (message, fields, due)
+        self._wake()
+
+    def _count_request(self, call):
+        self.requests += 1
+        increment('outbox_requests_total', call=call)
+
+    def _wake(self):
+        """
+        Starts the task that sends pending output if it is not running
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _wait_for_slot(self):
+        """
+        Waits until the channel's rate limit allows another call
+        """
+        while len(self._calls) == RATE_LIMIT:
+            delay = self._calls[0] + RATE_PERIOD - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self._calls.append(time.monotonic())
+
+    async def _call(self, call, coroutine):
+        """
+        Awaits an API call and counts it
+
+        Args:
+            call (str): 'send' or 'edit'
+            coroutine (coroutine): the API call
+
+        Returns:
+            the call's result
+        """
+        self.api_calls += 1
+        increment('outbox_api_calls_total', call=call)
+        with timer('discord_api_seconds', call=call):
+            return await coroutine
+
+    def _take_message(self):
+        """
+        Removes as many pending messages as fit in one message and joins them
+
+        Returns:
+            str: text to send
+        """
+        text = self._pending.pop(0)[1][:MAX_MESSAGE_LENGTH]
+        while self._pending and len(text) + len(self._pending[0][1]) + 1 <= MAX_MESSAGE_LENGTH:
+            text = f'{text}\n{self._pending.pop(0)[1]}'
+        return text
+
+    async def _flush(self):
+        """
+        Sends pending messages and due edits until there are none left
+        """
+        await asyncio.sleep(COALESCE_DELAY)
+        while self._pending or self._edits:
+            if self._pending:
+                # messages queued while waiting for the rate limit are merged too
+                await self._wait_for_slot()
+                await self._send(self._take_message())
+                continue
+            message_id, (message, fields, due) = min(self._edits.items(), key=lambda item: item[1][2])
+            delay = due - time.monotonic()
+            if delay > 0:
+                # wakes up early enough to send messages queued in the meantime
+                await asyncio.sleep(min(delay, COALESCE_DELAY))
+                continue
+            await self._wait_for_slot()
+            # a newer edit may have arrived while waiting for the rate limit
+            message, fields, _ = self._edits.pop(message_id)
+            try:
+                await self._call('edit', message.edit(**fields))
+            except Exception as error:
+                print(f'Could not edit message in {self.channel}: {error}')
+        if self.on_idle is not None:
+            self.on_idle(self)
+
+    async def _send(self, text):
+        """
+        Sends one message, reporting failures instead of raising them
+
+        Args:
+            text (str): the message
+        """
+        try:
+            await self._call('send', self.channel.send(text))
+        except Exception as error:
+            print(f'Could not send message to {self.channel}: {error}')
@@ -0,0 +1,739 @@
+import asyncio
+
+from instrumentation import increment, timer
+from mixer import BUFFER_SECONDS, Mixer
+from prefetch import Prefetcher, song_key
+
+# causes bot to disconnect after queue empties after some time
+EMPTY_TIMEOUT = 5
+
+# players that have not played anything for this long disconnect and are collected
+IDLE_TIMEOUT = 15 * 60
+
+# seconds before the current song ends at which the next song's ffmpeg is spawned and warmed
+PRESPAWN_LEAD = 10
+
+# a song that stops more than this many seconds before its end was cut off by its stream
+END_TOLERANCE = 5
+
+# times a cut off song is resumed before it is given up on, and the wait before the first try, doubled after each
+MAX_RECOVERIES = 3
+RECOVERY_BACKOFF = 1
+
+# seconds a resumed song has to play before its recoveries are counted from zero again
+HEALTHY_PLAY = 30
+
+
+class GuildPlayer:
+    """
+    Long-lived task that owns playback for one server
+
+    Commands talk to the player by putting messages in its inbox instead of
+    running playback themselves. Only the player's task starts songs, so
+    there is no need for locks and two songs can never be started at once.
+    Queue edits are synchronous, which is safe because the event loop is
+    single threaded; the ones that can change the next songs go through
+    the inbox so the player prefetches the new ones. PCM songs are played
+    through a mixer.Mixer, which tells the player when a song's stream
+    ended so the prespawned next song can be faded in without a gap.
+
+    ...
+
+    Attributes
+    ----------
+    music : music.Music
+        the cog that owns the player
+    guild : discord.Guild
+        server the player belongs to
+    queue : music.SongQueue
+        songs waiting to be played
+    prefetcher : prefetch.Prefetcher
+        resolves the streams of upcoming songs
+    current_song : track.Track
+        song currently playing, or None
+    loop : bool
+        whether the current song repeats
+    channel : discord.abc.Messageable
+        where "Now playing" messages are sent
+    volume : float
+        gain applied to the server's songs
+    ingest_tasks : set
+        running playlist ingestion tasks
+    task : asyncio.Task
+        the task running the player
+    on_exit : callable
+        called with the player once its task ends
+
+    Methods
+    -------
+    start()
+        Starts the player's task
+    tell(command, *args)
+        Sends a message without waiting for it to be handled
+    ask(command, *args)
+        Sends a message and waits for its result
+    enqueue(tracks)
+        Adds tracks to the end of the queue
+    prefetch_upcoming()
+        Starts resolving the streams of the next songs in the queue and
+        schedules spawning the next song's ffmpeg
+    """
+    def __init__(self, music, guild, queue, on_exit, volume=1.0):
+        """
+        Args:
+            music (music.Music): the cog that owns the player
+            guild (discord.Guild): server the player belongs to
+            queue (music.SongQueue): songs waiting to be played
+            on_exit (callable): called with the player once its task ends
+            volume (float, optional): gain applied to the server's songs. Defaults to 1.0.
+        """
+        self.music = music
+        self.guild = guild
+        self.queue = queue
+        self.prefetcher = Prefetcher(lambda: music.extractor, music.stream_cache, guild.id, audio_cache=music.audio_cache)
+        self.current_song = None
+        self.loop = False
+        self.channel = None
+        self.volume = volume
+        self.ingest_tasks = set()
+        self.task = None
+        self.on_exit = on_exit
+        self._inbox = asyncio.Queue()
+        self._audio_source = None
+        # what the voice client plays, the mixer or an Opus source
+        self._playing = None
+        # (song, stream, audio source) handed to the mixer but not reached by the voice client yet
+        self._fading = None
+        # set once the queue has been played through, which starts the short leave timer
+        self._finished = False
+        # (song, stream, audio source) spawned ahead of time for the next song
+        self._next = None
+        self._prespawn_song = None
+        self._prespawn_task = None
+        self._prespawn_handle = None
+        # what the voice client played when it was stopped by a skip, which is not a cut off stream
+        self._stopped = None
+        self._recoveries = 0
+        self._recovery_handle = None
+
+    def start(self):
+        """
+        Starts the player's task
+
+        Returns:
+            GuildPlayer: the player itself
+        """
+        self.task = asyncio.create_task(self._run())
+        self.task.add_done_callback(lambda _: self.on_exit(self))
+        return self
+
+    def tell(self, command, *args):
+        """
+        Sends a message without waiting for it to be handled
+
+        Args:
+            command (str): name of the handler
+            args: arguments for the handler
+        """
+        self._inbox.put_nowait((command, args, None))
+
+    async def ask(self, command, *args):
+        """
+        Sends a message and waits for its result
+
+        Args:
+            command (str): name of the handler
+            args: arguments for the handler
+
+        Returns:
+            the handler's result
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._inbox.put_nowait((command, args, future))
+        return await future
+
+    @property
+    def voice_client(self):
+        """
+        discord.VoiceClient: the server's voice client, or None
+        """
+        return self.guild.voice_client
+
+    def enqueue(self, tracks):
+        """
+        Adds tracks to the end of the queue
+
+        Args:
+            tracks (list): tracks to queue
+        """
+        for track in tracks:
+            self.queue.put_nowait(track)
+        self.tell('queued')
+
+    def prefetch_upcoming(self):
+        """
+        Starts resolving the streams of the next songs in the queue and
+        schedules spawning the next song's ffmpeg
+        """
+        self.prefetcher.schedule(self._upcoming(self.prefetcher.depth))
+        self._schedule_prespawn()
+
+    def _upcoming(self, count):
+        """
+        Returns the songs that will be played next
+
+        Args:
+            count (int): maximum number of songs
+
+        Returns:
+            list: upcoming tracks in play order
+        """
+        # a looping song is also the next song
+        upcoming = [self.current_song] if self.loop and self.current_song else []
+        upcoming.extend(self.queue.page(0, count))
+        return upcoming[:count]
+
+    def _schedule_prespawn(self):
+        """
+        Arranges for the next song's ffmpeg to be spawned shortly before the current song ends
+
+        Spawning any earlier would leave ffmpeg holding an idle connection
+        for the whole song. Songs of unknown length are not prespawned.
+        """
+        if self._prespawn_handle is not None:
+            self._prespawn_handle.cancel()
+            self._prespawn_handle = None
+        song = self.current_song
+        voice_client = self.voice_client
+        if self._audio_source is None or not song or not song.duration:
+            return
+        # playback position does not advance while paused, so resuming schedules again
+        if voice_client is None or voice_client.is_paused():
+            return
+        delay = max(song.duration - self._audio_source.position - PRESPAWN_LEAD, 0)
+        self._prespawn_handle = asyncio.get_running_loop().call_later(delay, self.tell, 'prespawn')
+
+    def _discard_next(self):
+        """
+        Stops the prespawned source, if any
+        """
+        if self._prespawn_task is not None:
+            self._prespawn_task.cancel()
+            self._prespawn_task = None
+        if self._next is not None:
+            self._next[2].cleanup()
+            self._next = None
+
+    def _discard_fading(self):
+        """
+        Stops the song handed to the mixer, if any, and puts it back at the front of the queue
+        """
+        if self._fading is None:
+            return
+        song, _, audio_source = self._fading
+        self._fading = None
+        audio_source.cleanup()
+        # a looping song was never taken off the queue
+        if song is not self.current_song:
+            self.queue.put_front(song)
+
+    async def _prespawn(self, song):
+        """
+        Spawns and warms the source of the next song
+
+        Args:
+            song (track.Track): the next song
+        """
+        try:
+            # shielded so cancelling the prespawn does not cancel the shared prefetch
+            source = await asyncio.shield(self.prefetcher.get(song))
+            with timer('ffmpeg_spawn_seconds'):
+                audio_source = self.music.create_audio_source(source, self.volume)
+            self._next = (song, source, audio_source)
+            await audio_source.warm()
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            # the song is spawned again when it starts
+            if self._next is not None and self._next[0] is song:
+                self._next[2].cleanup()
+                self._next = None
+            print(f'Player for {self.guild.id} failed to prespawn {song.title}: {error}')
+        finally:
+            if self._prespawn_task is asyncio.current_task():
+                self._prespawn_task = None
+
+    def _idle_timeout(self):
+        """
+        Returns how long the player waits for a message before leaving
+
+        Returns:
+            float: seconds to wait, or None to wait forever
+        """
+        voice_client = self.voice_client
+        if voice_client and voice_client.is_playing():
+            return None
+        return EMPTY_TIMEOUT if self._finished else IDLE_TIMEOUT
+
+    async def _run(self):
+        """
+        Handles messages until the player disconnects or sits idle for too long
+        """
+        try:
+            while True:
+                try:
+                    command, args, future = await asyncio.wait_for(self._inbox.get(), self._idle_timeout())
+                except asyncio.TimeoutError:
+                    if self._finished and self.channel:
+                        self.music.outbox(self.channel).send("Queue is empty, so I'm leaving. See you next time!")
+                    await self._close()
+                    return
+                try:
+                    result = await getattr(self, f'_on_{command}')(*args)
+                except Exception as error:
+                    # the caller may have stopped waiting, eg. when its command was cancelled
+                    if future is None or future.done():
+                        print(f'Player for {self.guild.id} failed handling {command}: {error}')
+                    else:
+                        future.set_exception(error)
+                else:
+                    if future is not None and not future.done():
+                        future.set_result(result)
+                if command == 'disconnect':
+                    return
+        finally:
+            self._cleanup()
+
+    async def _start_next(self):
+        """
+        Plays the next song, or marks the queue as finished if there is none
+        """
+        while True:
+            voice_client = self.voice_client
+            # if the bot is not connected anymore, clear the queue
+            if voice_client is None or not voice_client.is_connected():
+                self.queue.clear()
+                self.current_song = None
+                return
+            if self.loop and self.current_song:
+                song = self.current_song
+            elif not self.queue.empty():
+                song = self.queue.get_nowait()
+            else:
+                self.current_song = None
+                self._finished = True
+                return
+            self.current_song = song
+            self._recoveries = 0
+
+            # a source prespawned for this song only needs to be handed to the voice client
+            if self._next is not None and self._next[0] is song:
+                _, source, self._audio_source = self._next
+                self._next = None
+                self._prespawn_task = None
+            else:
+                self._discard_next()
+                try:
+                    source = await self.prefetcher.get(song)
+                except Exception:
+                    self.loop = False
+                    if self.channel:
+                        self.music.outbox(self.channel).send(f"Could not play {song.title}, skipping it")
+                    continue
+
+                # creating the source spawns ffmpeg
+                with timer('ffmpeg_spawn_seconds'):
+                    self._audio_source = self.music.create_audio_source(source, self.volume)
+            self._play(voice_client, self._audio_source)
+            self._song_started(song, source)
+            return
+
+    def _song_started(self, song, source):
+        """
+        Records and announces a song the voice client started playing
+
+        Args:
+            song (track.Track): the song
+            source (dict): info dict of its stream
+        """
+        self.prefetcher.song_started()
+        if self.music.audio_cache:
+            self.music.audio_cache.played(song)
+        self.prefetch_upcoming()
+        if self.channel:
+            # when songs are skipped quickly only the last one is announced
+            self.music.outbox(self.channel).send(f"Now playing: {source['title']}", kind='now_playing', replace=True)
+
+    def _play(self, voice_client, audio_source):
+        """
+        Hands a source to the voice client, through a new mixer unless it is Opus
+
+        Args:
+            voice_client (discord.VoiceClient): the server's voice client
+            audio_source (audio_source.WarmSource): source to play
+        """
+        loop = asyncio.get_running_loop()
+        played = audio_source
+        if BUFFER_SECONDS and not audio_source.is_opus():
+            # the voice thread cleans up what it played after calling back, so every play gets its own mixer
+            played = Mixer(audio_source, lambda command, *args: loop.call_soon_threadsafe(self.tell, command, *args))
+        self._playing = played
+        # the callback runs on the voice thread, so it hands the message to the event loop
+        with timer('voice_play_seconds'):
+            voice_client.play(played, after=lambda error: loop.call_soon_threadsafe(
+                self.tell, 'song_ended', played, error))
+
+    def _cut_off(self, audio_source, error):
+        """
+        Decides whether a source ended because its stream broke rather than because the song was over
+
+        Args:
+            audio_source (audio_source.WarmSource): the source that ended
+            error (Exception): error the voice client stopped with, or None
+
+        Returns:
+            bool: whether the song should be resumed
+        """
+        voice_client = self.voice_client
+        if voice_client is None or not voice_client.is_connected():
+            return False
+        if error is not None:
+            return True
+        # songs of unknown length only count as cut off when the voice client reports an error
+        duration = self.current_song.duration if self.current_song else None
+        return bool(duration) and audio_source.position < duration - END_TOLERANCE
+
+    async def _on_play(self, channel):
+        """
+        Resumes playback, or starts it if nothing is playing
+
+        Args:
+            channel (discord.abc.Messageable): where "Now playing" messages are sent
+        """
+        self.channel = channel
+        self._finished = False
+        voice_client = self.voice_client
+        if voice_client and voice_client.is_paused():
+            voice_client.resume()
+            self._schedule_prespawn()
+        elif voice_client and not voice_client.is_playing() and self._audio_source is None:
+            await self._start_next()
+
+    async def _on_queued(self):
+        """
+        Cancels the leave timer and prefetches newly queued songs
+        """
+        self._finished = False
+        if self._audio_source is not None:
+            self.prefetch_upcoming()
+
+    async def _on_prespawn(self):
+        """
+        Spawns the next song's ffmpeg if the current song is about to end
+        """
+        self._prespawn_handle = None
+        upcoming = self._upcoming(1)
+        if not upcoming or self._audio_source is None:
+            return
+        song = upcoming[0]
+        if self._prespawn_song is song and (self._next is not None or self._prespawn_task is not None):
+            return
+        remaining = self.current_song.duration - self._audio_source.position
+        if remaining > PRESPAWN_LEAD + 1:
+            # the song was paused or started late, so check again later
+            self._schedule_prespawn()
+            return
+        self._discard_next()
+        self._prespawn_song = song
+        self._prespawn_task = asyncio.create_task(self._prespawn(song))
+
+    async def _on_stream_drained(self, mixer, audio_source):
+        """
+        Hands the prespawned next song to the mixer once the current song's stream ended
+
+        Songs that were cut off, and next songs that are not spawned yet or
+        are Opus, are left to start after the mixer ends instead.
+
+        Args:
+            mixer (mixer.Mixer): the mixer playing the song
+            audio_source (audio_source.WarmSource): the source whose stream ended
+        """
+        upcoming = self._upcoming(1)
+        if (mixer is not self._playing or audio_source is not self._audio_source or self._fading is not None
+                or not upcoming or self._next is None or self._next[0] is not upcoming[0]
+                or self._cut_off(audio_source, None) or not mixer.queue(self._next[2])):
+            mixer.finish()
+            return
+        if not (self.loop and self.current_song):
+            self.queue.get_nowait()
+        self._fading, self._next = self._next, None
+        self._prespawn_task = None
+
+    async def _on_crossfaded(self, mixer, audio_source):
+        """
+        Makes the song the mixer faded in the current song
+
+        Args:
+            mixer (mixer.Mixer): the mixer playing the songs
+            audio_source (audio_source.WarmSource): the source of the song that was faded in
+        """
+        # a skip during the fade stops both songs, and the faded song starts again afterwards
+        if (mixer is not self._playing or mixer is self._stopped
+                or self._fading is None or self._fading[2] is not audio_source):
+            return
+        song, source, audio_source = self._fading
+        self._fading = None
+        self.prefetcher.song_ended()
+        # the mixer already buffered the rest of the previous song
+        self._audio_source.cleanup()
+        self._audio_source = audio_source
+        increment('crossfades_total')
+        self.current_song = song
+        self._recoveries = 0
+        self._song_started(song, source)
+
+    async def _on_song_ended(self, played, error=None):
+        """
+        Cleans up a finished song and starts the next one, or resumes the song if its stream was cut off
+
+        Args:
+            played (discord.AudioSource): what the voice client played, the mixer or an Opus source
+            error (Exception, optional): error the voice client stopped with. Defaults to None.
+        """
+        self.prefetcher.song_ended()
+        played.cleanup()
+        skipped = played is self._stopped
+        if skipped:
+            self._stopped = None
+        if played is not self._playing:
+            return
+        self._playing = None
+        audio_source, self._audio_source = self._audio_source, None
+        audio_source.cleanup()
+        self._discard_fading()
+        error = error or getattr(played, 'error', None)
+        if not skipped and self._cut_off(audio_source, error):
+            increment('stream_stalls_total')
+            if audio_source.position - audio_source.start >= HEALTHY_PLAY:
+                self._recoveries = 0
+            if self._schedule_recovery(self.current_song, audio_source.position):
+                return
+            increment('stream_recovery_failures_total')
+            if self.channel:
+                self.music.outbox(self.channel).send(f"Lost the stream of {self.current_song.title}, skipping it")
+        await self._start_next()
+
+    def _schedule_recovery(self, song, position):
+        """
+        Arranges for a cut off song to be resumed after a backoff, unless it was resumed too often
+
+        Args:
+            song (track.Track): the song that was cut off
+            position (float): seconds into the song at which it stopped
+
+        Returns:
+            bool: whether a recovery was scheduled
+        """
+        if self._recoveries >= MAX_RECOVERIES:
+            return False
+        delay = RECOVERY_BACKOFF * 2 ** self._recoveries
+        self._recoveries += 1
+        self._recovery_handle = asyncio.get_running_loop().call_later(delay, self.tell, 'recover', song, position)
+        return True
+
+    async def _on_recover(self, song, position):
+        """
+        Resolves a cut off song's stream again and resumes it where it stopped
+
+        Args:
+            song (track.Track): the song that was cut off
+            position (float): seconds into the song at which it stopped
+        """
+        self._recovery_handle = None
+        voice_client = self.voice_client
+        # the song may have been skipped while waiting
+        if song is not self.current_song or self._audio_source is not None:
+            return
+        if voice_client is None or not voice_client.is_connected():
+            return
+        # the old url has probably expired, so it is not reused
+        self.music.stream_cache.pop(song_key(song), None)
+        try:
+            source = await self.prefetcher.get(song)
+            with timer('ffmpeg_spawn_seconds'):
+                self._audio_source = self.music.create_audio_source(source, self.volume, start=position)
+        except Exception as error:
+            print(f'Player for {self.guild.id} failed to recover {song.title}: {error}')
+            if not self._schedule_recovery(song, position):
+                increment('stream_recovery_failures_total')
+                await self._start_next()
+            return
+        increment('stream_recoveries_total')
+        self._play(voice_client, self._audio_source)
+        self._schedule_prespawn()
+
+    async def _on_skip(self):
+        """
+        Skips the current song; the voice client's callback then starts the next one
+
+        Returns:
+            bool: whether a song was skipped
+        """
+        voice_client = self.voice_client
+        if voice_client and voice_client.is_playing():
+            self._stopped = self._playing
+            voice_client.stop()
+            return True
+        # a song waiting to be resumed is skipped by not resuming it
+        if self._recovery_handle is not None:
+            self._recovery_handle.cancel()
+            self._recovery_handle = None
+            await self._start_next()
+            return True
+        return False
+
+    async def _on_pause(self):
+        """
+        Pauses the current song
+
+        Returns:
+            bool: whether a song was paused
+        """
+        voice_client = self.voice_client
+        if voice_client and voice_client.is_playing():
+            voice_client.pause()
+            self._schedule_prespawn()
+            return True
+        return False
+
+    async def _on_loop(self):
+        """
+        Toggles looping of the current song
+
+        Returns:
+            tuple: the new loop setting and the current song
+        """
+        self.loop = not self.loop
+        self.prefetch_upcoming()
+        return self.loop, self.current_song
+
+    async def _on_volume(self, volume):
+        """
+        Changes the volume of the server's songs
+
+        Args:
+            volume (float): new gain
+
+        Returns:
+            bool: whether the current song changed volume too, which Opus sources cannot
+        """
+        self.volume = volume
+        applied = False
+        for source in (self._audio_source, self._next[2] if self._next else None,
+                       self._fading[2] if self._fading else None):
+            # the gain stage sits right inside the warm source on the PCM path
+            gain_stage = getattr(source, 'original', None)
+            if hasattr(gain_stage, 'volume'):
+                gain_stage.volume = volume
+                applied = applied or source is self._audio_source
+        return applied or self._audio_source is None
+
+    async def _on_shuffle(self):
+        """
+        Shuffles the queue and prefetches the new upcoming songs
+        """
+        self.queue.shuffle()
+        if self._audio_source is not None:
+            self.prefetch_upcoming()
+
+    async def _on_remove(self, index):
+        """
+        Removes a song from the queue and prefetches the new upcoming songs
+
+        Args:
+            index (int): position of the song in the queue, starting from 0
+
+        Returns:
+            track.Track: the removed song
+        """
+        song = self.queue.remove(index)
+        if self._audio_source is not None:
+            self.prefetch_upcoming()
+        return song
+
+    async def _on_move(self, src, dst):
+        """
+        Moves a song to a different position in the queue and prefetches the new upcoming songs
+
+        Args:
+            src (int): current position of the song, starting from 0
+            dst (int): new position of the song
+        """
+        self.queue.move(src, dst)
+        if self._audio_source is not None:
+            self.prefetch_upcoming()
+
+    async def _on_jump(self, index):
+        """
+        Drops the songs before a position in the queue and skips the current song
+
+        Args:
+            index (int): position of the song to play next, starting from 0
+
+        Returns:
+            bool: whether a song was skipped
+        """
+        self.queue.jump(index)
+        self.loop = False
+        # skipping the current song makes the player move on to the new front of the queue
+        return await self._on_skip()
+
+    async def _on_dedupe(self):
+        """
+        Removes duplicate songs from the queue and prefetches the new upcoming songs
+
+        Returns:
+            int: number of songs removed
+        """
+        removed = self.queue.dedupe()
+        if removed and self._audio_source is not None:
+            self.prefetch_upcoming()
+        return removed
+
+    async def _on_disconnect(self):
+        """
+        Leaves the voice channel and stops the player
+        """
+        await self._close()
+
+    async def _close(self):
+        """
+        Disconnects from voice if connected
+        """
+        self.queue.clear()
+        voice_client = self.voice_client
+        if voice_client is not None:
+            await voice_client.disconnect()
+
+    def _cleanup(self):
+        """
+        Stops background work owned by the player
+        """
+        self.prefetcher.cancel()
+        if self._prespawn_handle is not None:
+            self._prespawn_handle.cancel()
+        if self._recovery_handle is not None:
+            self._recovery_handle.cancel()
+        self._discard_next()
+        if self._fading is not None:
+            self._fading[2].cleanup()
+        # after a disconnect the song_ended message is never handled, so the playing song is cleaned up here
+        if self._playing is not None:
+            self._playing.cleanup()
+            self._playing = None
+        if self._audio_source is not None:
+            self._audio_source.cleanup()
+            self._audio_source = None
+        for task in self.ingest_tasks:
+            task.cancel()
+        self.ingest_tasks.clear()
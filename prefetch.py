@@ -0,0 +1,218 @@
+import asyncio
+import itertools
+import time
+from urllib.parse import parse_qs, urlparse
+
+from instrumentation import histogram
+
+# number of upcoming songs resolved ahead of time
+PREFETCH_DEPTH = 2
+
+# prefetched streams expiring within this many seconds are resolved again
+EXPIRY_MARGIN = 120
+
+# assumed lifetime of stream urls that do not say when they expire
+DEFAULT_URL_LIFETIME = 3600
+
+
+def song_key(song):
+    """
+    Identifies a queued song
+
+    Args:
+        song (track.Track): queued song
+
+    Returns:
+        str: the video id, or the url for sources without one
+    """
+    return song.id or song.url
+
+
+def song_url(song):
+    """
+    Builds the url that resolves a queued song into a stream
+
+    Args:
+        song (track.Track): queued song
+
+    Returns:
+        str: url handed to yt_dlp
+    """
+    # assumes only soundcloud and youtube are available
+    if song.ie_key == 'Soundcloud':
+        return song.url
+    return f"https://www.youtube.com/watch?v={song.id}"
+
+
+def url_expiry(url):
+    """
+    Reads the expiry time that signed stream urls carry in their expire= parameter
+
+    Args:
+        url (str): stream url
+
+    Returns:
+        float: unix time at which the url stops working
+    """
+    try:
+        return float(parse_qs(urlparse(url).query)['expire'][0])
+    except (KeyError, IndexError, ValueError):
+        return time.time() + DEFAULT_URL_LIFETIME
+
+
+def local_source(song, path):
+    """
+    Builds the stream info of a song played from a local file
+
+    Args:
+        song (track.Track): queued song
+        path (str): location of the file
+
+    Returns:
+        dict: info dict of the stream
+    """
+    source = {'url': path, 'title': song.title, 'local': True}
+    # the cache prefers Opus, which is what webm audio from youtube holds
+    if path.endswith(('.webm', '.opus')):
+        source['acodec'] = 'opus'
+    return source
+
+
+class Prefetcher:
+    """
+    Resolves the stream urls of upcoming songs while the current song plays
+
+    ...
+
+    Attributes
+    ----------
+    extractor : extraction.ExtractionService
+        used to resolve the stream urls, retrieved on first use
+    streams : cache.TTLCache
+        shared cache mapping song keys to resolved streams
+    guild_id : int
+        server the prefetcher belongs to
+    depth : int
+        number of upcoming songs to resolve
+    tasks : dict
+        maps song keys to running resolution tasks
+    audio_cache : audio_cache.AudioCache
+        local files played instead of streams, or None
+
+    Methods
+    -------
+    schedule(songs)
+        Starts resolving the first few upcoming songs
+    get(song)
+        Returns the resolved stream for a song, resolving it now if necessary
+    song_ended()
+        Marks the moment the current song stopped
+    song_started()
+        Records the silence since the previous song stopped
+    cancel()
+        Stops all pending resolutions
+    """
+    def __init__(self, get_extractor, streams, guild_id, depth=PREFETCH_DEPTH, audio_cache=None):
+        """
+        Args:
+            get_extractor (callable): returns the extraction.ExtractionService used to resolve the stream urls
+            streams (cache.TTLCache): shared cache mapping song keys to resolved streams
+            guild_id (int): server the prefetcher belongs to
+            depth (int, optional): number of upcoming songs to resolve. Defaults to PREFETCH_DEPTH.
+            audio_cache (audio_cache.AudioCache, optional): local files played instead of streams. Defaults to None.
+        """
+        # the pool imports yt_dlp when it is built, which players that never resolve a song do not need
+        self._get_extractor = get_extractor
+        self.audio_cache = audio_cache
+        self.streams = streams
+        self.guild_id = guild_id
+        self.depth = depth
+        self.tasks = {}
+        self._ended_at = None
+
+    @property
+    def extractor(self):
+        """
+        extraction.ExtractionService: used to resolve the stream urls, retrieved on first use
+        """
+        return self._get_extractor()
+
+    async def _resolve(self, song):
+        """
+        Resolves a song and caches its stream until shortly before the url expires
+
+        Args:
+            song (track.Track): queued song
+
+        Returns:
+            dict: info dict of the stream
+        """
+        key = song_key(song)
+        try:
+            source = await self.extractor.extract_info(song_url(song), guild_id=self.guild_id)
+            self.streams.set(key, source, expires=url_expiry(source['url']) - EXPIRY_MARGIN)
+            return source
+        finally:
+            self.tasks.pop(key, None)
+
+    def schedule(self, songs):
+        """
+        Starts resolving the first few upcoming songs
+
+        Args:
+            songs (iterable): upcoming tracks in play order
+        """
+        for song in itertools.islice(songs, self.depth):
+            key = song_key(song)
+            if self.audio_cache and song.id in self.audio_cache.files:
+                continue
+            if key not in self.tasks and key not in self.streams:
+                self.tasks[key] = asyncio.create_task(self._resolve(song))
+
+    async def get(self, song):
+        """
+        Returns the resolved stream for a song, resolving it now if necessary
+
+        Args:
+            song (track.Track): queued song
+
+        Returns:
+            dict: info dict of the stream
+        """
+        # cached songs play from disk without asking the origin for a stream
+        path = self.audio_cache.path(song) if self.audio_cache else None
+        if path is not None:
+            return local_source(song, path)
+        key = song_key(song)
+        task = self.tasks.get(key)
+        if task is not None:
+            try:
+                await task
+            except Exception:
+                pass
+        source = self.streams.get(key)
+        if source is None:
+            source = await self._resolve(song)
+        return source
+
+    def song_ended(self):
+        """
+        Marks the moment the current song stopped
+        """
+        self._ended_at = time.perf_counter()
+
+    def song_started(self):
+        """
+        Records the silence since the previous song stopped
+        """
+        if self._ended_at is not None:
+            histogram('song_gap_seconds').observe(time.perf_counter() - self._ended_at)
+            self._ended_at = None
+
+    def cancel(self):
+        """
+        Stops all pending resolutions
+        """
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
@@ -0,0 +1,236 @@
+import collections
+import math
+
+import discord
+
+from instrumentation import increment, timer
+
+# determines size of each page for queue command
+QUEUE_PAGE_SIZE = 10
+
+# number of queue messages per server whose buttons keep working
+TRACKED_MESSAGES = 8
+
+
+def song_field(index, song):
+    """
+    Formats a song as an embed field
+
+    Args:
+        index (int): position of the song as shown to users
+        song (track.Track): queued song
+
+    Returns:
+        tuple: name and value of the field
+    """
+    # assumes only soundcloud and youtube available
+    if song.ie_key == 'Soundcloud':
+        time_str = 'Soundcloud song'
+        title = song.url.split('/')[-1].replace('-', ' ')
+    else:
+        duration = song.duration or 0
+        hours = '' if duration < 3600 else f'{duration // 3600}:'
+        minutes = duration % 3600 // 60
+        minutes = minutes if duration < 3600 else f'{minutes:02}'
+        time_str = f"{hours}{minutes}:{duration % 60:02}"
+        title = song.title
+    return f"{index}. {title}", time_str
+
+
+class QueuePages:
+    """
+    Pages of a server's queue shared by all of its queue messages
+
+    Pages are rendered from the queue only when they are first shown and
+    kept until the queue's version changes, so flipping back and forth or
+    reposting the queue does not rebuild any embeds. Every queue message
+    gets its own small QueueView, and only the most recent messages keep
+    working buttons, so discord.py's view store does not grow with every
+    queue posted.
+
+    ...
+
+    Attributes
+    ----------
+    guild_id : int
+        id of the server
+    queue : music.SongQueue
+        the server's queue
+    page_size : int
+        number of songs per page
+    views : collections.OrderedDict
+        maps message ids to the views of the tracked messages, oldest message first
+
+    Methods
+    -------
+    page_count
+        Number of pages the queue fills
+    render(number)
+        Returns the embed of a page
+    view()
+        Creates the buttons for a new queue message
+    track(message, view)
+        Remembers a sent queue message, stopping the buttons of the oldest ones
+    stop()
+        Stops the buttons of every tracked message
+    """
+    def __init__(self, guild_id, queue, page_size=QUEUE_PAGE_SIZE):
+        """
+        Args:
+            guild_id (int): id of the server, which keeps the button ids apart from other servers'
+            queue (music.SongQueue): the server's queue
+            page_size (int, optional): number of songs per page. Defaults to QUEUE_PAGE_SIZE.
+        """
+        self.guild_id = guild_id
+        self.queue = queue
+        self.page_size = page_size
+        self.views = collections.OrderedDict()
+        self._version = None
+        self._rendered = {}
+
+    @property
+    def page_count(self):
+        """
+        int: number of pages the queue fills
+        """
+        return math.ceil(self.queue.qsize() / self.page_size)
+
+    def render(self, number):
+        """
+        Returns the embed of a page, rendering it only if the queue changed since it was last shown
+
+        Args:
+            number (int): page number starting from 1
+
+        Returns:
+            discord.Embed: the page
+        """
+        if self.queue.version != self._version:
+            self._rendered.clear()
+            self._version = self.queue.version
+        embed = self._rendered.get(number)
+        if embed is not None:
+            increment('queue_pages_total', result='cached')
+            return embed
+        increment('queue_pages_total', result='rendered')
+        embed = discord.Embed(title='Current song queue:', color=discord.Color.blue())
+        start = (number - 1) * self.page_size
+        # only the songs on the page are read from the queue
+        for index, song in enumerate(self.queue.page(start, start + self.page_size), start=start + 1):
+            name, value = song_field(index, song)
+            embed.add_field(name=name, value=value, inline=False)
+        embed.set_footer(text=f'Page {number}/{max(self.page_count, 1)}')
+        self._rendered[number] = embed
+        return embed
+
+    def view(self):
+        """
+        Creates the buttons for a new queue message, which shows the first page
+
+        Returns:
+            QueueView: the message's view
+        """
+        return QueueView(self)
+
+    def track(self, message, view):
+        """
+        Remembers a sent queue message, stopping the buttons of the oldest ones
+
+        Args:
+            message (discord.Message): queue message
+            view (QueueView): the view it was sent with
+        """
+        self.views[message.id] = view
+        while len(self.views) > TRACKED_MESSAGES:
+            # stopping removes the view's entries from discord.py's view store
+            self.views.popitem(last=False)[1].stop()
+
+    def stop(self):
+        """
+        Stops the buttons of every tracked message
+        """
+        for view in self.views.values():
+            view.stop()
+        self.views.clear()
+
+
+class QueueView(discord.ui.View):
+    """
+    Previous and next buttons of one queue message
+
+    Button presses are answered by editing the message in the interaction
+    response, which is the only API call a page flip makes. The view never
+    times out, so no task waits on it between presses; QueuePages stops it
+    once newer queue messages replace it.
+
+    ...
+
+    Attributes
+    ----------
+    pages : QueuePages
+        the server's shared pages
+    number : int
+        page the message shows
+
+    Methods
+    -------
+    flip(interaction, step)
+        Moves the message by step pages
+    """
+    def __init__(self, pages):
+        """
+        Args:
+            pages (QueuePages): the server's shared pages
+        """
+        super().__init__(timeout=None)
+        self.pages = pages
+        self.number = 1
+        self.previous.custom_id = f'queue:{pages.guild_id}:previous'
+        self.next.custom_id = f'queue:{pages.guild_id}:next'
+        self._version = pages.queue.version
+
+    async def flip(self, interaction, step):
+        """
+        Moves the message by step pages
+
+        Args:
+            interaction (discord.Interaction): the button press
+            step (int): -1 for the previous page, 1 for the next one
+        """
+        with timer('handler_seconds', handler='queue_page'):
+            pages = self.pages
+            count = pages.page_count
+            if count < 1:
+                await interaction.response.edit_message(content="Queue is empty! Add some songs first.", embed=None)
+                return
+            # the queue may have shrunk since the message was sent
+            number = min(max(min(self.number, count) + step, 1), count)
+            if number == self.number and self._version == pages.queue.version:
+                # nothing changed, so the press only has to be acknowledged
+                await interaction.response.defer()
+                return
+            self.number = number
+            self._version = pages.queue.version
+            await interaction.response.edit_message(embed=pages.render(number))
+
+    @discord.ui.button(emoji='\u25c0', style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction, button):
+        """
+        Shows the previous page
+
+        Args:
+            interaction (discord.Interaction): the button press
+            button (discord.ui.Button): the pressed button
+        """
+        await self.flip(interaction, -1)
+
+    @discord.ui.button(emoji='\u25b6', style=discord.ButtonStyle.secondary)
+    async def next(self, interaction, button):
+        """
+        Shows the next page
+
+        Args:
+            interaction (discord.Interaction): the button press
+            button (discord.ui.Button): the pressed button
+        """
+        await self.flip(interaction, 1)
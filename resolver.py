@@ -0,0 +1,134 @@
+import re
+from urllib.parse import parse_qs, urlsplit
+
+# youtube video ids are 11 url-safe base64 characters
+VIDEO_ID = re.compile(r'[\w-]{11}')
+
+# playlist ids are longer, eg. PL followed by 16 or 32 characters
+PLAYLIST_ID = re.compile(r'[\w-]{12,}')
+
+# start of the ids of mixes, the endless playlists youtube generates from a video
+MIX_PREFIX = 'RD'
+
+# hosts serving youtube videos, without a leading www. or m.
+YOUTUBE_HOSTS = {'youtube.com', 'music.youtube.com', 'youtube-nocookie.com'}
+
+# paths of youtube pages that carry the video id as their second part
+VIDEO_PATHS = {'shorts', 'embed', 'live', 'v'}
+
+# first parts of soundcloud paths that are pages rather than users
+SOUNDCLOUD_RESERVED = {'discover', 'search', 'stream', 'you', 'charts', 'pages', 'upload', 'settings'}
+
+
+class Query:
+    """
+    A classified query
+
+    ...
+
+    Attributes
+    ----------
+    kind : str
+        'video', 'playlist', 'soundcloud', 'soundcloud_set', 'id', 'link' or 'search'
+    key : str
+        identifies the resource however its link was written, or the search terms
+    url : str
+        canonical url handed to yt_dlp, or the search terms
+    """
+    __slots__ = ('kind', 'key', 'url')
+
+    def __init__(self, kind, key, url):
+        """
+        Args:
+            kind (str): kind of query
+            key (str): identifies the resource
+            url (str): canonical url or search terms
+        """
+        self.kind = kind
+        self.key = key
+        self.url = url
+
+    def __repr__(self):
+        return f'Query(kind={self.kind!r}, key={self.key!r})'
+
+
+def looks_like_video_id(word):
+    """
+    Decides whether a single word is more likely a youtube video id than a search term
+
+    Args:
+        word (str): the query
+
+    Returns:
+        bool: whether the word is shaped like a video id and is not plain lowercase text
+    """
+    if not VIDEO_ID.fullmatch(word):
+        return False
+    # words like "beautifully" match the pattern but are searches
+    return any(char.isdigit() or char in '-_' for char in word) or not (word.islower() or word.istitle())
+
+
+def classify(query):
+    """
+    Classifies a query and pulls out the ids of youtube and soundcloud links without any requests
+
+    Args:
+        query (str): search terms or link given by the user
+
+    Returns:
+        Query: kind, key and url of the query
+    """
+    query = query.strip()
+    # discord users wrap links in <> to hide their previews
+    if query.startswith('<') and query.endswith('>'):
+        query = query[1:-1]
+    if ' ' in query or not query:
+        return Query('search', query, query)
+    url = query if '://' in query else f'https://{query}'
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return Query('search', query, query)
+    host = (parts.hostname or '').lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = [part for part in parts.path.split('/') if part]
+    params = parse_qs(parts.query)
+
+    if host in YOUTUBE_HOSTS or host == 'youtu.be':
+        if host == 'youtu.be':
+            video = path[0] if path else ''
+        elif path[:1] == ['watch']:
+            video = params.get('v', [''])[0]
+        elif len(path) >= 2 and path[0] in VIDEO_PATHS:
+            video = path[1]
+        else:
+            video = ''
+        is_video = bool(VIDEO_ID.fullmatch(video))
+        # playlists take precedence over the video a link was opened from, like before
+        playlist = params.get('list', [''])[0]
+        if PLAYLIST_ID.fullmatch(playlist):
+            if playlist.startswith(MIX_PREFIX) and is_video:
+                # mixes are generated from the video they were opened from, which their page needs
+                return Query('playlist', f'{playlist}:{video}',
+                             f'https://www.youtube.com/watch?v={video}&list={playlist}')
+            return Query('playlist', playlist, f'https://www.youtube.com/playlist?list={playlist}')
+        if is_video:
+            return Query('video', video, f'https://www.youtube.com/watch?v={video}')
+        return Query('link', url, url)
+
+    if host == 'soundcloud.com' and path and path[0] not in SOUNDCLOUD_RESERVED:
+        if len(path) == 3 and path[1] == 'sets':
+            permalink = '/'.join(path).lower()
+            return Query('soundcloud_set', permalink, f'https://soundcloud.com/{permalink}')
+        if len(path) == 2 and path[1] not in ('sets', 'likes', 'tracks', 'albums', 'reposts'):
+            permalink = '/'.join(path).lower()
+            return Query('soundcloud', permalink, f'https://soundcloud.com/{permalink}')
+        return Query('link', url, url)
+
+    if '://' in query or '.' in host and path:
+        return Query('link', url, url)
+    if looks_like_video_id(query):
+        return Query('id', query, f'https://www.youtube.com/watch?v={query}')
+    return Query('search', query, query)
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import increment, timer
+from track import Track
+
+# path of the sqlite database holding the players' state; sessions are not kept when unset
+SESSION_DB = os.environ.get('SESSION_DB')
+
+# seconds between snapshots of the players that changed
+SNAPSHOT_INTERVAL = 30
+
+# sessions older than this many seconds are not restored
+SESSION_TTL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    guild_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL,
+    saved REAL NOT NULL
+);
+"""
+
+
+def pack_track(track):
+    """
+    Converts a track to the list stored in a session
+
+    Args:
+        track (track.Track): queued song
+
+    Returns:
+        list: the track's fields, leaving out youtube urls that the id rebuilds
+    """
+    url = track.url
+    if url == f'https://www.youtube.com/watch?v={track.id}':
+        url = None
+    return [track.id, track.ie_key, url, track.title, track.duration]
+
+
+def unpack_track(fields):
+    """
+    Rebuilds a track from the list stored in a session
+
+    Args:
+        fields (list): fields produced by pack_track
+
+    Returns:
+        track.Track: the track
+    """
+    video_id, ie_key, url, title, duration = fields
+    return Track(video_id, ie_key, url or f'https://www.youtube.com/watch?v={video_id}', title, duration)
+
+
+class SessionStore:
+    """
+    SQLite file of every server's queue, current song and settings, so a restart does not lose them
+
+    Snapshots are incremental: a player is only serialized again when its
+    queue version or settings changed since it was last written, and each
+    server is one compressed row. Sessions are restored lazily, one server
+    at a time when it next uses the bot, so startup does not read any of
+    them.
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+        location of the sqlite database
+
+    Methods
+    -------
+    take(guild_id)
+        Returns a server's saved session the first time it is asked for
+    save(guild_id, signature, build)
+        Buffers a server's state if it changed since it was last saved
+    forget(guild_id)
+        Deletes a server's session, for players that stopped on purpose
+    run(collect, interval=SNAPSHOT_INTERVAL)
+        Collects and writes the changed sessions periodically
+    flush()
+        Writes all buffered sessions
+    close()
+        Flushes and closes the database
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): location of the sqlite database
+        """
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-store')
+        self._conn = None
+        # maps server ids to the signature of their last saved state
+        self._signatures = {}
+        self._pending = {}
+        self._taken = set()
+        self._closed = False
+
+    def _connect(self):
+        """
+        Opens the database on first use; only called from the store's thread
+
+        Returns:
+            sqlite3.Connection: the open connection
+        """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    async def _run(self, func, *args):
+        """
+        Runs a database function on the store's thread
+
+        Args:
+            func (callable): function taking the connection as its first argument
+
+        Returns:
+            the function's result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._connect(), *args))
+
+    @staticmethod
+    def _load(conn, guild_id):
+        """
+        Reads a server's session
+
+        Args:
+            conn (sqlite3.Connection): open connection
+            guild_id (int): id of the server
+
+        Returns:
+            dict: the session, or None if there is none or it is too old
+        """
+        row = conn.execute('SELECT data, saved FROM sessions WHERE guild_id = ?', (guild_id,)).fetchone()
+        if row is None or time.time() - row[1] > SESSION_TTL:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    async def take(self, guild_id):
+        """
+        Returns a server's saved session the first time it is asked for, and None afterwards
+
+        Args:
+            guild_id (int): id of the server
+
+        Returns:
+            dict: session with 'current' and 'songs' as lists of tracks, 'loop', 'volume' and 'channel',
+            or None if there is nothing to restore
+        """
+        if self._closed or guild_id in self._taken:
+            return None
+        self._taken.add(guild_id)
+        with timer('session_restore_seconds'):
+            session = await self._run(self._load, guild_id)
+        if session is None:
+            return None
+        increment('sessions_restored_total')
+        session['current'] = unpack_track(session['current']) if session['current'] else None
+        session['songs'] = [unpack_track(fields) for fields in session['songs']]
+        return session
+
+    def save(self, guild_id, signature, build):
+        """
+        Buffers a server's state if it changed since it was last saved
+
+        Args:
+            guild_id (int): id of the server
+            signature (tuple): changes whenever the state does
+            build (callable): returns the state as a dict with 'current' and 'songs' as tracks
+        """
+        if self._closed or self._signatures.get(guild_id) == signature:
+            return
+        self._signatures[guild_id] = signature
+        # a restarted server must not get its older session back
+        self._taken.add(guild_id)
+        state = build()
+        state['current'] = pack_track(state['current']) if state['current'] else None
+        state['songs'] = [pack_track(track) for track in state['songs']]
+        self._pending[guild_id] = zlib.compress(json.dumps(state, separators=(',', ':')).encode())
+
+    def forget(self, guild_id):
+        """
+        Deletes a server's session, for players that stopped on purpose
+
+        Args:
+            guild_id (int): id of the server
+        """
+        if self._closed:
+            return
+        self._signatures.pop(guild_id, None)
+        self._taken.add(guild_id)
+        self._pending[guild_id] = None
+
+    def _write(self, conn, sessions):
+        """
+        Commits a batch of sessions
+
+        Args:
+            conn (sqlite3.Connection): open connection
+            sessions (dict): maps server ids to compressed sessions, or None for deleted ones
+        """
+        now = time.time()
+        conn.executemany('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                         [(guild_id, data, now) for guild_id, data in sessions.items() if data is not None])
+        conn.executemany('DELETE FROM sessions WHERE guild_id = ?',
+                         [(guild_id,) for guild_id, data in sessions.items() if data is None])
+        conn.commit()
+
+    async def flush(self):
+        """
+        Writes all buffered sessions
+        """
+        if not self._pending:
+            return
+        sessions, self._pending = self._pending, {}
+        increment('sessions_saved_total', sum(1 for data in sessions.values() if data is not None))
+        with timer('session_snapshot_seconds'):
+            await self._run(self._write, sessions)
+
+    async def run(self, collect, interval=SNAPSHOT_INTERVAL):
+        """
+        Collects and writes the changed sessions periodically
+
+        Args:
+            collect (callable): calls save for every player
+            interval (float, optional): seconds between snapshots. Defaults to SNAPSHOT_INTERVAL.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            collect()
+            try:
+                await self.flush()
+            except sqlite3.Error as error:
+                print(f'Could not save sessions to {self.path}: {error}')
+
+    async def close(self):
+        """
+        Flushes and closes the database
+        """
+        await self.flush()
+        self._closed = True
+        if self._conn is not None:
+            await self._run(lambda conn: conn.close())
+            self._conn = None
+        self._executor.shutdown(wait=True)
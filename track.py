@@ -0,0 +1,70 @@
+class Track:
+    """
+    Compact representation of a queued song
+
+    yt_dlp entries carry formats, thumbnails and many other fields that the
+    queue never uses, so only the handful of fields needed for playback and
+    the queue display are kept.
+
+    ...
+
+    Attributes
+    ----------
+    id : str
+        video id
+    ie_key : str
+        name of the yt_dlp extractor that produced the entry (eg. 'Youtube', 'Soundcloud')
+    url : str
+        page url of the song
+    title : str
+        title of the song
+    duration : int
+        length of the song in seconds, or None if unknown
+
+    Methods
+    -------
+    from_entry(entry)
+        Builds a track from a yt_dlp entry
+    """
+    __slots__ = ('id', 'ie_key', 'url', 'title', 'duration')
+
+    def __init__(self, id, ie_key, url, title, duration):
+        """
+        Args:
+            id (str): video id
+            ie_key (str): name of the yt_dlp extractor that produced the entry
+            url (str): page url of the song
+            title (str): title of the song
+            duration (int): length of the song in seconds, or None if unknown
+        """
+        self.id = id
+        self.ie_key = ie_key
+        self.url = url
+        self.title = title
+        self.duration = duration
+
+    @classmethod
+    def from_entry(cls, entry):
+        """
+        Builds a track from a yt_dlp entry
+
+        Works for both flat playlist/search entries and fully extracted videos.
+
+        Args:
+            entry (dict): entry produced by yt_dlp
+
+        Returns:
+            Track: the compact track
+        """
+        duration = entry.get('duration')
+        return cls(
+            entry.get('id'),
+            entry.get('ie_key') or entry.get('extractor_key'),
+            # fully extracted videos store the stream in 'url' and the page in 'webpage_url'
+            entry.get('webpage_url') or entry.get('url'),
+            entry.get('title'),
+            None if duration is None else int(duration)
+        )
+
+    def __repr__(self):
+        return f'Track(id={self.id!r}, title={self.title!r})'
@@ -0,0 +1,87 @@
+class HumanCounter:
+    """
+    Keeps a count of the human members in the voice channels the bot is in
+
+    Counts are seeded from the gateway's member cache when the bot joins a
+    channel and then adjusted from voice state events, so deciding whether
+    anyone is left is a dictionary lookup instead of a pass over the channel.
+
+    ...
+
+    Attributes
+    ----------
+    counts : dict
+        maps tracked voice channel ids to their number of human members
+
+    Methods
+    -------
+    track(channel)
+        Starts counting the humans in a channel
+    forget(channel_id)
+        Stops counting a channel
+    update(member, before, after)
+        Adjusts the counts for a voice state change
+    humans(channel)
+        Returns the number of humans in a channel
+    """
+    def __init__(self):
+        self.counts = {}
+
+    def track(self, channel):
+        """
+        Starts counting the humans in a channel using the cached members
+
+        Args:
+            channel (discord.VoiceChannel): channel the bot is in
+
+        Returns:
+            int: the number of humans in the channel
+        """
+        count = sum(1 for member in channel.members if not member.bot)
+        self.counts[channel.id] = count
+        return count
+
+    def forget(self, channel_id):
+        """
+        Stops counting a channel
+
+        Args:
+            channel_id (int): id of the channel
+        """
+        self.counts.pop(channel_id, None)
+
+    def update(self, member, before, after):
+        """
+        Adjusts the counts for a voice state change
+
+        Args:
+            member (discord.Member): the user
+            before (discord.VoiceState): the previous voice state of the user
+            after (discord.VoiceState): the resulting voice state of the user
+        """
+        if member.bot:
+            return
+        before_id = before.channel.id if before.channel else None
+        after_id = after.channel.id if after.channel else None
+        # mutes, deafens, etc. do not change channels
+        if before_id == after_id:
+            return
+        if before_id in self.counts:
+            self.counts[before_id] = max(self.counts[before_id] - 1, 0)
+        if after_id in self.counts:
+            self.counts[after_id] += 1
+
+    def humans(self, channel):
+        """
+        Returns the number of humans in a channel, counting it from the cache if it is not tracked yet
+
+        Args:
+            channel (discord.VoiceChannel): channel the bot is in
+
+        Returns:
+            int: the number of humans in the channel
+        """
+        count = self.counts.get(channel.id)
+        if count is None:
+            count = self.track(channel)
+        return count